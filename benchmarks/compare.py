@@ -0,0 +1,97 @@
+import argparse
+import json
+import logging
+
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, str, int, str]
+
+
+def load(path: Path) -> Dict[Key, Dict[str, Any]]:
+    """Read timings written by `benchmarks.run`, keyed by what was timed"""
+    report = json.loads(path.read_text())
+    return {
+        (
+            result["suite"],
+            result["stage"],
+            result["size"],
+            json.dumps(result["parameters"], sort_keys=True),
+        ): result
+        for result in report["results"]
+    }
+
+
+def compare(
+    baseline: Dict[Key, Dict[str, Any]],
+    contender: Dict[Key, Dict[str, Any]],
+    statistic: str = "best",
+) -> List[Tuple[Key, float, float, float]]:
+    """Pair up the timings both runs have
+
+    Returns:
+        List[Tuple[Key, float, float, float]]: What was timed, the baseline's and contender's seconds, and how many times faster the contender is
+    """
+    return [
+        (
+            key,
+            baseline[key][statistic],
+            contender[key][statistic],
+            baseline[key][statistic] / contender[key][statistic],
+        )
+        for key in baseline
+        if key in contender
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare two sets of timings from `python -m benchmarks.run`"
+    )
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("contender", type=Path)
+    parser.add_argument(
+        "-s",
+        "--statistic",
+        choices=["best", "median"],
+        default="best",
+        help="Which of each stage's timings to compare. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Mark stages that are this fraction slower or faster. Defaults to %(default)s",
+    )
+    args = parser.parse_args()
+
+    baseline, contender = load(args.baseline), load(args.contender)
+    print(
+        f"{'suite':<5} {'stage':<40} {'size':>10} {'baseline':>10} {'contender':>10} {'speedup':>8}"
+    )
+    for (suite, stage, size, _), before, after, speedup in compare(
+        baseline, contender, statistic=args.statistic
+    ):
+        if speedup < 1 - args.threshold:
+            mark = "slower"
+        elif speedup > 1 + args.threshold:
+            mark = "faster"
+        else:
+            mark = ""
+        print(
+            f"{suite:<5} {stage:<40} {size:>10} {before:>9.4f}s {after:>9.4f}s {speedup:>7.2f}x {mark}"
+        )
+
+    for name, only in [
+        (args.baseline, baseline.keys() - contender.keys()),
+        (args.contender, contender.keys() - baseline.keys()),
+    ]:
+        for suite, stage, size, _ in sorted(only):
+            print(f"Only in {name}: {suite} {stage} {size}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import logging
+import struct
+
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# The tracker writes 24 columns. Only X_Position, Y_Position (4, 5) and Frame (7) are read
+TRACKER_COLUMNS = 24
+# The tracker ends each file with a few empty rows
+TRAILING_ROWS = 5
+# Write this many rows at a time, to keep memory bounded for big files
+ROWS_PER_CHUNK = 1_000_000
+
+
+def tracker_csvs(
+    folder: Path,
+    rows: int,
+    filename: str = "benchmark",
+    frame_rate_mismatch: float = 0.03,
+    seed: int = 0,
+) -> Dict[str, Path]:
+    """Write substrate_, reference_ and pipette_<filename>.csv, shaped like the tracker's output.
+
+    The reference gets `rows` frames. The substrate and pipette cover the same experiment in `frame_rate_mismatch` fewer frames,
+    as they do when the tracker drops frames, so that resampling has to line up streams at different rates.
+
+    Args:
+        folder (Path): Where to write them
+        rows (int): Rows in the reference CSV
+        filename (str): What csv-analyser's `--filename-contains` should be
+        frame_rate_mismatch (float): The fraction of frames the substrate and pipette have fewer of
+        seed (int): The same seed always gives the same files
+
+    Returns:
+        Dict[str, Path]: The paths, keyed by `substrate`, `reference` and `pipette`
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    frames = {
+        "reference": rows,
+        "substrate": int(rows * (1 - frame_rate_mismatch)),
+        "pipette": int(rows * (1 - frame_rate_mismatch)),
+    }
+    # Roughly where each of them sits in the real recordings, in pixels
+    positions = {
+        "reference": (320, 174),
+        "substrate": (382, 237),
+        "pipette": (240, 1356),
+    }
+
+    paths = {}
+    for name, n in frames.items():
+        path = folder / f"{name}_{filename}.csv"
+        x, y = positions[name]
+        with path.open("w", newline="", encoding="utf-8-sig") as file:
+            for first in range(0, n, ROWS_PER_CHUNK):
+                frame = np.arange(first, min(first + ROWS_PER_CHUNK, n))
+                _tracker_rows(
+                    frame=frame,
+                    x=x + np.cumsum(rng.normal(0, 0.05, len(frame))),
+                    y=y + np.cumsum(rng.normal(0, 0.05, len(frame))),
+                    rng=rng,
+                ).to_csv(file, header=False, index=False)
+            file.write((",".join([""] * TRACKER_COLUMNS) + "\n") * TRAILING_ROWS)
+        logger.debug(f"Wrote {n} rows to {path.as_posix()}")
+        paths[name] = path
+    return paths
+
+
+def _tracker_rows(
+    frame: np.ndarray, x: np.ndarray, y: np.ndarray, rng: np.random.Generator
+) -> pd.DataFrame:
+    df = pd.DataFrame(
+        {column: "" for column in range(TRACKER_COLUMNS)}, index=range(len(frame))
+    )
+    df[0] = [f"ID{i}" for i in frame]
+    df[1] = frame
+    df[2] = 5
+    df[3] = rng.uniform(0.5, 0.7, len(frame)).round(3)
+    df[4] = x.round(3)
+    df[5] = y.round(3)
+    df[6] = 0
+    df[7] = frame
+    df[8] = frame
+    return df
+
+
+def tiff_folder(
+    folder: Path, frames: int, size: int = 256, seed: int = 0, kind: str = "noise"
+) -> List[Path]:
+    """Write `frames` uncompressed 8-bit greyscale TIFFs, named image00000.tif onwards
+
+    Args:
+        kind (str): "noise", which doesn't compress at all, or "dark": a dim, noisy background with a few bright beads,
+            which compresses about as well as the microscope's frames do
+
+    Returns:
+        List[Path]: The TIFFs, in order
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for frame in range(frames):
+        path = folder / f"image{frame:05}.tif"
+        if kind == "noise":
+            pixels = rng.integers(0, 256, (size, size), dtype=np.uint8)
+        else:
+            pixels = _dark_frame(rng, size)
+        path.write_bytes(_tiff(pixels))
+        paths.append(path)
+    logger.debug(f"Wrote {frames} TIFFs to {folder.as_posix()}")
+    return paths
+
+
+def _dark_frame(rng: np.random.Generator, size: int, beads: int = 5) -> np.ndarray:
+    rows, columns = np.mgrid[0:size, 0:size]
+    pixels = rng.poisson(3, (size, size)).astype(float)
+    for row, column in rng.uniform(0, size, (beads, 2)):
+        pixels += 200 * np.exp(-((rows - row) ** 2 + (columns - column) ** 2) / 18)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def _tiff(pixels: np.ndarray) -> bytes:
+    # A little-endian baseline TIFF: header, pixels, then a single IFD describing them
+    height, width = pixels.shape
+    data = pixels.tobytes()
+    ifd_offset = 8 + len(data)
+    entries = [
+        (256, 3, 1, width),  # ImageWidth
+        (257, 3, 1, height),  # ImageLength
+        (258, 3, 1, 8),  # BitsPerSample
+        (259, 3, 1, 1),  # Compression: none
+        (262, 3, 1, 1),  # PhotometricInterpretation: black is zero
+        (273, 4, 1, 8),  # StripOffsets
+        (277, 3, 1, 1),  # SamplesPerPixel
+        (278, 3, 1, height),  # RowsPerStrip
+        (279, 4, 1, len(data)),  # StripByteCounts
+    ]
+    ifd = struct.pack("<H", len(entries))
+    for tag, kind, count, value in entries:
+        # Values shorter than 4 bytes are left-justified in the value field
+        packed = (
+            struct.pack("<H", value) + b"\0\0"
+            if kind == 3
+            else struct.pack("<I", value)
+        )
+        ifd += struct.pack("<HHI", tag, kind, count) + packed
+    ifd += struct.pack("<I", 0)  # No more IFDs
+    return b"II*\0" + struct.pack("<I", ifd_offset) + data + ifd
@@ -0,0 +1,451 @@
+import argparse
+import datetime
+import importlib.util
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from phd_utils import csv_analyser, results, tiff_stacker
+
+from . import generate
+
+logger = logging.getLogger(__name__)
+
+# Roughly the tracker's, so the resampled output grows with the CSVs as it does for real experiments
+FRAME_RATE = 140  # frames per second
+RESAMPLE_TO = pd.Timedelta(0.009, "seconds")
+
+FORCE_MODEL = dict(
+    initial_x_displacement=1.5,
+    initial_substrate_tip_position=1300.0,
+    length_of_substrate=2000.0,
+    stiffness_constant_of_substrate=0.5,
+    stiffness_constant_of_pipette=0.6,
+    reverse_sliding_direction=False,
+    angle_alpha=0.1,
+    angle_beta=0.2,
+    substrate_tip_velocity=2.0,
+    flexural_rigidity=3e-12,
+)
+
+
+def time_stage(
+    function: Callable[[], Any], repeat: int, setup: Callable[[], None] = lambda: None
+) -> Tuple[List[float], Any]:
+    """Run `function` `repeat` times, calling `setup` (untimed) before each
+
+    Returns:
+        Tuple[List[float], Any]: Seconds taken by each run, and what the last run returned
+    """
+    seconds = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        returned = function()
+        seconds.append(time.perf_counter() - start)
+    return seconds, returned
+
+
+def record(
+    suite: str, stage: str, size: int, seconds: List[float], **parameters
+) -> Dict[str, Any]:
+    logger.info(
+        f"{suite:>4} {stage:<40} {size:>10} {min(seconds):10.4f}s (best of {len(seconds)})"
+    )
+    return dict(
+        suite=suite,
+        stage=stage,
+        size=size,
+        parameters=parameters,
+        seconds=seconds,
+        best=min(seconds),
+        median=statistics.median(seconds),
+    )
+
+
+def benchmark_csv(
+    rows: int,
+    frame_rate_mismatch: float,
+    repeat: int,
+    data_dir: Path,
+    work_dir: Path,
+    resample_engines: List[str],
+    output_formats: List[str],
+) -> List[Dict[str, Any]]:
+    """Time each stage of csv-analyser on synthetic tracker CSVs with `rows` rows"""
+    folder = data_dir / f"csv-{rows}-{frame_rate_mismatch}"
+    if not folder.is_dir():
+        logger.info(f"Generating tracker CSVs with {rows} rows")
+        generate.tracker_csvs(
+            folder, rows=rows, frame_rate_mismatch=frame_rate_mismatch
+        )
+    paths = {
+        name: folder / f"{name}_benchmark.csv"
+        for name in ["substrate", "reference", "pipette"]
+    }
+    parameters = dict(frame_rate_mismatch=frame_rate_mismatch)
+    records = []
+
+    streams = {}
+    for name, path in paths.items():
+        seconds, streams[name] = time_stage(
+            lambda: csv_analyser.read_displacement_csv(path), repeat
+        )
+        records.append(
+            record("csv", f"read_displacement_csv[{name}]", rows, seconds, **parameters)
+        )
+
+    for engine in resample_engines:
+        seconds, merged = time_stage(
+            lambda: csv_analyser.merge_and_displace_frames(
+                **streams,
+                experiment_duration=pd.Timedelta(rows / FRAME_RATE, "seconds"),
+                duration_of_resampled_row=RESAMPLE_TO,
+                engine=engine,
+            ),
+            repeat,
+        )
+        records.append(
+            record(
+                "csv",
+                f"merge_and_displace_frames[{engine}]",
+                rows,
+                seconds,
+                **parameters,
+            )
+        )
+
+    seconds, result = time_stage(
+        lambda: csv_analyser.generate_normal_force_and_correct_for_load_positioning(
+            df=merged, **FORCE_MODEL
+        ),
+        repeat,
+    )
+    records.append(record("csv", "force_model", rows, seconds, **parameters))
+
+    for output_format in output_formats:
+        output_file = work_dir / f"processed.{output_format}"
+        seconds, _ = time_stage(
+            lambda: results.write_result(result, output_file, output_format), repeat
+        )
+        records.append(
+            record("csv", f"write_result[{output_format}]", rows, seconds, **parameters)
+        )
+        output_file.unlink()
+
+    return records
+
+
+def benchmark_tiff(
+    frames: int,
+    files_per_stack: int,
+    size: int,
+    repeat: int,
+    data_dir: Path,
+    work_dir: Path,
+    engines: List[str],
+    compressions: List[str] = ["none"],
+    levels: List[int] = [6],
+    kind: str = "noise",
+) -> List[Dict[str, Any]]:
+    """Time tiff-stacker on a folder of `frames` synthetic TIFFs, with each of the `engines`,
+    and the native engine with each of the `compressions` at each of the `levels`"""
+    source = data_dir / f"tiff-{frames}-{size}" / kind
+    if not source.is_dir():
+        logger.info(f"Generating {frames} TIFFs")
+        generate.tiff_folder(source, frames=frames, size=size, kind=kind)
+    tifs = sorted(source.glob("*.tif"))
+    parameters = dict(files_per_stack=files_per_stack, image_size=size)
+    if kind != "noise":
+        # Only when it isn't the default, so that earlier results still compare
+        parameters["image_kind"] = kind
+    folder = work_dir / "tiffs"
+
+    def fresh_copy():
+        # `stack_in_folders` deletes what it stacks
+        shutil.rmtree(folder, ignore_errors=True)
+        shutil.copytree(source, folder)
+
+    records = []
+    with open(os.devnull, "w") as devnull:
+        for engine in engines:
+            destination = work_dir / "stack.tif"
+            seconds, _ = time_stage(
+                lambda: tiff_stacker.stack_tifs(
+                    sources=tifs[:files_per_stack],
+                    destination=destination,
+                    imagemagick_stderr=devnull,
+                    engine=engine,
+                ),
+                repeat,
+            )
+            records.append(
+                record(
+                    "tiff",
+                    f"stack_tifs[{engine}]",
+                    min(files_per_stack, frames),
+                    seconds,
+                    **parameters,
+                )
+            )
+            destination.unlink()
+
+            seconds, _ = time_stage(
+                lambda: tiff_stacker.stack_in_folders(
+                    folders=[folder],
+                    files_per_stack=files_per_stack,
+                    imagemagick_stderr=devnull,
+                    engine=engine,
+                ),
+                repeat,
+                setup=fresh_copy,
+            )
+            records.append(
+                record(
+                    "tiff", f"stack_in_folders[{engine}]", frames, seconds, **parameters
+                )
+            )
+            shutil.rmtree(folder)
+
+        compressed = [
+            (name, level) for name in compressions if name != "none" for level in levels
+        ]
+        for compression, level in compressed:
+            destination = work_dir / "stack.tif"
+            seconds, _ = time_stage(
+                lambda: tiff_stacker.stack_tifs(
+                    sources=tifs[:files_per_stack],
+                    destination=destination,
+                    imagemagick_stderr=devnull,
+                    compression=tiff_stacker.Compression(
+                        compression, level=level, threads=os.cpu_count() or 1
+                    ),
+                ),
+                repeat,
+            )
+            records.append(
+                record(
+                    "tiff",
+                    f"stack_tifs[native,{compression}-{level}]",
+                    min(files_per_stack, frames),
+                    seconds,
+                    **parameters,
+                )
+            )
+            # Not a parameter, as it is a result
+            records[-1]["stack_bytes"] = destination.stat().st_size
+            original = sum(path.stat().st_size for path in tifs[:files_per_stack])
+            logger.info(
+                f"{compression} at level {level} stacks to {records[-1]['stack_bytes'] / original:.1%} of the size"
+            )
+            destination.unlink()
+
+    return records
+
+
+def environment() -> Dict[str, Any]:
+    """What the benchmarks ran on, so that runs on different machines aren't compared unknowingly"""
+    return dict(
+        timestamp=datetime.datetime.now().isoformat(timespec="seconds"),
+        python=sys.version.split()[0],
+        numpy=np.__version__,
+        pandas=pd.__version__,
+        platform=platform.platform(),
+        processor=platform.processor(),
+        cpus=os.cpu_count(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+    Time each stage of csv-analyser and tiff-stacker on synthetic data, and write the timings to a JSON file.
+    Compare two of those files with `python -m benchmarks.compare`.
+
+    Generated data is kept in --data-dir, so later runs don't need to generate it again.
+    """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        required=True,
+        help="Where to write the timings, as JSON",
+    )
+    parser.add_argument(
+        "-s",
+        "--suite",
+        choices=["csv", "tiff"],
+        nargs="+",
+        default=["csv", "tiff"],
+        help="What to benchmark. Defaults to both",
+    )
+    parser.add_argument(
+        "-r",
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000],
+        help="Sizes of tracker CSVs to benchmark csv-analyser with. Defaults to %(default)s (we record up to 10M)",
+    )
+    parser.add_argument(
+        "-m",
+        "--frame-rate-mismatch",
+        type=float,
+        default=0.03,
+        help="The fraction of frames the substrate and pipette CSVs have fewer of than the reference. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-e",
+        "--resample-engine",
+        choices=["pandas", "numpy"],
+        nargs="+",
+        default=["pandas", "numpy"],
+    )
+    parser.add_argument(
+        "-F",
+        "--output-format",
+        choices=results.FORMATS,
+        nargs="+",
+        default=["csv"],
+        help="Formats to time writing the result in. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-t",
+        "--frames",
+        type=int,
+        nargs="+",
+        default=[100, 1_000],
+        help="Numbers of TIFFs to benchmark tiff-stacker with. Defaults to %(default)s (we record up to 100k)",
+    )
+    parser.add_argument(
+        "-f",
+        "--files-per-stack",
+        type=int,
+        default=2000,
+        help="As tiff-stacker's. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-E",
+        "--tiff-engine",
+        choices=["native", "imagemagick"],
+        nargs="+",
+        default=["native", "imagemagick"],
+    )
+    parser.add_argument(
+        "-Z",
+        "--tiff-compression",
+        choices=["none", "deflate", "zstd"],
+        nargs="+",
+        default=["none", "deflate"],
+        help="Compressions to time the native engine with, as well as without. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--tiff-compression-level",
+        type=int,
+        nargs="+",
+        default=[1, 6],
+        help="Levels to time each compression at. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--image-kind",
+        choices=["noise", "dark"],
+        default="noise",
+        help="What the generated TIFFs look like. Noise doesn't compress; dark is like the microscope's frames. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--image-size",
+        type=int,
+        default=256,
+        help="Width and height of each generated TIFF, in pixels. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=3,
+        help="How many times to run each stage. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-d",
+        "--data-dir",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "phd_utils-benchmarks",
+        help="Where to keep generated data. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        type=lambda x: getattr(logging, x.upper()),
+        default=logging.INFO,
+        help="How verbose to be",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    # Only our own timings, not every stage's progress
+    logging.getLogger("phd_utils").setLevel(max(args.log_level, logging.WARNING))
+
+    logger.debug(f"Arguments: {args}")
+
+    records = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        if "csv" in args.suite:
+            for rows in args.rows:
+                records.extend(
+                    benchmark_csv(
+                        rows=rows,
+                        frame_rate_mismatch=args.frame_rate_mismatch,
+                        repeat=args.repeat,
+                        data_dir=args.data_dir,
+                        work_dir=Path(work_dir),
+                        resample_engines=args.resample_engine,
+                        output_formats=args.output_format,
+                    )
+                )
+        if "tiff" in args.suite:
+            engines = args.tiff_engine
+            if "imagemagick" in engines and shutil.which("convert") is None:
+                logger.warning("Skipping the imagemagick engine, as it isn't installed")
+                engines = [engine for engine in engines if engine != "imagemagick"]
+            compressions = args.tiff_compression
+            if "zstd" in compressions and importlib.util.find_spec("zstandard") is None:
+                logger.warning("Skipping zstd, as zstandard isn't installed")
+                compressions = [name for name in compressions if name != "zstd"]
+            for frames in args.frames:
+                records.extend(
+                    benchmark_tiff(
+                        frames=frames,
+                        files_per_stack=args.files_per_stack,
+                        size=args.image_size,
+                        repeat=args.repeat,
+                        data_dir=args.data_dir,
+                        work_dir=Path(work_dir),
+                        engines=engines,
+                        compressions=compressions,
+                        levels=args.tiff_compression_level,
+                        kind=args.image_kind,
+                    )
+                )
+
+    args.output.write_text(
+        json.dumps(dict(environment=environment(), results=records), indent=2)
+    )
+    logger.info(f"Wrote {len(records)} timings to {args.output.as_posix()}")
+
+
+if __name__ == "__main__":
+    main()
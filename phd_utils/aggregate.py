@@ -0,0 +1,327 @@
+import argparse
+import json
+import logging
+import sys
+import warnings
+
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import csv_analyser, results
+from .discovery import natural_key
+
+logger = logging.getLogger(__name__)
+
+METRICS = csv_analyser.FORCE_COLUMNS
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+class RunningStats:
+    """Mean and standard deviation of each element of equally shaped arrays, added one at a time (Welford's algorithm),
+    so memory doesn't grow with how many are added. NaNs are left out, element by element
+    """
+
+    def __init__(self, shape: Tuple[int, ...]):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        # Sum of squared differences from the mean
+        self._m2 = np.zeros(shape)
+
+    def add(self, values: np.ndarray):
+        present = ~np.isnan(values)
+        self.count += present
+        delta = np.where(present, values - self.mean, 0)
+        self.mean += np.divide(
+            delta, self.count, out=np.zeros_like(delta), where=present
+        )
+        self._m2 += np.where(present, delta * (values - self.mean), 0)
+
+    def std(self) -> np.ndarray:
+        """The sample standard deviation (as pandas'), or NaN where fewer than two values were added"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                self.count > 1, np.sqrt(self._m2 / (self.count - 1)), np.nan
+            )
+
+
+def find_results(folder: Path, pattern: str = "*") -> List[Path]:
+    """The processed_<pattern>.<format> results in a folder, in natural order of their ids"""
+    return sorted(
+        (
+            path
+            for path in folder.glob(f"processed_{pattern}.*")
+            if path.suffix.lstrip(".") in results.FORMATS
+        ),
+        key=lambda path: natural_key(path.name),
+    )
+
+
+def experiment_id(path: Path) -> str:
+    """The `--filename-contains` a result was made with"""
+    return path.stem[len("processed_") :]
+
+
+def aggregate(
+    paths: Sequence[Path],
+    directory: Path,
+    interval: Optional[pd.Timedelta] = None,
+    duration: Optional[pd.Timedelta] = None,
+    metrics: Sequence[str] = METRICS,
+    quantiles: Sequence[float] = QUANTILES,
+    output_format: str = "csv",
+    rows_per_chunk: int = 10_000,
+) -> pd.DataFrame:
+    """Put many experiments' results on one time grid, and summarise each metric across them at every instant.
+    Results are read one at a time, and written straight into a memory-mapped array, so memory doesn't grow with how many there are.
+    Results shorter than the grid are padded with NaN, and longer ones cut short.
+
+    `directory` gets
+    - values.npy: (experiments, instants, metrics)
+    - experiments.csv: the id and path of each experiment
+    - instants.npy: the time of each instant, in nanoseconds
+    - metrics.json: the metrics' names
+    - summary.<output_format>: mean, std, count and `quantiles` of each metric at each instant (see `summarise`)
+
+    Args:
+        paths (Sequence[Path]): Results written by `analyse_csv`, in any of `results.FORMATS`
+        directory (Path): Where to write the aggregate
+        interval (Optional[pd.Timedelta]): The `--resample-to` the results were made with.
+            Defaults to the spacing of the first result with at least two rows
+        duration (Optional[pd.Timedelta]): How long the grid is. Defaults to the longest result,
+            which means reading each result's instants first
+        metrics (Sequence[str]): Columns to aggregate
+        quantiles (Sequence[float]): Quantiles to summarise with, each between 0 and 1
+        output_format (str): One of `results.FORMATS`, for the summary
+        rows_per_chunk (int): How many instants to take quantiles of at once. Lower this to use less memory
+
+    Returns:
+        pd.DataFrame: The summary
+    """
+    assert len(paths) > 0, "No results to aggregate"
+    metrics = list(metrics)
+    if interval is None:
+        for path in paths:
+            instants = results.read_result(path, columns=[]).index
+            if len(instants) > 1:
+                interval = instants[1] - instants[0]
+                break
+        assert (
+            interval is not None
+        ), "No result has two rows to find the interval from, so give it (`--resample-to`)"
+    if duration is None:
+        duration = max(
+            results.read_result(path, columns=[]).index[-1] for path in paths
+        )
+    instants = pd.timedelta_range(
+        0, periods=duration // interval + 1, freq=interval, name="Instant"
+    )
+    logger.info(
+        f"Aggregating {len(paths)} experiments onto {len(instants)} instants of {interval}"
+    )
+
+    directory.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(
+        {
+            "Experiment": [experiment_id(path) for path in paths],
+            "Path": [path.as_posix() for path in paths],
+        }
+    ).to_csv(directory / "experiments.csv", index=False)
+    np.save(directory / "instants.npy", instants.asi8)
+    (directory / "metrics.json").write_text(json.dumps(metrics))
+    values = np.lib.format.open_memmap(
+        directory / "values.npy",
+        mode="w+",
+        shape=(len(paths), len(instants), len(metrics)),
+    )
+
+    stats = RunningStats((len(instants), len(metrics)))
+    for number, path in enumerate(paths):
+        df = results.read_result(path, columns=metrics)
+        positions = df.index.asi8 // interval.value
+        assert np.all(
+            df.index.asi8 == positions * interval.value
+        ), f"{path.as_posix()} isn't resampled to {interval}"
+        kept = (positions >= 0) & (positions < len(instants))
+        if not kept.all():
+            logger.warning(
+                f"Leaving out {np.count_nonzero(~kept)} rows of {path.as_posix()} outside the grid"
+            )
+        row = np.full((len(instants), len(metrics)), np.nan)
+        row[positions[kept]] = df.to_numpy(dtype=float)[kept]
+        values[number] = row
+        stats.add(row)
+        logger.debug(f"Added {path.as_posix()}")
+    values.flush()
+
+    summary = summarise(values, stats, instants, metrics, quantiles, rows_per_chunk)
+    output_format = results.resolve_format(output_format)
+    results.write_result(summary, directory / f"summary.{output_format}", output_format)
+    return summary
+
+
+def summarise(
+    values: np.ndarray,
+    stats: RunningStats,
+    instants: pd.TimedeltaIndex,
+    metrics: List[str],
+    quantiles: Sequence[float],
+    rows_per_chunk: int,
+) -> pd.DataFrame:
+    """Columns of <metric>_mean, <metric>_std, <metric>_count and <metric>_q<percent> for each metric, e.g Friction_Coefficient_q50.
+    Quantiles need every experiment's values at once, so are taken from `values` `rows_per_chunk` instants at a time
+    """
+    quantile_values = np.empty((len(quantiles), len(instants), len(metrics)))
+    with warnings.catch_warnings():
+        # Instants that no experiment reached
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for first in range(0, len(instants), rows_per_chunk):
+            chunk = slice(first, first + rows_per_chunk)
+            quantile_values[:, chunk] = np.nanquantile(
+                values[:, chunk], quantiles, axis=0
+            )
+
+    columns = {}
+    std = stats.std()
+    for i, metric in enumerate(metrics):
+        columns[f"{metric}_mean"] = np.where(
+            stats.count[:, i] > 0, stats.mean[:, i], np.nan
+        )
+        columns[f"{metric}_std"] = std[:, i]
+        columns[f"{metric}_count"] = stats.count[:, i]
+        for quantile, value in zip(quantiles, quantile_values):
+            columns[f"{metric}_q{quantile * 100:g}"] = value[:, i]
+    return pd.DataFrame(columns, index=instants)
+
+
+def load_aggregate(
+    directory: Path,
+) -> Tuple[np.ndarray, pd.DataFrame, pd.TimedeltaIndex, List[str]]:
+    """Read back what `aggregate` wrote, other than the summary. The values are memory-mapped
+
+    Returns:
+        Tuple[np.ndarray, pd.DataFrame, pd.TimedeltaIndex, List[str]]: Values (experiments, instants, metrics), experiments,
+            instants and metrics
+    """
+    return (
+        np.load(directory / "values.npy", mmap_mode="r"),
+        pd.read_csv(directory / "experiments.csv", dtype=str),
+        pd.TimedeltaIndex(np.load(directory / "instants.npy"), name="Instant"),
+        json.loads((directory / "metrics.json").read_text()),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+    Put many experiments' results (processed_<id>.csv etc, from csv-analyser) on one time grid, and summarise them.
+
+    Results go to a directory of values.npy (experiments x instants x metrics), experiments.csv, instants.npy and metrics.json,
+    along with a summary of each metric's mean, standard deviation, count and quantiles at each instant.
+    Results are read one at a time, so memory doesn't grow with how many experiments there are.
+    """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "results",
+        type=Path,
+        nargs="+",
+        help="Results, or folders to find processed_<ids> results in",
+    )
+    parser.add_argument(
+        "-g",
+        "--ids",
+        type=str,
+        default="*",
+        help="e.g `2021-06-*` to only aggregate processed_2021-06-* results from folders",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        required=True,
+        help="Where to write the aggregate",
+    )
+    parser.add_argument(
+        "-r",
+        "--resample-to",
+        type=float,
+        default=None,
+        help="As csv-analyser's, in seconds. Defaults to the spacing of the first result with at least two rows",
+    )
+    parser.add_argument(
+        "-e",
+        "--experiment-duration",
+        type=float,
+        default=None,
+        help="How long the grid is, in seconds. Defaults to the longest result's",
+    )
+    parser.add_argument(
+        "-m",
+        "--metrics",
+        nargs="+",
+        default=list(METRICS),
+        help="Columns to aggregate. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-q",
+        "--quantiles",
+        type=float,
+        nargs="+",
+        default=list(QUANTILES),
+        help="Quantiles to summarise with. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-F",
+        "--output-format",
+        choices=results.FORMATS,
+        default="csv",
+        help="Format to write the summary in. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Write over an existing aggregate",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        type=lambda x: getattr(logging, x.upper()),
+        default=logging.INFO,
+        help="How verbose to be",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    logger.debug(f"Arguments: {args}")
+
+    paths = []
+    for path in args.results:
+        paths.extend(find_results(path, args.ids) if path.is_dir() else [path])
+    if not paths:
+        parser.error("No results found")
+
+    if args.output.exists() and not args.overwrite:
+        logger.error(f"{args.output} already exists, and `--overwrite` not specified")
+        sys.exit(1)
+
+    aggregate(
+        paths=paths,
+        directory=args.output,
+        interval=(
+            None
+            if args.resample_to is None
+            else pd.Timedelta(args.resample_to, "seconds")
+        ),
+        duration=(
+            None
+            if args.experiment_duration is None
+            else pd.Timedelta(args.experiment_duration, "seconds")
+        ),
+        metrics=args.metrics,
+        quantiles=args.quantiles,
+        output_format=args.output_format,
+    )
@@ -0,0 +1,255 @@
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from . import cli, csv_analyser
+
+logger = logging.getLogger(__name__)
+
+
+class ExperimentResult(NamedTuple):
+    filename: str
+    succeeded: bool
+    seconds: float
+    error: Optional[str] = None
+
+
+def read_manifest(path: Path) -> List[Dict[str, Any]]:
+    """Read per-experiment parameters from a manifest.
+
+    Keys are csv-analyser's long options (e.g `filename-contains`, `substrate-stiffness`)
+
+    - CSV: a header row of keys, then one row per experiment. Empty cells are ignored
+    - TOML: an `[[experiment]]` table per experiment, and an optional `[defaults]` table that applies to all of them
+
+    Args:
+        path (Path): The manifest
+
+    Returns:
+        List[Dict[str, Any]]: Parameters for each experiment
+    """
+    if path.suffix == ".toml":
+        try:
+            import tomllib  # type: ignore
+        except ImportError:  # Python < 3.11
+            import tomli as tomllib  # type: ignore
+
+        with path.open("rb") as file:
+            manifest = tomllib.load(file)
+        assert (
+            "experiment" in manifest
+        ), f"{path.as_posix()} has no [[experiment]] tables, so no experiments to analyse"
+        defaults = manifest.get("defaults", {})
+        return [{**defaults, **experiment} for experiment in manifest["experiment"]]
+
+    with path.open(newline="") as file:
+        return [
+            {key: value for key, value in row.items() if value not in (None, "")}
+            for row in csv.DictReader(file)
+        ]
+
+
+def to_argv(parameters: Dict[str, Any]) -> List[str]:
+    """Turn a manifest entry into csv-analyser command line arguments"""
+    argv = []
+    for key, value in parameters.items():
+        option = "--" + key.strip().replace("_", "-")
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            value = value.lower() == "true"
+        if isinstance(value, bool):
+            # Flags like `--overwrite` don't take a value
+            if value:
+                argv.append(option)
+        else:
+            argv.extend([option, str(value)])
+    return argv
+
+
+def discover_ids(folder: Path, pattern: str) -> List[str]:
+    """Find experiments whose substrate CSV is named `substrate_<pattern>.csv`, returning the part matching `pattern`"""
+    prefix, suffix = "substrate_", ".csv"
+    return sorted(
+        path.name[len(prefix) : -len(suffix)]
+        for path in folder.glob(f"{prefix}{pattern}{suffix}")
+    )
+
+
+def run_experiment(argv: List[str]) -> ExperimentResult:
+    """Run csv-analyser with these arguments, catching (and logging) any failure"""
+    start = time.perf_counter()
+    filename = "?"
+    try:
+        # argparse reports bad arguments on stderr before exiting. Keep hold of them instead
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            try:
+                args = cli.csv_analyser_parser().parse_args(argv)
+            except SystemExit:
+                raise ValueError(stderr.getvalue().strip().splitlines()[-1])
+        filename = args.filename_contains
+        csv_analyser.analyse_csv(**cli.analyse_csv_arguments(args))
+    except Exception as e:
+        logger.error(f"Experiment {filename} failed: {e!r}")
+        return ExperimentResult(
+            filename=filename,
+            succeeded=False,
+            seconds=time.perf_counter() - start,
+            error=repr(e),
+        )
+    return ExperimentResult(
+        filename=filename, succeeded=True, seconds=time.perf_counter() - start
+    )
+
+
+def run_batch(jobs: Iterable[List[str]], max_workers: Optional[int] = None):
+    """Run each job (a list of csv-analyser arguments) on a pool of processes.
+    If a worker dies outright (e.g the OOM killer), the pool breaks, and every job it hadn't finished is run again,
+    each in a process of its own, so only the job that killed it fails
+
+    Args:
+        jobs (Iterable[List[str]]): Command line arguments for each experiment
+        max_workers (Optional[int]): How many experiments to analyse at once. Defaults to the number of CPUs
+
+    Returns:
+        List[ExperimentResult]: In the same order as `jobs`
+    """
+    jobs = list(jobs)
+    logger.info(f"Analysing {len(jobs)} experiments")
+
+    results: List[Optional[ExperimentResult]] = [None] * len(jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_experiment, job) for job in jobs]
+        for i, future in enumerate(futures):
+            try:
+                results[i] = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                pass
+
+    unfinished = [i for i, result in enumerate(results) if result is None]
+    if unfinished:
+        logger.warning(
+            f"A worker died, running the {len(unfinished)} experiments it left unfinished again, one per process"
+        )
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or os.cpu_count()
+        ) as executor:
+            for i, result in zip(
+                unfinished,
+                executor.map(run_isolated, [jobs[i] for i in unfinished]),
+            ):
+                results[i] = result
+    return results
+
+
+def run_isolated(job: List[str]) -> ExperimentResult:
+    """`run_experiment` in a process of its own, taking the process dying as a failure rather than giving up"""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(run_experiment, job).result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            args = cli.csv_analyser_parser(required=False).parse_args(job)
+            logger.error(f"Experiment {args.filename_contains} failed: {e!r}")
+            return ExperimentResult(
+                filename=args.filename_contains,
+                succeeded=False,
+                seconds=0,
+                error=repr(e),
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+    Run csv-analyser over many experiments at once, on a pool of processes.
+
+    Experiments come from either
+    - A manifest (.csv or .toml), whose keys are csv-analyser's long options (e.g `filename-contains`, `substrate-stiffness`)
+    - A glob matched against substrate_*.csv filenames, to find `--filename-contains` values
+
+    Any other arguments are passed to csv-analyser for every experiment (the manifest takes precedence).
+    A failed experiment is reported in the summary, and doesn't stop the others.
+    """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        allow_abbrev=False,  # Don't steal csv-analyser's arguments
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-m", "--manifest", type=Path)
+    source.add_argument(
+        "-g",
+        "--ids",
+        type=str,
+        help="e.g `2021-06-*` to analyse every experiment with a substrate_2021-06-*.csv",
+    )
+    parser.add_argument(
+        "-J",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="How many experiments to analyse at once. Defaults to the number of CPUs (%(default)s)",
+    )
+    parser.add_argument(
+        "-S",
+        "--summary",
+        type=Path,
+        default=None,
+        help="Also write the summary of successes, failures and timings to this JSON file",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        type=lambda x: getattr(logging, x.upper()),
+        default=logging.INFO,
+        help="How verbose to be",
+    )
+    args, common = parser.parse_known_args()
+    # Check these up front, rather than once per experiment
+    defaults = cli.csv_analyser_parser(required=False).parse_args(common)
+
+    logging.basicConfig(level=args.log_level)
+
+    logger.debug(f"Arguments: {args}, passing on {common}")
+
+    if args.manifest is not None:
+        experiments = read_manifest(args.manifest)
+    else:
+        experiments = [
+            {"filename-contains": id} for id in discover_ids(defaults.folder, args.ids)
+        ]
+
+    jobs = [[*common, *to_argv(experiment)] for experiment in experiments]
+
+    start = time.perf_counter()
+    results = run_batch(jobs, max_workers=args.jobs)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        status = "ok" if result.succeeded else f"FAILED {result.error}"
+        logger.info(f"{result.filename:>20} {result.seconds:8.2f}s {status}")
+
+    failures = [result for result in results if not result.succeeded]
+    logger.info(
+        f"{len(results) - len(failures)} succeeded, {len(failures)} failed in {elapsed:.2f}s"
+    )
+
+    if args.summary is not None:
+        args.summary.write_text(
+            json.dumps(
+                {
+                    "seconds": elapsed,
+                    "experiments": [result._asdict() for result in results],
+                },
+                indent=2,
+            )
+        )
+
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,248 @@
+import argparse
+import datetime
+import hashlib
+import logging
+import os
+import tempfile
+
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3  # bytes
+
+
+def default_cache_dir() -> Path:
+    """Where to keep cached files, following the XDG convention (`~/.cache/phd_utils`)"""
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "phd_utils"
+
+
+def fingerprint(path: Path) -> str:
+    """Identify a file by where it is, how big it is and when it was last modified.
+
+    Returns:
+        str: `<path digest>-<size and mtime digest>`, so all versions of a file share a prefix
+    """
+    stat = path.stat()
+    location = hashlib.sha1(path.resolve().as_posix().encode()).hexdigest()[:16]
+    version = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    return f"{location}-{version[:16]}"
+
+
+def derived_key(
+    prefix: str, sources: Iterable[Path], parameters: Dict[str, Any]
+) -> str:
+    """Identify something computed from `sources` with `parameters`, e.g the merged frame of an experiment.
+
+    Returns:
+        str: `<prefix>-<sources' paths and parameters digest>-<sources' versions digest>`,
+            so that whatever replaces it when the sources change shares a prefix
+    """
+    locations, versions = zip(*(fingerprint(source).split("-") for source in sources))
+    what = hashlib.sha1(
+        repr((locations, sorted(parameters.items()))).encode()
+    ).hexdigest()
+    version = hashlib.sha1("".join(versions).encode()).hexdigest()
+    return f"{prefix}-{what[:16]}-{version[:16]}"
+
+
+def lookup(cache_dir: Path, key: str) -> Optional[Path]:
+    """Find a cached file, marking it as recently used
+
+    Args:
+        cache_dir (Path): The cache directory
+        key (str): The name of the entry, including its suffix
+
+    Returns:
+        Optional[Path]: The entry, or None if there isn't one
+    """
+    entry = cache_dir / key
+    try:
+        if not entry.is_file():
+            raise FileNotFoundError(entry)
+        # mtime rather than atime, because filesystems are often mounted with noatime
+        os.utime(entry)
+    except FileNotFoundError:
+        # Including when another process evicts it in between
+        logger.debug(f"Cache miss for {key}")
+        return None
+    logger.debug(f"Cache hit for {key}")
+    return entry
+
+
+def store(
+    cache_dir: Path,
+    key: str,
+    write: Callable[[BinaryIO], None],
+    max_size: int = DEFAULT_CACHE_SIZE,
+    replaces: Optional[str] = None,
+) -> Path:
+    """Atomically add an entry to the cache, then evict entries until it is under `max_size`
+
+    Args:
+        cache_dir (Path): The cache directory. Created if it doesn't exist
+        key (str): The name of the entry, including its suffix
+        write (Callable[[BinaryIO], None]): Writes the entry's contents to the given file
+        max_size (int): Cap on the total size of the cache, in bytes
+        replaces (Optional[str]): Glob of stale entries to remove (e.g older versions of the same source)
+
+    Returns:
+        Path: The new entry
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry = cache_dir / key
+
+    if replaces is not None:
+        for stale in cache_dir.glob(replaces):
+            if stale != entry:
+                logger.debug(f"Removing stale cache entry {stale.name}")
+                # Another process may have removed it already
+                stale.unlink(missing_ok=True)
+
+    # Write somewhere else first, so that a crash never leaves a half-written entry behind
+    fd, temporary = tempfile.mkstemp(dir=cache_dir, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+        os.replace(temporary, entry)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+    evict(cache_dir=cache_dir, max_size=max_size)
+    return entry
+
+
+def evict(cache_dir: Path, max_size: int):
+    """Delete the least recently used entries until the cache is no bigger than `max_size` bytes.
+    Other processes share the cache, so entries may disappear while we look at them
+    """
+    entries = []
+    for entry in cache_dir.iterdir():
+        if not entry.is_file() or entry.name.startswith("."):
+            continue
+        try:
+            entries.append((entry.stat(), entry))
+        except FileNotFoundError:
+            continue
+    entries.sort(key=lambda pair: pair[0].st_mtime_ns)  # Oldest first
+
+    total = sum(stat.st_size for stat, _ in entries)
+    for stat, entry in entries:
+        if total <= max_size:
+            break
+        logger.debug(f"Evicting {entry.name} from cache ({stat.st_size} bytes)")
+        entry.unlink(missing_ok=True)
+        total -= stat.st_size
+
+
+class Entry(NamedTuple):
+    path: Path
+    size: int  # bytes
+    last_used: datetime.datetime
+    # What it was made from, for entries that record that
+    description: Optional[str]
+
+
+def entries(cache_dir: Path) -> List[Entry]:
+    """Everything in the cache, most recently used first. Entries evicted while we look are left out"""
+    # Here, so that the command line tools don't import numpy just to find the cache
+    import numpy as np
+
+    if not cache_dir.is_dir():
+        return []
+    found = []
+    for path in cache_dir.iterdir():
+        if not path.is_file() or path.name.startswith("."):
+            continue
+        description = None
+        try:
+            stat = path.stat()
+            if path.suffix == ".npz":
+                with np.load(path) as npz:
+                    if "description" in npz.files:
+                        description = str(npz["description"])
+        except FileNotFoundError:
+            continue
+        found.append(
+            Entry(
+                path=path,
+                size=stat.st_size,
+                last_used=datetime.datetime.fromtimestamp(stat.st_mtime),
+                description=description,
+            )
+        )
+    found.sort(key=lambda entry: entry.last_used, reverse=True)
+    return found
+
+
+def clear(cache_dir: Path, pattern: str = "*") -> int:
+    """Delete the entries whose names match `pattern`
+
+    Returns:
+        int: How many bytes were freed
+    """
+    freed = 0
+    for entry in entries(cache_dir):
+        if entry.path.match(pattern):
+            logger.debug(f"Removing {entry.path.name} from cache")
+            try:
+                entry.path.unlink()
+            except FileNotFoundError:
+                # Evicted by another process, so not ours to count
+                continue
+            freed += entry.size
+    return freed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+    Inspect or clear csv-analyser's cache, which keeps parsed CSVs (*.npy)
+    and merged, resampled experiments (merged-*.npz), so that re-runs can skip reading and merging
+    """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("action", choices=["list", "clear"])
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=default_cache_dir(),
+        help="Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        default="*",
+        help="Only entries whose names match this glob, e.g 'merged-*'. Defaults to all of them",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        type=lambda x: getattr(logging, x.upper()),
+        default=logging.INFO,
+        help="How verbose to be",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    logger.debug(f"Arguments: {args}")
+
+    if args.action == "clear":
+        freed = clear(args.cache_dir, pattern=args.pattern)
+        logger.info(f"Freed {freed / 1024 ** 2:.1f} MiB from {args.cache_dir}")
+        return
+
+    matching = [
+        entry for entry in entries(args.cache_dir) if entry.path.match(args.pattern)
+    ]
+    for entry in matching:
+        print(
+            f"{entry.last_used:%Y-%m-%d %H:%M:%S} {entry.size / 1024 ** 2:>9.1f} MiB  {entry.path.name}"
+        )
+        if entry.description is not None:
+            print(f"    {entry.description}")
+    total = sum(entry.size for entry in matching)
+    print(f"{len(matching)} entries, {total / 1024 ** 2:.1f} MiB in {args.cache_dir}")
@@ -0,0 +1,419 @@
+import argparse
+import logging
+import os
+import sys
+
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import cache, profiling, results, worker
+
+logger = logging.getLogger(__name__)
+
+# Only the standard library (and our modules that stick to it) is imported here, so that `--help` and argument errors are instant.
+# The modules that do the work, with numpy and pandas, are imported once the arguments are known to be good
+
+
+def csv_analyser_parser(required: bool = True) -> argparse.ArgumentParser:
+    """csv-analyser's arguments. Pass `required=False` to parse a partial set of them (e.g defaults for a batch)"""
+    parser = argparse.ArgumentParser(
+        description="""
+    Given a string, this program will
+    - Read substrate*.csv, reference*.csv and pipette*.csv, where each filename contains that string
+    - Convert them to timeseries, and concatenate
+    - Resample
+    - Do some basic analysis
+    """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "-c",
+        "--filename-contains",
+        type=str,
+        help="""Look for the substrate, reference and pipette csvs which have their filenames containing this number""",
+    )
+    parser.add_argument(
+        "-f",
+        "--folder",
+        type=Path,
+        default=Path.cwd(),
+        help="The folder to look in. Defaults to the current working directory",
+    )
+    parser.add_argument(
+        "-e",
+        "--experiment-duration",
+        type=float,
+        help="Duration of this experiment, in seconds",
+        required=required,
+    )
+    parser.add_argument(
+        "-r",
+        "--resample-to",
+        type=float,
+        help="How many seconds each row should last for after resampling",
+        required=required,
+    )
+
+    parser.add_argument("-x", "--initial-x-displacement", type=float, required=required)
+    parser.add_argument("-t", "--substrate-tip-position", type=float, required=required)
+    parser.add_argument("-L", "--substrate-length", type=float, required=required)
+    parser.add_argument("-k", "--substrate-stiffness", type=float, required=required)
+    parser.add_argument("-j", "--pipette-stiffness", type=float, required=required)
+    # parser.add_argument("-R", "--pipette-position-at-rest", type=float, default=None, required=False)
+    parser.add_argument("-a", "--angle-alpha", type=float, default=None, required=False)
+    parser.add_argument("-b", "--angle-beta", type=float, default=None, required=False)
+    parser.add_argument("-s", "--speed", type=float, default=None, required=False)
+    parser.add_argument(
+        "-fr", "--flexural-rigidity", type=float, default=None, required=False
+    )
+    parser.add_argument(
+        "-d", "--reverse-sliding-direction", default=False, action="store_true"
+    )
+    parser.add_argument(
+        "-O",
+        "--overwrite",
+        default=False,
+        action="store_true",
+        help="If the output filename already exists, ovewrite it. Else, the program will raise an error",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=cache.default_cache_dir(),
+        help="Where to keep parsed copies of the CSVs, so that re-runs don't have to parse them again. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=cache.DEFAULT_CACHE_SIZE // 1024 ** 2,
+        help="Maximum size of the cache directory, in MiB. Least recently used entries are evicted first. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--no-cache",
+        default=False,
+        action="store_true",
+        help="Always parse the CSVs, and don't touch the cache",
+    )
+    parser.add_argument(
+        "--resample-engine",
+        choices=["pandas", "numpy"],
+        default="pandas",
+        help="How to resample. `numpy` is much quicker for long recordings. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="Stream the CSVs this many rows at a time, so that memory use doesn't grow with the length of the recording",
+    )
+    parser.add_argument(
+        "-F",
+        "--output-format",
+        choices=results.FORMATS,
+        default="csv",
+        help="What to write processed_<filename-contains> as. Parquet and Feather need pyarrow, and fall back to npz without it. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--float32",
+        default=False,
+        action="store_true",
+        help="Compute and write the results in single precision, using half the memory",
+    )
+    parser.add_argument(
+        "-W",
+        "--watch",
+        default=False,
+        action="store_true",
+        help="Keep analysing the CSVs while the tracker appends to them, until they stop growing for --idle-timeout, or Ctrl+C. Writes csv",
+    )
+    parser.add_argument(
+        "--frame-rate",
+        type=float,
+        default=None,
+        help="Frames per second. Needed for --watch, as frames can't be timed against the experiment's duration until it's over",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1,
+        help="With --watch, how many seconds to wait between looking for new rows. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="With --watch, finish after this many seconds without new rows. Defaults to waiting for Ctrl+C",
+    )
+    parser.add_argument(
+        "--rolling-window",
+        type=float,
+        default=None,
+        help="Add the rolling mean, standard deviation, minimum and maximum of Friction_Force and Friction_Coefficient over this many seconds",
+    )
+    parser.add_argument(
+        "--slip-rate",
+        type=float,
+        nargs=2,
+        default=None,
+        metavar=("START", "END"),
+        help="Write slips_<filename-contains>.csv, of each time --slip-column drops faster than START per second, until it drops slower than END",
+    )
+    parser.add_argument(
+        "--min-slip-drop",
+        type=float,
+        default=0,
+        help="Leave out slips that drop less than this. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--slip-column",
+        type=str,
+        default="Friction_Force",
+        help="What to find slips in. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--preview",
+        default=False,
+        action="store_true",
+        help="Also write preview_<filename-contains>, for plotting long experiments quickly (see phd_utils.preview.Preview)",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        type=lambda x: getattr(logging, x.upper()),
+        default=logging.INFO,
+        help="How verbose to be",
+    )
+    add_common_arguments(parser)
+    return parser
+
+
+def analyse_csv_arguments(args: argparse.Namespace) -> Dict[str, Any]:
+    """Map csv-analyser's command line arguments onto `analyse_csv`'s parameters"""
+    return dict(
+        filename=args.filename_contains,
+        folder=args.folder,
+        experiment_duration=args.experiment_duration,
+        resample_to=args.resample_to,
+        initial_x_displacement=args.initial_x_displacement,
+        substrate_tip_position=args.substrate_tip_position,
+        length_of_substrate=args.substrate_length,
+        stiffness_constant_of_substrate=args.substrate_stiffness,
+        stiffness_constant_of_pipette=args.pipette_stiffness,
+        reverse_sliding_direction=args.reverse_sliding_direction,
+        angle_alpha=args.angle_alpha,
+        angle_beta=args.angle_beta,
+        speed=args.speed,
+        flexural_rigidity=args.flexural_rigidity,
+        # pipette_position_at_rest=args.pipette_position_at_rest,
+        overwrite=args.overwrite,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        max_cache_size=args.cache_size * 1024 ** 2,
+        chunk_size=args.chunk_size,
+        resample_engine=args.resample_engine,
+        dtype="float32" if args.float32 else "float64",
+        output_format=args.output_format,
+        watch=args.watch,
+        frame_rate=args.frame_rate,
+        poll_interval=args.poll_interval,
+        idle_timeout=args.idle_timeout,
+        rolling_window=args.rolling_window,
+        slip_rates=None if args.slip_rate is None else tuple(args.slip_rate),
+        min_slip_drop=args.min_slip_drop,
+        slip_column=args.slip_column,
+        write_preview=args.preview,
+    )
+
+
+def tiff_stacker_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="""
+    Given a list of directories this program will
+    - Gather all files that end in .tif
+    - Sort them, in natural order (image999.tif before image1000.tif) unless `--order name` is given
+    - Merge FILES_PER_STACK of them into a single "stackN.tif" file into that directory (where N is the current batch), for all files
+    - Check that the stack has a page of the right size for each file, without decoding it
+    - Delete the original files
+
+    By default, the images' data is copied into the stacks as it is.
+    With `--engine imagemagick`, it calls `convert` instead, with the assumption that it is ImageMagick. Ensure that ImageMagick is installed
+    """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("folder", type=Path, nargs="+")
+    parser.add_argument(
+        "-f",
+        "--files-per-stack",
+        type=int,
+        default=2000,
+        help="Number of files to combine into each stack. Defaults to 2000",
+    )
+    parser.add_argument(
+        "-s",
+        "--stack-size",
+        type=int,
+        default=None,
+        help="Instead of a number of files, put as many in each stack as fit in this many MiB, so stacks are about the same size whatever the images' size. Stacks over 4 GiB are written as BigTIFFs",
+    )
+    parser.add_argument(
+        "-i",
+        "--imagemagick-stderr",
+        type=argparse.FileType(mode="w"),
+        default=sys.stdout,
+        help="ImageMagick sometimes emits some benign errors to stderr (like unknown TIFF metadata fields). Specify a logfile to avoid stdout being cluttered",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=["native", "imagemagick"],
+        default="native",
+        help="`native` copies the images' data into the stack as it is, without decoding it. `imagemagick` calls `convert`, which re-encodes every image, but can stack other formats. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="How many stacks to build at once, across groups and folders. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-o",
+        "--order",
+        choices=["natural", "name"],
+        default="natural",
+        help="`natural` puts image999.tif before image1000.tif, comparing runs of digits as numbers. `name` compares names character by character. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "-z",
+        "--compression",
+        choices=["deflate", "zstd"],
+        default=None,
+        help="Losslessly compress the stacks' pages (the native engine only compresses those that aren't already). zstd needs the zstandard package. Defaults to copying them as they are",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=6,
+        help="From 1 (quickest) to 9 for deflate, or 22 for zstd. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--compression-threads",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="How many pages to compress at once, for each stack being built. Defaults to the number of CPUs, %(default)s",
+    )
+    parser.add_argument(
+        "-c",
+        "--checksums",
+        default=False,
+        action="store_true",
+        help="Each stack's pages are checked against its files' (their number, size and bit depth) before the files are deleted. Also check that the native engine copied their data correctly, by comparing checksums",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        type=lambda x: getattr(logging, x.upper()),
+        default=logging.INFO,
+        help="How verbose to be",
+    )
+    add_common_arguments(parser)
+    return parser
+
+
+def add_common_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        default=None,
+        metavar="PATH",
+        help="Time each stage, and measure its memory. Logs a table, and also writes JSON to PATH if given",
+    )
+    parser.add_argument(
+        "--no-worker",
+        default=False,
+        action="store_true",
+        help="Run here, even if `phd-utils-worker` is running",
+    )
+
+
+def run_csv_analyser(args: argparse.Namespace):
+    from .csv_analyser import analyse_csv
+
+    with profiling.session(args.profile):
+        analyse_csv(**analyse_csv_arguments(args))
+
+
+def run_tiff_stacker(args: argparse.Namespace):
+    from .tiff_stacker import Compression, stack_in_folders
+
+    bytes_per_stack = None if args.stack_size is None else args.stack_size * 1024 ** 2
+    compression = None
+    if args.compression is not None:
+        compression = Compression(
+            args.compression, args.compression_level, args.compression_threads
+        )
+    with profiling.session(args.profile):
+        stack_in_folders(
+            folders=args.folder,
+            files_per_stack=args.files_per_stack,
+            bytes_per_stack=bytes_per_stack,
+            imagemagick_stderr=args.imagemagick_stderr,
+            engine=args.engine,
+            jobs=args.jobs,
+            order=args.order,
+            checksums=args.checksums,
+            compression=compression,
+        )
+
+    logger.info("All done!")
+
+
+# What the worker can run: how to parse each command's arguments, and then run it
+COMMANDS: Dict[
+    str,
+    Tuple[Callable[[], argparse.ArgumentParser], Callable[[argparse.Namespace], None]],
+] = {
+    "csv-analyser": (csv_analyser_parser, run_csv_analyser),
+    "tiff-stacker": (tiff_stacker_parser, run_tiff_stacker),
+}
+
+
+def main(command: str, argv: Optional[List[str]] = None):
+    """Run one of the `COMMANDS`, handing it to the worker if one is running
+
+    Args:
+        command (str): e.g "csv-analyser"
+        argv (Optional[List[str]]): Its arguments. Defaults to the command line's
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    build_parser, run = COMMANDS[command]
+    # Parse here too, so that mistakes are reported straight away
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if (
+        command == "csv-analyser"
+        and args.chunk_size is not None
+        and results.resolve_format(args.output_format) not in results.STREAMABLE_FORMATS
+    ):
+        parser.error(
+            f"--chunk-size can only write {' or '.join(results.STREAMABLE_FORMATS)}, not {args.output_format}"
+        )
+
+    logging.basicConfig(level=args.log_level)
+
+    logger.debug(f"Arguments: {args}")
+
+    if not args.no_worker:
+        exit_code = worker.submit(command, argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    run(args)
+
+
+def csv_analyser():
+    main("csv-analyser")
+
+
+def tiff_stacker():
+    main("tiff-stacker")
@@ -1,34 +1,98 @@
 import logging
-import argparse
+import importlib.util
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
 from numpy import cos
+import numpy as np
 import pandas as pd
-import string
 import datetime
 
+from . import cache
+from . import preview
+from . import profiling
+from . import results
+from . import resample
+
 
 logger = logging.getLogger(__name__)
 
 
-def read_displacement_csv(path: Path):
+# Tracker exports put the columns we care about at E, F and H (zero-indexed 4, 5 and 7)
+DISPLACEMENT_COLUMNS = {4: "X_Position", 5: "Y_Position", 7: "Frame"}
+# What `generate_normal_force_and_correct_for_load_positioning` adds
+FORCE_COLUMNS = (
+    "Substrate_Tip_Position",
+    "Corrected_Deflection",
+    "Normal_Force",
+    "Pipette_Deflection",
+    "Friction_Force",
+    "Friction_Coefficient",
+)
+# What `add_rolling_statistics` summarises by default
+ROLLING_COLUMNS = ("Friction_Force", "Friction_Coefficient")
+
+
+def read_displacement_csv(
+    path: Path,
+    engine: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+    max_cache_size: int = cache.DEFAULT_CACHE_SIZE,
+):
     """Reads in a CSV, returning a dataframe with:
     - (Index)
-    - Frame
     - X_Position
     - Y_Position
+    - Frame
+
+    Only columns E, F and H are parsed, straight into float64 (so we never guess at types).
+    The first column (which starts with a BOM) is never touched.
 
     Args:
         path (Path): Where the file is
+        engine (Optional[str]): "pyarrow" or "c". Defaults to "pyarrow" if it is installed, else "c"
+        cache_dir (Optional[Path]): If given, keep a binary copy of the parsed columns here, and use it on later reads (until the CSV changes)
+        max_cache_size (int): Cap on the size of `cache_dir`, in bytes. Least recently used entries are evicted first
 
     Returns:
         pd.DataFrame: A DataFrame (tabular data)
     """
-    df: pd.DataFrame = pd.read_csv(
-        path,
-        index_col=False,
-        names=[s for s in string.ascii_uppercase],  # A..Z
-    )
+    if cache_dir is not None:
+        key = cache.fingerprint(path)
+        entry = cache.lookup(cache_dir, f"{key}.npy")
+        if entry is not None:
+            try:
+                # Copy-on-write, so that nothing downstream can scribble on the cache
+                df = _displacement_from_array(np.load(entry, mmap_mode="c"))
+            except FileNotFoundError:
+                # Another process evicted it since we looked it up
+                logger.debug(f"Cached csv for {path.as_posix()} vanished, parsing it")
+            else:
+                logger.info(f"Loaded cached csv for {path.as_posix()} ({len(df)} rows)")
+                return df
+
+    df = _parse_displacement_csv(path, engine=engine)
+
+    if cache_dir is not None:
+        array = _displacement_to_array(df)
+        cache.store(
+            cache_dir=cache_dir,
+            key=f"{key}.npy",
+            write=lambda file: np.save(file, array),
+            max_size=max_cache_size,
+            replaces=f"{key.split('-')[0]}-*.npy",  # Older versions of this CSV
+        )
+
+    return df
+
+
+def _parse_displacement_csv(path: Path, engine: Optional[str]) -> pd.DataFrame:
+    if engine is None:
+        engine = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+
+    if engine == "pyarrow":
+        df = _read_displacement_csv_with_pyarrow(path)
+    else:
+        df = _read_displacement_csv_with_pandas(path, engine=engine)
 
     df.dropna(
         axis="index",  # Drop empty rows
@@ -36,34 +100,90 @@ def read_displacement_csv(path: Path):
         inplace=True,
     )
 
-    df.dropna(
-        axis="columns",
-        how="all",
-        inplace=True,
+    # Empty rows forced this to be a float. Fix that now
+    df["Frame"] = df["Frame"].astype(int)
+
+    logger.info(f"Loaded csv from {path.as_posix()} ({len(df)} rows)")
+
+    return df
+
+
+def iter_displacement_csv(path: Path, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """As `read_displacement_csv`, but yielding `chunk_size` rows at a time, so that the whole file is never in memory"""
+    for df in _read_displacement_csv_with_pandas(
+        path, engine="c", chunksize=chunk_size
+    ):
+        df.dropna(axis="index", how="all", inplace=True)
+        df["Frame"] = df["Frame"].astype(int)
+        yield df
+
+
+def _displacement_to_array(df: pd.DataFrame) -> np.ndarray:
+    # One row per column, so that the positions can later be viewed (not copied) as a 2D block
+    # Frames and row labels are integers well below 2 ** 53, so are exact as floats
+    return np.stack(
+        [
+            df["X_Position"].to_numpy(dtype=float),
+            df["Y_Position"].to_numpy(dtype=float),
+            df["Frame"].to_numpy(dtype=float),
+            df.index.to_numpy(dtype=float),
+        ]
     )
 
-    df.rename(
-        columns={
-            "H": "Frame",
-            "E": "X_Position",
-            "F": "Y_Position",
-        },
-        inplace=True,
+
+def _displacement_from_array(array: np.ndarray) -> pd.DataFrame:
+    df = pd.DataFrame(
+        array[:2].T,
+        columns=["X_Position", "Y_Position"],
+        index=pd.Index(array[3].astype(int)),
+        copy=False,
     )
+    df["Frame"] = array[2].astype(int)
+    return df
 
-    # Pandas interpreted this as a float. Fix that now
-    df["Frame"] = df["Frame"].astype(int)
 
-    df.drop(
-        # We've pulled out all of the columns we want, so drop the ones that we don't need (which have single-character names)
-        labels=[col for col in df.columns if len(col) == 1],
-        axis="columns",
-        inplace=True,
+def _read_displacement_csv_with_pandas(path: Path, engine: str, **kwargs):
+    return pd.read_csv(
+        path,
+        header=None,
+        index_col=False,
+        usecols=list(DISPLACEMENT_COLUMNS.keys()),
+        names=list(DISPLACEMENT_COLUMNS.values()),
+        dtype={name: "float64" for name in DISPLACEMENT_COLUMNS.values()},
+        engine=engine,
+        **kwargs,
     )
 
-    logger.info(f"Loaded csv from {path.as_posix()} ({len(df)} rows)")
 
-    return df
+def _read_displacement_csv_with_pyarrow(path: Path) -> pd.DataFrame:
+    # pandas' own pyarrow engine can't select columns by position, so drive pyarrow directly
+    import pyarrow
+    import pyarrow.csv
+
+    columns = {f"f{i}": name for i, name in DISPLACEMENT_COLUMNS.items()}
+    try:
+        table = pyarrow.csv.read_csv(
+            path,
+            read_options=pyarrow.csv.ReadOptions(autogenerate_column_names=True),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=list(columns.keys()),
+                column_types={column: pyarrow.float64() for column in columns},
+            ),
+        )
+    except pyarrow.ArrowInvalid as e:
+        # e.g ragged rows, which the C parser copes with
+        logger.debug(f"pyarrow couldn't parse {path.as_posix()} ({e}), falling back")
+        return _read_displacement_csv_with_pandas(path, engine="c")
+
+    return table.to_pandas().rename(columns=columns)
+
+
+def frame_instants(
+    frames: np.ndarray, number_of_frames: int, experiment_duration: pd.Timedelta
+) -> np.ndarray:
+    """Convert from frame numbers to the time through the experiment, in nanoseconds.
+    Exactly as `frames / number_of_frames * experiment_duration` would give, without making Timedeltas"""
+    return (frames / number_of_frames * experiment_duration.value).astype(np.int64)
 
 
 def merge_and_displace_frames(
@@ -72,7 +192,62 @@ def merge_and_displace_frames(
     pipette: pd.DataFrame,
     experiment_duration: pd.Timedelta,
     duration_of_resampled_row: pd.Timedelta,
+    engine: str = "pandas",
 ):
+    """Put the three CSVs on a common timeline, resampling to buckets of `duration_of_resampled_row`
+
+    Args:
+        engine (str): "pandas" concatenates the frames and uses `DataFrame.resample`.
+            "numpy" works out each row's bucket directly, and averages with `np.bincount`, which is much quicker for long recordings
+    """
+    with profiling.stage("resample") as counts:
+        if engine == "numpy":
+            combined = _resample_with_numpy(
+                streams={
+                    "Reference": reference,
+                    "Substrate": substrate,
+                    "Pipette": pipette,
+                },
+                experiment_duration=experiment_duration,
+                duration_of_resampled_row=duration_of_resampled_row,
+            )
+        else:
+            combined = _resample_with_pandas(
+                substrate=substrate,
+                reference=reference,
+                pipette=pipette,
+                experiment_duration=experiment_duration,
+                duration_of_resampled_row=duration_of_resampled_row,
+            )
+        counts["rows"] = len(combined)
+    logger.info(
+        f"Resampled to buckets of {duration_of_resampled_row} ({len(combined)} rows)"
+    )
+
+    combined["X_Delta"] = (
+        combined["Substrate_X_Position"] - combined["Reference_X_Position"]
+    )
+    combined["Y_Delta"] = (
+        combined["Substrate_Y_Position"] - combined["Reference_Y_Position"]
+    )
+
+    # Make our delta lines start at 0
+    x_start = combined["X_Delta"].iloc[0]
+    y_start = combined["Y_Delta"].iloc[0]
+
+    combined["X_Delta"] = combined["X_Delta"] - x_start
+    combined["Y_Delta"] = combined["Y_Delta"] - y_start
+
+    return combined
+
+
+def _resample_with_pandas(
+    substrate: pd.DataFrame,
+    reference: pd.DataFrame,
+    pipette: pd.DataFrame,
+    experiment_duration: pd.Timedelta,
+    duration_of_resampled_row: pd.Timedelta,
+) -> pd.DataFrame:
     reference = reference.add_prefix("Reference_")
     substrate = substrate.add_prefix("Substrate_")
     pipette = pipette.add_prefix("Pipette_")
@@ -104,25 +279,86 @@ def merge_and_displace_frames(
         columns=[col for col in combined.columns if col.endswith("Frame")],
         inplace=True,
     )
-    logger.info(
-        f"Resampled to buckets of {duration_of_resampled_row} ({len(combined)} rows)"
-    )
+    return combined
 
-    combined["X_Delta"] = (
-        combined["Substrate_X_Position"] - combined["Reference_X_Position"]
-    )
-    combined["Y_Delta"] = (
-        combined["Substrate_Y_Position"] - combined["Reference_Y_Position"]
-    )
 
-    # Make our delta lines start at 0
-    x_start = combined["X_Delta"].iloc[0]
-    y_start = combined["Y_Delta"].iloc[0]
+def _resample_with_numpy(
+    streams: Dict[str, pd.DataFrame],
+    experiment_duration: pd.Timedelta,
+    duration_of_resampled_row: pd.Timedelta,
+) -> pd.DataFrame:
+    # Frame -> instant is linear, so there's no need for Timedelta arithmetic
+    timed = {}
+    for name, df in streams.items():
+        # Frame numbers are no longer valid
+        value_columns = [col for col in df.columns if col != "Frame"]
+        timed[name] = pd.DataFrame(
+            df[value_columns].to_numpy(dtype=float),
+            columns=value_columns,
+            index=pd.TimedeltaIndex(
+                frame_instants(
+                    df["Frame"].to_numpy(), df["Frame"].max(), experiment_duration
+                ),
+                name="Instant",
+            ),
+            copy=False,
+        )
+    return resample.resample(timed, interval=duration_of_resampled_row, method="mean")
+
+
+def substrate_tip_position(
+    instants: pd.TimedeltaIndex,
+    start: pd.Timedelta,
+    interval: pd.Timedelta,
+    initial_position: float,
+    velocity: float,
+    stationary_for: pd.Timedelta,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Where the substrate tip is at each instant.
+    It stays at `initial_position` for `stationary_for`, then moves at a constant `velocity`.
+
+    Instants are on a grid of `interval`s from `start`. At each one, the tip is
+    where it would have been `stationary_for` ago, rounded down to the grid.
 
-    combined["X_Delta"] = combined["X_Delta"] - x_start
-    combined["Y_Delta"] = combined["Y_Delta"] - y_start
+    Args:
+        instants (pd.TimedeltaIndex): Where to evaluate the position
+        start (pd.Timedelta): The first instant of the grid
+        interval (pd.Timedelta): The grid spacing
+        initial_position (float): Where the tip starts
+        velocity (float): In micrometres per second
+        stationary_for (pd.Timedelta): How long the tip waits before moving
+        out (Optional[np.ndarray]): Where to write the position
 
-    return combined
+    Returns:
+        np.ndarray: The position at each instant
+    """
+    # Integer nanoseconds, so that snapping to the grid is exact
+    since_start = instants.asi8 - start.value - stationary_for.value
+    moving = since_start >= 0
+    # Snap to the grid, in place
+    on_grid = since_start
+    on_grid //= interval.value
+    on_grid *= interval.value
+    on_grid += start.value
+    # As `TimedeltaIndex.total_seconds`
+    travelled = np.divide(on_grid, 1e9, out=out)
+    travelled *= velocity
+    travelled[~moving] = 0
+    travelled += initial_position
+    return travelled
+
+
+def row_interval(instants: pd.TimedeltaIndex) -> pd.Timedelta:
+    """How far apart resampled rows are, for when it isn't given.
+    Resampled frames know their frequency, but ones read back from the cache don't, so otherwise assume a regular grid.
+    A single row has no spacing to go by, so its instant is taken as it is
+    """
+    if instants.freq is not None:
+        return pd.Timedelta(instants.freq)
+    if len(instants) > 1:
+        return instants[1] - instants[0]
+    return pd.Timedelta(1, "ns")
 
 
 def generate_normal_force_and_correct_for_load_positioning(
@@ -137,157 +373,303 @@ def generate_normal_force_and_correct_for_load_positioning(
     angle_beta: float,
     substrate_tip_velocity: float,  # micrometres per second
     flexural_rigidity: float,
-    duration_subtrate_tip_is_stationary_for: pd.Timedelta = pd.Timedelta(5, "seconds")
+    duration_subtrate_tip_is_stationary_for: pd.Timedelta = pd.Timedelta(5, "seconds"),
     # pipette_position_at_rest: Optional[float] = None,
+    start: Optional[pd.Timedelta] = None,
+    interval: Optional[pd.Timedelta] = None,
+    initial_pipette_y_position: Optional[float] = None,
+    dtype: Any = np.float64,
 ):
-    # Pretend we're at a constant velocity for the whole thing (in micrometers per second)
-    df["Substrate_Tip_Position"] = df.index.total_seconds() * substrate_tip_velocity
-    shifted = pd.DataFrame(
-        df["Substrate_Tip_Position"].shift(freq=duration_subtrate_tip_is_stationary_for)
-    )
-    # Now shift our line to the right, because we're stationary for the first n seconds
-    df = pd.merge_asof(
-        df.reset_index().drop(columns="Substrate_Tip_Position"),
-        shifted.reset_index(),
-        on="Instant",
+    """Add the substrate tip's position, and the forces acting on it.
+    Everything is computed in one preallocated block, so peak memory is little more than the size of the result
+
+    Args:
+        df (pd.DataFrame): Resampled frames, as returned by `merge_and_displace_frames`
+        start (Optional[pd.Timedelta]): The first instant of the experiment. Defaults to the first row's. Give this (and `interval`, `initial_pipette_y_position`) when `df` is only part of an experiment
+        interval (Optional[pd.Timedelta]): How long each row lasts for. Defaults to the index's frequency,
+            or the spacing of its first two rows
+        initial_pipette_y_position (Optional[float]): Where the pipette was at `start`. Defaults to the first row's
+        dtype (Any): Of the result. `np.float32` halves its memory, at the cost of precision
+
+    Returns:
+        pd.DataFrame: A new DataFrame, with the extra columns
+    """
+    if start is None:
+        start = df.index[0]
+    if interval is None:
+        interval = row_interval(df.index)
+    if initial_pipette_y_position is None:
+        initial_pipette_y_position = df["Pipette_Y_Position"].iloc[0]
+
+    # One block for the input columns and the new ones, which becomes the result without being copied again.
+    # Each new column is written in place, in the same order of operations as the textbook formulas,
+    # and unfinished columns double as scratch space, so there are no temporaries
+    inputs = [column for column in df.columns if column not in FORCE_COLUMNS]
+    columns = [*inputs, *FORCE_COLUMNS]
+    block = np.empty((len(columns), len(df)), dtype=dtype)
+    for row, column in zip(block, inputs):
+        row[:] = df[column].to_numpy()
+    (
+        x_delta,
+        pipette_y_position,
+        tip,
+        corrected_deflection,
+        normal_force,
+        pipette_deflection,
+        friction_force,
+        friction_coefficient,
+    ) = (
+        block[columns.index(column)]
+        for column in ["X_Delta", "Pipette_Y_Position", *FORCE_COLUMNS]
     )
-    df.set_index("Instant", inplace=True)
-    # Fill in the missing values (add a flat section to the line)
-    df["Substrate_Tip_Position"].fillna(0, inplace=True)
-    # Translate up the y axis
-    df["Substrate_Tip_Position"] = (
-        df["Substrate_Tip_Position"] + initial_substrate_tip_position
+
+    substrate_tip_position(
+        instants=df.index,
+        start=start,
+        interval=interval,
+        initial_position=initial_substrate_tip_position,
+        velocity=substrate_tip_velocity,
+        stationary_for=duration_subtrate_tip_is_stationary_for,
+        out=tip,
     )
 
-    displaced_x_delta = df["X_Delta"] / cos(angle_beta) + initial_x_displacement
-    bead_to_tip_displacement = df["Pipette_Y_Position"] - df["Substrate_Tip_Position"]
-
-    length_from_the_tip = length_of_substrate - bead_to_tip_displacement
-    df["Corrected_Deflection"] = (
-        displaced_x_delta
-        * stiffness_constant_of_substrate
-        * length_from_the_tip
-        * length_from_the_tip
-        * (3 * length_of_substrate - length_from_the_tip)
-        / (6 * flexural_rigidity * 10 ** 16)
+    force_model(
+        x_delta=x_delta,
+        pipette_y_position=pipette_y_position,
+        initial_pipette_y_position=initial_pipette_y_position,
+        initial_x_displacement=initial_x_displacement,
+        length_of_substrate=length_of_substrate,
+        stiffness_constant_of_substrate=stiffness_constant_of_substrate,
+        stiffness_constant_of_pipette=stiffness_constant_of_pipette,
+        reverse_sliding_direction=reverse_sliding_direction,
+        angle_alpha=angle_alpha,
+        angle_beta=angle_beta,
+        flexural_rigidity=flexural_rigidity,
+        out=(
+            tip,
+            corrected_deflection,
+            normal_force,
+            pipette_deflection,
+            friction_force,
+            friction_coefficient,
+        ),
     )
-    df["Normal_Force"] = df["Corrected_Deflection"] * stiffness_constant_of_substrate
 
-    if angle_alpha > 0:
-        holder = cos(angle_alpha)
-    else:
-        holder = 1
+    # `block.T` is a view, so this doesn't copy either
+    return pd.DataFrame(block.T, index=df.index, columns=columns, copy=False)
+
+
+def force_model(
+    x_delta: np.ndarray,
+    pipette_y_position: np.ndarray,
+    initial_pipette_y_position: Any,
+    initial_x_displacement: Any,
+    length_of_substrate: Any,
+    stiffness_constant_of_substrate: Any,
+    stiffness_constant_of_pipette: Any,
+    reverse_sliding_direction: bool,
+    angle_alpha: Any,
+    angle_beta: Any,
+    flexural_rigidity: Any,
+    out: Sequence[np.ndarray],
+):
+    """The forces acting on the substrate tip, written in place into `out`, without temporaries.
+    Parameters can be numbers, or arrays that broadcast against the rows, to evaluate many sets of them at once (see `sweep`)
+
+    Args:
+        x_delta (np.ndarray): Of each row
+        pipette_y_position (np.ndarray): Of each row
+        out (Sequence[np.ndarray]): One array for each of `FORCE_COLUMNS`, the first already holding the substrate tip's position
+    """
+    (
+        tip,
+        corrected_deflection,
+        normal_force,
+        pipette_deflection,
+        friction_force,
+        friction_coefficient,
+    ) = out
+
+    # Length from the tip, as `length_of_substrate - bead_to_tip_displacement`
+    length_from_the_tip = pipette_deflection
+    np.subtract(pipette_y_position, tip, out=length_from_the_tip)
+    np.subtract(length_of_substrate, length_from_the_tip, out=length_from_the_tip)
+
+    # Displaced x delta, then the beam deflection
+    np.divide(x_delta, cos(angle_beta), out=corrected_deflection)
+    corrected_deflection += initial_x_displacement
+    corrected_deflection *= stiffness_constant_of_substrate
+    corrected_deflection *= length_from_the_tip
+    corrected_deflection *= length_from_the_tip
+    np.subtract(3 * length_of_substrate, length_from_the_tip, out=normal_force)
+    corrected_deflection *= normal_force
+    corrected_deflection /= 6 * flexural_rigidity * 10 ** 16
+
+    np.multiply(corrected_deflection, stiffness_constant_of_substrate, out=normal_force)
+
+    holder = np.where(np.greater(angle_alpha, 0), cos(angle_alpha), 1)
 
     if reverse_sliding_direction is True:  # user said -d
-        df["Pipette_Deflection"] = (
-            df["Pipette_Y_Position"] - df["Pipette_Y_Position"].iloc[0]
-        ) / holder
+        np.subtract(
+            pipette_y_position, initial_pipette_y_position, out=pipette_deflection
+        )
     else:  # user didn't say -d
-        df["Pipette_Deflection"] = (
-            df["Pipette_Y_Position"].iloc[0] - df["Pipette_Y_Position"]
-        ) / holder
+        np.subtract(
+            initial_pipette_y_position, pipette_y_position, out=pipette_deflection
+        )
+    pipette_deflection /= holder
 
-    df["Friction_Force"] = (
-        df["Pipette_Deflection"] / cos(angle_beta) * stiffness_constant_of_pipette
-    )
+    np.divide(pipette_deflection, cos(angle_beta), out=friction_force)
+    friction_force *= stiffness_constant_of_pipette
 
-    df["Friction_Coefficient"] = df["Friction_Force"] / df["Normal_Force"]
+    np.divide(friction_force, normal_force, out=friction_coefficient)
 
-    return df
 
+def rolling_statistics(values: np.ndarray, window: int) -> Dict[str, np.ndarray]:
+    """Mean, standard deviation (as pandas'), minimum and maximum of each `window` rows up to and including each row,
+    as `pd.Series(values).rolling(window)` gives, in O(n) whatever the window.
+    The mean and standard deviation come from running sums, and the minimum and maximum from running extremes within
+    blocks of `window` rows, which any window straddles at most two of (van Herk/Gil-Werman).
+    The first `window - 1` rows, and windows with a NaN or infinite value, are NaN
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="""
-    Given a string, this program will
-    - Read substrate*.csv, reference*.csv and pipette*.csv, where each filename contains that string
-    - Convert them to timeseries, and concatenate
-    - Resample
-    - Do some basic analysis
-    """,
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-    )
-    parser.add_argument(
-        "-c",
-        "--filename-contains",
-        type=str,
-        help="""Look for the substrate, reference and pipette csvs which have their filenames containing this number""",
-    )
-    parser.add_argument(
-        "-f",
-        "--folder",
-        type=Path,
-        default=Path.cwd(),
-        help="The folder to look in. Defaults to the current working directory",
-    )
-    parser.add_argument(
-        "-e",
-        "--experiment-duration",
-        type=float,
-        help="Duration of this experiment, in seconds",
-        required=True,
-    )
-    parser.add_argument(
-        "-r",
-        "--resample-to",
-        type=float,
-        help="How many seconds each row should last for after resampling",
-        required=True,
+    Returns:
+        Dict[str, np.ndarray]: "Mean", "Std", "Min" and "Max", each as long as `values`
+    """
+    n = len(values)
+    statistics = {name: np.full(n, np.nan) for name in ("Mean", "Std", "Min", "Max")}
+    if window < 1 or window > n:
+        return statistics
+    # Each statistic is written in place, in its own array, to keep temporaries to a minimum
+    mean, std, minimum, maximum = (
+        statistic[window - 1 :] for statistic in statistics.values()
     )
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    all_finite = finite.all()
+
+    def window_sums(x: np.ndarray) -> np.ndarray:
+        sums = np.cumsum(x)
+        sums[window:] -= sums[:-window].copy()
+        return sums[window - 1 :]
+
+    # Sums of values close to 0 lose less precision when differenced
+    if all_finite:
+        offset = values.mean()
+    else:
+        offset = values[finite].mean() if finite.any() else 0
+    centred = values - offset
+    if not all_finite:
+        centred[~finite] = 0
+    total, total_of_squares = window_sums(centred), window_sums(centred * centred)
+    np.divide(total, window, out=mean)
+    if window > 1:
+        total *= mean
+        np.subtract(total_of_squares, total, out=std)
+        std /= window - 1
+        np.sqrt(np.maximum(std, 0, out=std), out=std)
+    mean += offset
+
+    # Running extremes within each block of `window` rows, from the left and from the right.
+    # The window ending at row i starts at i - window + 1, so covers the end of one block and the start of the next
+    blocks = -(-n // window)
+    for extreme, out, padding in [
+        (np.minimum, minimum, np.inf),
+        (np.maximum, maximum, -np.inf),
+    ]:
+        padded = values
+        if blocks * window != n:
+            padded = np.full(blocks * window, padding)
+            padded[:n] = values
+        from_left = extreme.accumulate(padded.reshape(blocks, window), axis=1).ravel()
+        # Reversing the whole array reverses each block, and their order
+        from_right = extreme.accumulate(
+            padded[::-1].reshape(blocks, window), axis=1
+        ).ravel()[::-1]
+        extreme(from_right[: n - window + 1], from_left[window - 1 : n], out=out)
+
+    if not all_finite:
+        incomplete = window_sums((~finite).astype(np.int64)) > 0
+        for statistic in (mean, std, minimum, maximum):
+            statistic[incomplete] = np.nan
+    return statistics
+
+
+def add_rolling_statistics(
+    df: pd.DataFrame, window: int, columns: Sequence[str] = ROLLING_COLUMNS
+) -> pd.DataFrame:
+    """Add <column>_Rolling_Mean, _Rolling_Std, _Rolling_Min and _Rolling_Max for each of `columns` (see `rolling_statistics`)"""
+    with profiling.stage("rolling") as counts:
+        for column in columns:
+            dtype = df[column].dtype
+            for name, statistic in rolling_statistics(
+                df[column].to_numpy(), window
+            ).items():
+                df[f"{column}_Rolling_{name}"] = statistic.astype(dtype, copy=False)
+        counts["rows"] = len(df)
+    return df
 
-    parser.add_argument("-x", "--initial-x-displacement", type=float, required=True)
-    parser.add_argument("-t", "--substrate-tip-position", type=float, required=True)
-    parser.add_argument("-L", "--substrate-length", type=float, required=True)
-    parser.add_argument("-k", "--substrate-stiffness", type=float, required=True)
-    parser.add_argument("-j", "--pipette-stiffness", type=float, required=True)
-    # parser.add_argument("-R", "--pipette-position-at-rest", type=float, default=None, required=False)
-    parser.add_argument("-a", "--angle-alpha", type=float, default=None, required=False)
-    parser.add_argument("-b", "--angle-beta", type=float, default=None, required=False)
-    parser.add_argument("-s", "--speed", type=float, default=None, required=False)
-    parser.add_argument(
-        "-fr", "--flexural-rigidity", type=float, default=None, required=False
-    )
-    parser.add_argument(
-        "-d", "--reverse-sliding-direction", default=False, action="store_true"
-    )
-    parser.add_argument(
-        "-O",
-        "--overwrite",
-        default=False,
-        action="store_true",
-        help="If the output filename already exists, ovewrite it. Else, the program will raise an error",
-    )
-    parser.add_argument(
-        "-l",
-        "--log-level",
-        type=lambda x: getattr(logging, x.upper()),
-        default=logging.INFO,
-        help="How verbose to be",
-    )
-    args = parser.parse_args()
-
-    logging.basicConfig(level=args.log_level)
-
-    logger.debug(f"Arguments: {args}")
-
-    analyse_csv(
-        filename=args.filename_contains,
-        folder=args.folder,
-        experiment_duration=args.experiment_duration,
-        resample_to=args.resample_to,
-        initial_x_displacement=args.initial_x_displacement,
-        substrate_tip_position=args.substrate_tip_position,
-        length_of_substrate=args.substrate_length,
-        stiffness_constant_of_substrate=args.substrate_stiffness,
-        stiffness_constant_of_pipette=args.pipette_stiffness,
-        reverse_sliding_direction=args.reverse_sliding_direction,
-        angle_alpha=args.angle_alpha,
-        angle_beta=args.angle_beta,
-        speed=args.speed,
-        flexural_rigidity=args.flexural_rigidity,
-        # pipette_position_at_rest=args.pipette_position_at_rest,
-        overwrite=args.overwrite,
-    )
+
+def detect_slips(
+    series: pd.Series, start_rate: float, end_rate: float, min_drop: float = 0
+) -> pd.DataFrame:
+    """Find stick-slip events: where `series` drops faster than `start_rate` per second, until it drops slower than `end_rate`.
+    Having `end_rate` below `start_rate` (hysteresis) keeps a noisy slip from being split into many.
+    Everything is done with whole-array operations, so 10M rows take well under a second
+
+    Args:
+        series (pd.Series): e.g Friction_Force, indexed by instant as `generate_normal_force_and_correct_for_load_positioning`'s result
+        start_rate (float): How fast a drop starts a slip, in units of `series` per second (positive)
+        end_rate (float): How slow a drop has to get for a slip to end, at most `start_rate`
+        min_drop (float): Leave out slips that drop less than this in all
+
+    Returns:
+        pd.DataFrame: One row per slip, with its Start and End instant, Duration, Start_Value, End_Value, Drop and Peak_Rate
+    """
+    assert (
+        0 <= end_rate <= start_rate
+    ), f"Slips must end at a lower rate ({end_rate}) than they start at ({start_rate})"
+    with profiling.stage("slips") as counts:
+        instants = series.index.asi8
+        values = series.to_numpy(dtype=np.float64)
+        # How fast it is falling at each row, per second
+        rate = -np.gradient(values, instants / 1e9) if len(values) > 1 else values * 0
+        # Rows where the state is decided are above `start_rate` (slipping) or below `end_rate` (not).
+        # Every other row keeps the state of the last decided row before it
+        decided = (rate > start_rate) | (rate <= end_rate) | np.isnan(rate)
+        last_decided = np.maximum.accumulate(np.where(decided, np.arange(len(rate)), 0))
+        slipping = np.where(
+            decided[last_decided], rate[last_decided] > start_rate, False
+        )
+
+        edges = np.diff(slipping.astype(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        # The last row of each slip
+        ends = np.flatnonzero(edges == -1) - 1
+        # The rate at each row is centred on it, so a slip runs from the row before its first fast one
+        starts = np.maximum(starts - 1, 0)
+        ends = np.minimum(ends + 1, len(values) - 1)
+
+        # The fastest drop from each start to its end. The odd entries are the gaps between slips
+        bounds = np.column_stack([starts, ends + 1]).ravel()
+        padded = np.append(np.nan_to_num(rate, nan=-np.inf), -np.inf)
+        peak_rates = (
+            np.maximum.reduceat(padded, bounds)[::2] if len(starts) else np.empty(0)
+        )
+        events = pd.DataFrame(
+            {
+                "Start": pd.to_timedelta(instants[starts]),
+                "End": pd.to_timedelta(instants[ends]),
+                "Start_Value": values[starts],
+                "End_Value": values[ends],
+                "Peak_Rate": peak_rates,
+            }
+        )
+        events.insert(2, "Duration", events["End"] - events["Start"])
+        events.insert(5, "Drop", events["Start_Value"] - events["End_Value"])
+        events = events[events["Drop"] >= min_drop].reset_index(drop=True)
+        counts.update(rows=len(values), slips=len(events))
+    logger.info(f"Found {len(events)} slips in {series.name}")
+    return events
 
 
 def glob_once(folder: Path, pattern: str):
@@ -299,6 +681,83 @@ def glob_once(folder: Path, pattern: str):
     return destination_path
 
 
+def read_and_merge(
+    substrate_path: Path,
+    reference_path: Path,
+    pipette_path: Path,
+    experiment_duration: float,
+    resample_to: float,
+    cache_dir: Optional[Path] = None,
+    max_cache_size: int = cache.DEFAULT_CACHE_SIZE,
+    resample_engine: str = "pandas",
+) -> pd.DataFrame:
+    """Everything before the force model: read the three CSVs, and `merge_and_displace_frames` them.
+    With a `cache_dir`, the merged frame is kept there too, so that later runs with the same CSVs,
+    `experiment_duration`, `resample_to` and `resample_engine` (e.g only changing the force model) skip straight to it"""
+    sources = [substrate_path, reference_path, pipette_path]
+    if cache_dir is not None:
+        parameters = dict(
+            experiment_duration=experiment_duration,
+            resample_to=resample_to,
+            resample_engine=resample_engine,
+        )
+        key = cache.derived_key("merged", sources, parameters)
+        entry = cache.lookup(cache_dir, f"{key}.npz")
+        if entry is not None:
+            try:
+                with profiling.stage("load_merged") as counts:
+                    merged = results.load_npz(entry)
+                    counts.update(rows=len(merged), bytes=entry.stat().st_size)
+            except FileNotFoundError:
+                # Another process evicted it since we looked it up
+                logger.debug("Cached merged frame vanished, merging again")
+            else:
+                logger.info(f"Loaded cached merged frame ({len(merged)} rows)")
+                return merged
+
+    def read(path: Path):
+        with profiling.stage("read") as counts:
+            df = read_displacement_csv(
+                path, cache_dir=cache_dir, max_cache_size=max_cache_size
+            )
+            counts.update(rows=len(df), bytes=path.stat().st_size)
+        return df
+
+    substrate, reference, pipette = (
+        read(substrate_path),
+        read(reference_path),
+        read(pipette_path),
+    )
+    with profiling.stage("merge") as counts:
+        merged = merge_and_displace_frames(
+            substrate=substrate,
+            reference=reference,
+            pipette=pipette,
+            experiment_duration=pd.Timedelta(value=experiment_duration, unit="seconds"),
+            duration_of_resampled_row=pd.Timedelta(value=resample_to, unit="seconds"),
+            engine=resample_engine,
+        )
+        counts["rows"] = len(merged)
+
+    if cache_dir is not None:
+        description = ", ".join(
+            [
+                *(path.as_posix() for path in sources),
+                *(f"{name}={value}" for name, value in parameters.items()),
+            ]
+        )
+        cache.store(
+            cache_dir=cache_dir,
+            key=f"{key}.npz",
+            write=lambda file: results.save_npz(
+                file, merged, description=np.array(description)
+            ),
+            max_size=max_cache_size,
+            replaces=f"{key.rsplit('-', 1)[0]}-*.npz",  # From older versions of these CSVs
+        )
+    return merged
+
+
 def analyse_csv(
     filename: str,
     folder: Path,  # yes
@@ -316,23 +775,47 @@ def analyse_csv(
     flexural_rigidity: float,
     # pipette_position_at_rest: Optional[float],
     overwrite: bool,
+    cache_dir: Optional[Path] = None,
+    max_cache_size: int = cache.DEFAULT_CACHE_SIZE,
+    chunk_size: Optional[int] = None,
+    resample_engine: str = "pandas",
+    dtype: Any = np.float64,
+    output_format: str = "csv",
+    watch: bool = False,
+    frame_rate: Optional[float] = None,
+    poll_interval: float = 1,
+    idle_timeout: Optional[float] = None,
+    rolling_window: Optional[float] = None,
+    slip_rates: Optional[Tuple[float, float]] = None,
+    min_slip_drop: float = 0,
+    slip_column: str = "Friction_Force",
+    write_preview: bool = False,
 ):
-    """This function does the entire analysis for one experiment"""
-
-    substrate_path = glob_once(folder, f"substrate_{filename}.csv")
-    reference_path = glob_once(folder, f"reference_{filename}.csv")
-    pipette_path = glob_once(folder, f"pipette_{filename}.csv")
-
-    merged_and_displaced = merge_and_displace_frames(
-        substrate=read_displacement_csv(substrate_path),
-        reference=read_displacement_csv(reference_path),
-        pipette=read_displacement_csv(pipette_path),
-        experiment_duration=pd.Timedelta(value=experiment_duration, unit="seconds"),
-        duration_of_resampled_row=pd.Timedelta(value=resample_to, unit="seconds"),
-    )
+    """This function does the entire analysis for one experiment.
+    If `chunk_size` is given, the CSVs are streamed that many rows at a time (and the cache isn't used).
+    If `watch` is given, the CSVs are followed as they grow (see `live.analyse_live`).
+    If `rolling_window` (in seconds) is given, the result gets rolling statistics (see `add_rolling_statistics`).
+    If `slip_rates` (start and end, per second) are given, slips in `slip_column` are written to slips_<filename>.csv (see `detect_slips`).
+    If `write_preview` is given, a preview for plotting is written to preview_<filename> (see `preview.write_preview`).
+    The result is written to processed_<filename>.<output_format> (see `results.FORMATS`)"""
+
+    with profiling.stage("glob") as counts:
+        substrate_path = glob_once(folder, f"substrate_{filename}.csv")
+        reference_path = glob_once(folder, f"reference_{filename}.csv")
+        pipette_path = glob_once(folder, f"pipette_{filename}.csv")
+        counts["files"] = 3
+
+    output_format = results.resolve_format(output_format)
+    output_file = results.result_path(folder, filename, output_format)
+    if output_file.exists():
+        assert output_file.is_file()
+    check_overwrite(output_file, overwrite)
+    if slip_rates is not None:
+        check_overwrite(results.slips_path(folder, filename), overwrite)
+    if write_preview:
+        check_overwrite(preview.preview_path(folder, filename), overwrite)
 
-    result = generate_normal_force_and_correct_for_load_positioning(
-        df=merged_and_displaced,
+    force_model = dict(
         initial_x_displacement=initial_x_displacement,
         initial_substrate_tip_position=substrate_tip_position,
         length_of_substrate=length_of_substrate,
@@ -344,14 +827,114 @@ def analyse_csv(
         substrate_tip_velocity=speed,
         flexural_rigidity=flexural_rigidity,
         # pipette_position_at_rest=pipette_position_at_rest,
+        dtype=dtype,
     )
 
-    output_file = folder.joinpath(f"processed_{filename}.csv")
-    if output_file.exists():
-        assert output_file.is_file()
+    if chunk_size is not None:
+        # Including Parquet without pyarrow, which falls back to npz
         assert (
-            overwrite is True
-        ), f"About to write over existing file {output_file}, but `--overwrite` not specified"
-        logger.warn(f"Overwriting file {output_file.as_posix()}")
+            output_format in results.STREAMABLE_FORMATS
+        ), f"`--chunk-size` can only write {' or '.join(results.STREAMABLE_FORMATS)}, not {output_format}"
+    if rolling_window is not None or slip_rates is not None:
+        assert (
+            not watch and chunk_size is None
+        ), "Rolling statistics and slips need the whole recording, so can't be used with `--watch` or `--chunk-size`"
+    assert not (watch and write_preview), "A preview can't be written while watching"
+
+    if watch:
+        from .live import analyse_live
+
+        assert frame_rate is not None, "`--watch` needs `--frame-rate`"
+        assert output_format == "csv", "`--watch` can only write csv"
+        analyse_live(
+            substrate=substrate_path,
+            reference=reference_path,
+            pipette=pipette_path,
+            output_file=output_file,
+            frame_rate=frame_rate,
+            duration_of_resampled_row=pd.Timedelta(value=resample_to, unit="seconds"),
+            poll_interval=poll_interval,
+            idle_timeout=idle_timeout,
+            **force_model,
+        )
+        return
+
+    if chunk_size is not None:
+        from .streaming import analyse_in_chunks
+
+        # Reading, merging and the force model are interleaved, chunk by chunk
+        with profiling.stage("stream") as counts:
+            analyse_in_chunks(
+                substrate=substrate_path,
+                reference=reference_path,
+                pipette=pipette_path,
+                output_file=output_file,
+                experiment_duration=pd.Timedelta(
+                    value=experiment_duration, unit="seconds"
+                ),
+                duration_of_resampled_row=pd.Timedelta(
+                    value=resample_to, unit="seconds"
+                ),
+                chunk_size=chunk_size,
+                output_format=output_format,
+                **force_model,
+            )
+            counts["bytes"] = output_file.stat().st_size
+        if write_preview:
+            # Only the columns it needs, which CSV and Parquet read without the rest
+            preview.write_preview(
+                results.read_result(output_file, columns=list(preview.PREVIEW_COLUMNS)),
+                preview.preview_path(folder, filename),
+                interval=pd.Timedelta(value=resample_to, unit="seconds"),
+            )
+        return
+
+    merged_and_displaced = read_and_merge(
+        substrate_path=substrate_path,
+        reference_path=reference_path,
+        pipette_path=pipette_path,
+        experiment_duration=experiment_duration,
+        resample_to=resample_to,
+        cache_dir=cache_dir,
+        max_cache_size=max_cache_size,
+        resample_engine=resample_engine,
+    )
 
-    result.to_csv(output_file)
+    with profiling.stage("force_model") as counts:
+        result = generate_normal_force_and_correct_for_load_positioning(
+            df=merged_and_displaced,
+            interval=pd.Timedelta(value=resample_to, unit="seconds"),
+            **force_model,
+        )
+        counts["rows"] = len(result)
+
+    if rolling_window is not None:
+        window = round(rolling_window / resample_to)
+        logger.info(f"Rolling statistics over {window} rows")
+        result = add_rolling_statistics(result, window)
+
+    if slip_rates is not None:
+        slips = detect_slips(result[slip_column], *slip_rates, min_drop=min_slip_drop)
+        results.write_slips(slips, results.slips_path(folder, filename))
+
+    with profiling.stage("write") as counts:
+        results.write_result(result, output_file, output_format)
+        counts.update(rows=len(result), bytes=output_file.stat().st_size)
+
+    if write_preview:
+        preview.write_preview(
+            result,
+            preview.preview_path(folder, filename),
+            interval=pd.Timedelta(value=resample_to, unit="seconds"),
+        )
+
+
+def check_overwrite(path: Path, overwrite: bool):
+    """Refuse to write over something `analyse_csv` wrote before, unless `overwrite`.
+    Checked before any analysis, so nothing is lost to a forgotten `--overwrite`
+    """
+    if path.exists():
+        assert (
+            overwrite is True
+        ), f"About to write over existing file {path}, but `--overwrite` not specified"
+        logger.warn(f"Overwriting file {path.as_posix()}")
@@ -0,0 +1,108 @@
+import concurrent.futures
+import logging
+import os
+import re
+
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Tuple
+
+from . import profiling
+
+logger = logging.getLogger(__name__)
+
+# What `tiff_stacker` calls the stacks it makes
+STACK_NAME = re.compile(r"stack\d+\.tif")
+
+
+def natural_key(name: str) -> Tuple[Any, ...]:
+    """Sort key which compares runs of digits as numbers, so `image999.tif` comes before `image1000.tif`"""
+    # Splitting on digits alternates text and numbers, always starting with text, so keys only ever compare like with like
+    parts = re.split(r"(\d+)", name)
+    parts[1::2] = map(int, parts[1::2])
+    # `name` breaks ties like `image01.tif` and `image1.tif`
+    return (parts, name)
+
+
+def scan_tifs(folder: Path, order: str = "natural", jobs: int = 8) -> Iterator[Path]:
+    """Every TIF in a folder and its sub-folders, other than stacks that `tiff_stacker` made.
+    Uses `os.scandir`, whose entries already know whether they are files or folders on most filesystems,
+    rather than asking the filesystem about each one. Sub-folders are listed in the background while earlier ones are yielded,
+    so the first files come straight away, even from folders of hundreds of thousands of files on a network filesystem
+
+    Args:
+        folder (Path): Where to look
+        order (str): "natural", as `natural_key`, or "name" for the same order as sorting the paths
+        jobs (int): How many folders to list at once
+
+    Yields:
+        Path: Each TIF, in order. Files and sub-folders sort together by name, as `sorted(folder.glob("**/*.tif"))` does
+    """
+    for entry in _entries(folder, order, jobs, sizes=False):
+        yield Path(entry.path)
+
+
+def scan_tif_sizes(
+    folder: Path, order: str = "natural", jobs: int = 8
+) -> Iterator[Tuple[Path, int]]:
+    """As `scan_tifs`, along with each TIF's size in bytes.
+    Getting the sizes needs a `stat` of each file, which are done in the background along with the listing
+
+    Yields:
+        Tuple[Path, int]: Each TIF, and how big it is
+    """
+    for entry in _entries(folder, order, jobs, sizes=True):
+        # Already fetched, as `DirEntry` keeps it
+        yield Path(entry.path), entry.stat().st_size
+
+
+def _entries(folder: Path, order: str, jobs: int, sizes: bool) -> Iterator[os.DirEntry]:
+    key = {"natural": natural_key, "name": str}[order]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from _walk(
+            executor, executor.submit(_scan, folder, key, sizes), key, sizes
+        )
+
+
+def _walk(
+    executor: concurrent.futures.Executor,
+    listing: "concurrent.futures.Future[List[os.DirEntry]]",
+    key: Callable[[str], Any],
+    sizes: bool,
+) -> Iterator[os.DirEntry]:
+    entries = listing.result()
+    # Start listing the sub-folders while we go through this one
+    subfolders = {
+        entry.path: executor.submit(_scan, Path(entry.path), key, sizes)
+        for entry in entries
+        if entry.is_dir(follow_symlinks=False)
+    }
+    for entry in entries:
+        if entry.path in subfolders:
+            yield from _walk(executor, subfolders[entry.path], key, sizes)
+        else:
+            yield entry
+
+
+def _scan(folder: Path, key: Callable[[str], Any], sizes: bool) -> List[os.DirEntry]:
+    """The folder's TIFs and sub-folders, in order"""
+    with profiling.stage("discover") as counts:
+        entries = []
+        try:
+            with os.scandir(folder) as iterator:
+                for entry in iterator:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append(entry)
+                    elif entry.name.endswith(".tif") and entry.is_file():
+                        if STACK_NAME.fullmatch(entry.name):
+                            logger.info(f"Skipping {entry.path}, which is a stack")
+                            continue
+                        if sizes:
+                            # Here, in the background, rather than when it is yielded. The entry keeps it
+                            entry.stat()
+                        entries.append(entry)
+        except PermissionError:
+            # As `glob` does
+            logger.warning(f"Can't list {folder}, skipping it")
+        entries.sort(key=lambda entry: key(entry.name))
+        counts["files"] = len(entries)
+    return entries
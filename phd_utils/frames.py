@@ -0,0 +1,150 @@
+import json
+import logging
+import mmap
+import os
+
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from . import tiff
+from .discovery import natural_key
+from .results import atomic_path
+
+logger = logging.getLogger(__name__)
+
+# Next to each stack, e.g stack0.index.json for stack0.tif
+INDEX_SUFFIX = ".index.json"
+
+
+class Frame(NamedTuple):
+    # The file the frame came from, relative to the folder, and which of its pages it was
+    source: str
+    source_page: int
+    # Where it is now
+    stack: str
+    page: int
+    # Where the page's IFD is in the stack, and each of its strips (or tiles)
+    ifd: int
+    data: List[Tuple[int, int]]
+
+
+def index_path(stack: Path) -> Path:
+    return stack.with_suffix(INDEX_SUFFIX)
+
+
+def write_index(
+    stack: Path, sources: List[Path], pages_per_source: Optional[List[int]] = None
+):
+    """Record where each of the sources' pages ended up in the stack, so `StackReader` can go straight to them.
+    Durable by the time this returns
+
+    Args:
+        stack (Path): A stack that has been made (and verified)
+        sources (List[Path]): What it was made from, in order
+        pages_per_source (Optional[List[int]]): How many pages each source had. Defaults to one each
+    """
+    if pages_per_source is None:
+        pages_per_source = [1] * len(sources)
+    with tiff.mapped(stack) as buffer:
+        pages = list(tiff.read_pages(buffer, name=stack.as_posix()))
+    origins = [
+        (source.relative_to(stack.parent).as_posix(), source_page)
+        for source, count in zip(sources, pages_per_source)
+        for source_page in range(count)
+    ]
+    assert len(origins) == len(
+        pages
+    ), f"{stack} has {len(pages)} pages, but its sources have {len(origins)}"
+
+    index = [
+        Frame(source, source_page, stack.name, number, page.ifd, page.data)._asdict()
+        for number, ((source, source_page), page) in enumerate(zip(origins, pages))
+    ]
+    with atomic_path(index_path(stack)) as temporary:
+        with temporary.open("w") as file:
+            json.dump(index, file)
+            file.flush()
+            os.fsync(file.fileno())
+    logger.debug(f"Indexed the {len(index)} pages of {stack}")
+
+
+def read_index(folder: Path) -> List[Frame]:
+    """Every frame in the folder's stacks, in the order they were stacked in, so a frame's number is its position"""
+    frames: List[Frame] = []
+    paths = sorted(
+        folder.glob(f"stack*{INDEX_SUFFIX}"), key=lambda path: natural_key(path.name)
+    )
+    for path in paths:
+        with path.open() as file:
+            frames.extend(
+                Frame(**{**entry, "data": [tuple(strip) for strip in entry["data"]]})
+                for entry in json.load(file)
+            )
+    return frames
+
+
+class StackReader:
+    """Frames from a folder's stacks, by frame number (their position in the order they were stacked in),
+    or by the file they came from.
+    Each stack is mapped into memory the first time one of its frames is asked for, and only that frame's bytes are read,
+    so getting a frame takes the same time however big the stacks are
+
+    Use as a context manager, or call `close`
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.frames = read_index(folder)
+        self._numbers = {
+            (frame.source, frame.source_page): number
+            for number, frame in enumerate(self.frames)
+        }
+        self._buffers: Dict[str, mmap.mmap] = {}
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __enter__(self) -> "StackReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for buffer in self._buffers.values():
+            buffer.close()
+        self._buffers.clear()
+
+    def number(self, source: str, source_page: int = 0) -> int:
+        """The frame number of a file that was stacked, by its path relative to the folder"""
+        return self._numbers[(source, source_page)]
+
+    def raw(self, number: int) -> bytes:
+        """A frame's image data as it is stored, i.e the pixels if it is uncompressed"""
+        frame = self.frames[number]
+        buffer = self._buffer(frame.stack)
+        return b"".join(
+            buffer[offset : offset + length] for offset, length in frame.data
+        )
+
+    def page(self, number: int) -> tiff.Page:
+        """A frame's TIFF tags, read from its IFD alone"""
+        frame = self.frames[number]
+        buffer = self._buffer(frame.stack)
+        byte_order, layout, _ = tiff.read_header(buffer, name=frame.stack)
+        page, _ = tiff.read_page(buffer, frame.ifd, byte_order, frame.stack, layout)
+        return page
+
+    def pixels(self, number: int) -> bytes:
+        """A frame's pixels, decoded as `tiff.decode` does"""
+        frame = self.frames[number]
+        return tiff.decode(self._buffer(frame.stack), self.page(number))
+
+    def _buffer(self, stack: str) -> mmap.mmap:
+        if stack not in self._buffers:
+            with (self.folder / stack).open("rb") as file:
+                # The mapping stays open after the file is closed
+                self._buffers[stack] = mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        return self._buffers[stack]
@@ -0,0 +1,249 @@
+import io
+import logging
+import time
+
+from pathlib import Path
+from typing import Dict, Generator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .csv_analyser import (
+    DISPLACEMENT_COLUMNS,
+    _read_displacement_csv_with_pandas,
+    frame_instants,
+    generate_normal_force_and_correct_for_load_positioning,
+)
+from .resample import bucket_index
+from .streaming import STREAMS, accumulate, bucket_means, delta_origin, displace
+
+logger = logging.getLogger(__name__)
+
+
+class Update(NamedTuple):
+    # Rows that won't change again
+    committed: pd.DataFrame
+    # The rows after those, whose buckets may still get more samples
+    provisional: pd.DataFrame
+    # How many rows were parsed from the CSVs for this update
+    rows_read: int
+
+
+def read_appended(
+    path: Path, offset: int, final: bool = False
+) -> Tuple[pd.DataFrame, int]:
+    """Parse the rows appended to a tracker CSV since byte `offset`.
+    Only whole lines are parsed, so a row that is still being written is left for next time
+
+    Args:
+        path (Path): The CSV
+        offset (int): Where the last read finished
+        final (bool): Also parse a last line that has no newline
+
+    Returns:
+        Tuple[pd.DataFrame, int]: The new rows (as `read_displacement_csv`), and where to read from next time
+    """
+    with path.open("rb") as file:
+        size = file.seek(0, io.SEEK_END)
+        if size < offset:
+            raise ValueError(
+                f"{path.as_posix()} is shorter than when it was last read. Was it replaced?"
+            )
+        file.seek(offset)
+        appended = file.read()
+
+    end = len(appended) if final else appended.rfind(b"\n") + 1
+    if not appended[:end].strip():
+        empty = pd.DataFrame(columns=list(DISPLACEMENT_COLUMNS.values()), dtype=float)
+        return empty.astype({"Frame": int}), offset + end
+
+    df = _read_displacement_csv_with_pandas(io.BytesIO(appended[:end]), engine="c")
+    df.dropna(axis="index", how="all", inplace=True)
+    df["Frame"] = df["Frame"].astype(int)
+    return df, offset + end
+
+
+def follow(
+    substrate: Path,
+    reference: Path,
+    pipette: Path,
+    frame_rate: float,
+    duration_of_resampled_row: pd.Timedelta,
+) -> Generator[Update, Optional[bool], None]:
+    """As `merge_and_displace_frames`, for CSVs that are still being written.
+
+    Each `next()` parses whatever has been appended to the CSVs since the last one, adding it to running sums for its bucket,
+    so an update costs as much as the new rows, however long the CSVs have grown.
+    A bucket is committed once every CSV has moved past it. The buckets after that are provisional,
+    and are given again (with any new samples) in later updates, until they are committed too.
+
+    `send(True)` for a last update, which also parses any unfinished last line, and commits every bucket.
+
+    Args:
+        frame_rate (float): Frames per second, to convert from frame numbers to instants (the experiment's length isn't known yet)
+
+    Yields:
+        Update: Rows after the last committed ones. Nothing is given until the first bucket is committed
+    """
+    paths = {"Reference": reference, "Substrate": substrate, "Pipette": pipette}
+    offsets = {name: 0 for name in STREAMS}
+    # Rows that have been parsed, but not yet added to a bucket
+    # (until every CSV has some rows, there's no start to measure buckets from)
+    pending: Dict[str, List[pd.DataFrame]] = {name: [] for name in STREAMS}
+    frontiers = {name: -1 for name in STREAMS}
+    sums = {name: np.zeros((0, 2)) for name in STREAMS}
+    counts = {name: np.zeros((0, 2), dtype=np.int64) for name in STREAMS}
+    start: Optional[int] = None
+    interval = duration_of_resampled_row.value
+    second = pd.Timedelta(1, "seconds")
+    emitted = 0
+    x_start, y_start = None, None
+    final = False
+
+    def instants(df: pd.DataFrame) -> np.ndarray:
+        return frame_instants(df["Frame"].to_numpy(), frame_rate, second)
+
+    while True:
+        rows_read = 0
+        for name in STREAMS:
+            df, offsets[name] = read_appended(paths[name], offsets[name], final=final)
+            rows_read += len(df)
+            if len(df) > 0:
+                pending[name].append(df)
+
+        if start is None and all(pending.values()):
+            start = min(instants(df).min() for dfs in pending.values() for df in dfs)
+            logger.debug(f"Following from {pd.Timedelta(start)}")
+
+        if start is not None:
+            for name in STREAMS:
+                for df in pending[name]:
+                    buckets = bucket_index(instants(df), start, interval)
+                    if buckets.min() < emitted:
+                        raise ValueError(
+                            f"Frames in {paths[name].as_posix()} go backwards, past rows that have already been written"
+                        )
+                    sums[name], counts[name] = accumulate(
+                        sums[name],
+                        counts[name],
+                        buckets - emitted,
+                        df[["X_Position", "Y_Position"]].to_numpy(),
+                    )
+                    frontiers[name] = max(frontiers[name], buckets.max())
+                pending[name] = []
+
+        # Every CSV may still add to its frontier bucket, but not to earlier ones
+        end = max(frontiers.values()) + 1
+        complete = end if final else min(frontiers.values())
+
+        if start is None or (x_start is None and complete == 0):
+            update = Update(pd.DataFrame(), pd.DataFrame(), rows_read)
+        else:
+            combined = bucket_means(
+                sums,
+                counts,
+                start=pd.Timedelta(start + emitted * interval),
+                interval=duration_of_resampled_row,
+                periods=end - emitted,
+            )
+            # Make our delta lines start at 0
+            if x_start is None:
+                x_start, y_start = delta_origin(combined)
+            displace(combined, x_start, y_start)
+
+            n = complete - emitted
+            for name in STREAMS:
+                sums[name] = sums[name][n:]
+                counts[name] = counts[name][n:]
+            emitted = complete
+            logger.debug(
+                f"Read {rows_read} rows. {emitted} rows committed, {len(combined) - n} provisional"
+            )
+            update = Update(combined.iloc[:n], combined.iloc[n:], rows_read)
+
+        if final:
+            yield update
+            return
+        final = bool((yield update))
+
+
+def analyse_live(
+    substrate: Path,
+    reference: Path,
+    pipette: Path,
+    output_file: Path,
+    frame_rate: float,
+    duration_of_resampled_row: pd.Timedelta,
+    poll_interval: float = 1,
+    idle_timeout: Optional[float] = None,
+    **force_model,
+):
+    """Keep `output_file` up to date with CSVs that are still being written, until they stop growing for `idle_timeout` seconds (or Ctrl+C).
+
+    Each update appends the newly committed rows, and rewrites the provisional rows at the end of the file.
+    Everything before those is left alone.
+
+    Args:
+        frame_rate (float): Frames per second
+        poll_interval (float): Seconds between looking for new rows
+        idle_timeout (Optional[float]): Stop after this many seconds without new rows. Defaults to never
+        force_model: The rest of `generate_normal_force_and_correct_for_load_positioning`'s arguments
+    """
+    updates = follow(
+        substrate=substrate,
+        reference=reference,
+        pipette=pipette,
+        frame_rate=frame_rate,
+        duration_of_resampled_row=duration_of_resampled_row,
+    )
+    start, initial_pipette_y_position = None, None
+    # Where the committed rows end, and the provisional ones begin
+    committed_bytes = 0
+    last_read = time.monotonic()
+    finishing = False
+
+    with output_file.open("wb") as file:
+        update = next(updates)
+        while True:
+            file.seek(committed_bytes)
+            file.truncate()
+            for rows, commit in ((update.committed, True), (update.provisional, False)):
+                if len(rows) == 0:
+                    continue
+                if start is None:
+                    start = rows.index[0]
+                    initial_pipette_y_position = rows["Pipette_Y_Position"].iloc[0]
+                result = generate_normal_force_and_correct_for_load_positioning(
+                    df=rows,
+                    start=start,
+                    interval=duration_of_resampled_row,
+                    initial_pipette_y_position=initial_pipette_y_position,
+                    **force_model,
+                )
+                file.write(result.to_csv(header=file.tell() == 0).encode())
+                if commit:
+                    committed_bytes = file.tell()
+            file.flush()
+
+            if finishing:
+                break
+
+            if update.rows_read > 0:
+                last_read = time.monotonic()
+            elif (
+                idle_timeout is not None and time.monotonic() - last_read > idle_timeout
+            ):
+                logger.info(f"No new rows for {idle_timeout}s, finishing")
+                finishing = True
+
+            if not finishing:
+                try:
+                    time.sleep(poll_interval)
+                except KeyboardInterrupt:
+                    logger.info("Interrupted, finishing")
+                    finishing = True
+
+            # The last update commits whatever is left
+            update = updates.send(True) if finishing else next(updates)
+
+    logger.info(f"Wrote {output_file.as_posix()}")
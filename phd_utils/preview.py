@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from . import profiling
+
+logger = logging.getLogger(__name__)
+
+# What `write_preview` keeps by default
+PREVIEW_COLUMNS = ("Normal_Force", "Friction_Force", "Friction_Coefficient")
+# Each level's buckets cover this many of the level below's
+FACTOR = 4
+# Stop adding levels once one has this few buckets
+MIN_BUCKETS = 1000
+
+
+def preview_path(folder: Path, filename: str) -> Path:
+    """Where `analyse_csv` writes a result's preview, e.g preview_<filename>"""
+    return folder.joinpath(f"preview_{filename}")
+
+
+def write_preview(
+    df: pd.DataFrame,
+    directory: Path,
+    interval: pd.Timedelta,
+    columns: Sequence[str] = PREVIEW_COLUMNS,
+    factor: int = FACTOR,
+    min_buckets: int = MIN_BUCKETS,
+):
+    """Write a pyramid of ever coarser copies of some of a result's columns, for `Preview` to plot from.
+    Level 0 is the rows themselves. Each level above keeps the minimum and maximum of each `factor` buckets of the level below,
+    so spikes and slips stay visible however far it is zoomed out. Levels are added until one has fewer than `min_buckets` buckets.
+    `directory` is replaced once the preview is complete, so check it can be written over first
+
+    Args:
+        df (pd.DataFrame): A result, as `generate_normal_force_and_correct_for_load_positioning` returns, on a regular grid
+        directory (Path): Where to write it, as
+            - preview.json: the columns, the grid, and how many rows each level's buckets cover
+            - level0.npy: (rows, columns)
+            - level<N>.npy: (buckets, 2, columns), the minimum and maximum of each bucket
+        interval (pd.Timedelta): How far apart the rows are, i.e what they were resampled to
+        columns (Sequence[str]): What to keep
+        factor (int): How many buckets of each level each bucket of the next one covers
+        min_buckets (int): Don't add levels with fewer buckets than this
+    """
+    assert factor > 1, f"Levels must get coarser, but factor is {factor}"
+    columns = list(columns)
+    with profiling.stage("preview") as counts:
+        values = df[columns].to_numpy()
+        extremes = values[:, np.newaxis, :]
+        rows_per_bucket = [1]
+        temporary = Path(
+            tempfile.mkdtemp(dir=directory.parent, prefix=f".{directory.name}.")
+        )
+        try:
+            np.save(temporary / "level0.npy", values)
+            while len(extremes) > min_buckets:
+                extremes = _coarsen(extremes, factor)
+                rows_per_bucket.append(rows_per_bucket[-1] * factor)
+                np.save(temporary / f"level{len(rows_per_bucket) - 1}.npy", extremes)
+            (temporary / "preview.json").write_text(
+                json.dumps(
+                    dict(
+                        columns=columns,
+                        start=int(df.index[0].value),
+                        interval=int(interval.value),
+                        rows=len(df),
+                        rows_per_bucket=rows_per_bucket,
+                    )
+                )
+            )
+            if directory.exists():
+                shutil.rmtree(directory)
+            os.replace(temporary, directory)
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        counts.update(rows=len(df), levels=len(rows_per_bucket))
+    logger.info(
+        f"Wrote a preview of {len(rows_per_bucket)} levels to {directory.as_posix()}"
+    )
+
+
+def _coarsen(extremes: np.ndarray, factor: int) -> np.ndarray:
+    # (buckets, 1 or 2, columns) to (buckets / factor, 2, columns): the minimum of each `factor` minima, and the maximum of the maxima.
+    # Combining one of each bucket's buckets at a time is much quicker than reducing along a short axis. fmin and fmax ignore NaN
+    whole = len(extremes) // factor
+    coarser = np.empty(
+        (-(-len(extremes) // factor), 2, extremes.shape[-1]), dtype=extremes.dtype
+    )
+    for side, combine in enumerate((np.fmin, np.fmax)):
+        values = extremes[:, min(side, extremes.shape[1] - 1)]
+        blocks = values[: whole * factor].reshape(whole, factor, -1)
+        out = coarser[:whole, side]
+        out[:] = blocks[:, 0]
+        for i in range(1, factor):
+            combine(out, blocks[:, i], out=out)
+        if whole < len(coarser):
+            coarser[whole, side] = combine.reduce(values[whole * factor :], axis=0)
+    return coarser
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: the positions of `points` of (x, y) that keep the line's shape,
+    including the first and last. NaNs are never picked
+
+    Returns:
+        np.ndarray: Positions in `x` and `y`, in order
+    """
+    present = np.flatnonzero(~np.isnan(y))
+    if points >= len(present) or points < 3:
+        return present
+    x, y = x[present].astype(np.float64), y[present].astype(np.float64)
+    # Everything between the first and last points is split into `points - 2` buckets, and one point picked from each:
+    # whichever makes the biggest triangle with the point picked before it and the average of the bucket after it
+    edges = np.append(np.linspace(1, len(x) - 1, points - 1).astype(np.int64), len(x))
+    picked = np.empty(points, dtype=np.int64)
+    picked[0], picked[-1] = 0, len(x) - 1
+    for i in range(points - 2):
+        start, end, after = edges[i], edges[i + 1], edges[i + 2]
+        average_x, average_y = x[end:after].mean(), y[end:after].mean()
+        previous = picked[i]
+        area = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+        picked[i + 1] = start + np.argmax(area)
+    return present[picked]
+
+
+class Preview:
+    """A preview written by `write_preview`, read at the resolution a plot needs.
+    Levels are memory-mapped, and only the buckets in the window asked for are read,
+    so each call takes about the same time however long the experiment is
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        metadata = json.loads((directory / "preview.json").read_text())
+        self.columns: List[str] = metadata["columns"]
+        self.start = pd.Timedelta(metadata["start"], "ns")
+        self.interval = pd.Timedelta(metadata["interval"], "ns")
+        self.rows: int = metadata["rows"]
+        self.rows_per_bucket: List[int] = metadata["rows_per_bucket"]
+        self.levels = [
+            np.load(directory / f"level{level}.npy", mmap_mode="r")
+            for level in range(len(self.rows_per_bucket))
+        ]
+
+    def level_for(
+        self,
+        width: int,
+        start: Optional[pd.Timedelta] = None,
+        end: Optional[pd.Timedelta] = None,
+    ) -> int:
+        """The coarsest level with at least `width` buckets between `start` and `end`, or level 0 if none has"""
+        start, end = self._bounds(start, end)
+        rows = (end - start) / self.interval
+        for level in reversed(range(len(self.levels))):
+            if rows / self.rows_per_bucket[level] >= width:
+                return level
+        return 0
+
+    def window(
+        self,
+        width: int,
+        start: Optional[pd.Timedelta] = None,
+        end: Optional[pd.Timedelta] = None,
+    ) -> pd.DataFrame:
+        """The minimum and maximum of each column, at least `width` times between `start` and `end` (e.g one per pixel),
+        from the coarsest level that has that many. Plot the two as an area (or vertical lines) to see every spike
+
+        Args:
+            width (int): e.g the plot's width in pixels
+            start (Optional[pd.Timedelta]): From the start of the experiment by default
+            end (Optional[pd.Timedelta]): To the end of the experiment by default
+
+        Returns:
+            pd.DataFrame: <column>_Min and <column>_Max for each column, indexed by the instant each bucket starts at
+        """
+        level = self.level_for(width, start, end)
+        instants, extremes = self._read(level, start, end)
+        if level == 0:
+            extremes = np.stack([extremes, extremes], axis=1)
+        return pd.DataFrame(
+            {
+                f"{column}_{name}": extremes[:, i, j]
+                for j, column in enumerate(self.columns)
+                for i, name in enumerate(("Min", "Max"))
+            },
+            index=instants,
+        )
+
+    def series(
+        self,
+        column: str,
+        points: int,
+        start: Optional[pd.Timedelta] = None,
+        end: Optional[pd.Timedelta] = None,
+    ) -> pd.Series:
+        """`points` of a column between `start` and `end` that keep the shape of its line, for plotting as a line.
+        Picked by `lttb` from the minima and maxima of the coarsest level with at least twice as many buckets (MinMaxLTTB),
+        so the work depends on `points`, not on how long the window is
+        """
+        level = self.level_for(2 * points, start, end)
+        instants, extremes = self._read(level, start, end)
+        j = self.columns.index(column)
+        if level == 0:
+            x, y = instants.asi8, extremes[:, j]
+        else:
+            # Both extremes of each bucket, at the bucket's start
+            x, y = np.repeat(instants.asi8, 2), extremes[:, :, j].ravel()
+        picked = lttb(x, y, points)
+        return pd.Series(
+            y[picked], index=pd.TimedeltaIndex(x[picked], name="Instant"), name=column
+        )
+
+    def _bounds(self, start: Optional[pd.Timedelta], end: Optional[pd.Timedelta]):
+        return (
+            self.start if start is None else start,
+            self.start + self.rows * self.interval if end is None else end,
+        )
+
+    def _read(
+        self, level: int, start: Optional[pd.Timedelta], end: Optional[pd.Timedelta]
+    ):
+        start, end = self._bounds(start, end)
+        bucket = self.interval * self.rows_per_bucket[level]
+        data = self.levels[level]
+        # Buckets that overlap the window
+        first = max(int((start - self.start) // bucket), 0)
+        last = min(int(-((self.start - end) // bucket)), len(data))
+        instants = pd.timedelta_range(
+            self.start + first * bucket,
+            periods=max(last - first, 0),
+            freq=bucket,
+            name="Instant",
+        )
+        return instants, np.asarray(data[first:last])
@@ -0,0 +1,183 @@
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Stages recorded since `enable`, or None if profiling is off
+_records: Optional[List[Dict[str, Any]]] = None
+# In each thread, `running`: the names of the stages currently running, outermost first,
+# and `peaks`: the most memory tracemalloc has seen allocated during each of those
+_threads = threading.local()
+# Whether `enable` started tracemalloc, so `disable` should stop it
+_tracing = False
+
+
+def enable(trace_memory: bool = True):
+    """Start recording stages. `trace_memory` also has tracemalloc record Python allocations (which slows them down)"""
+    global _records, _tracing
+    _records = []
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _tracing = True
+
+
+def disable() -> List[Dict[str, Any]]:
+    """Stop recording stages
+
+    Returns:
+        List[Dict[str, Any]]: What was recorded, as `stage` describes
+    """
+    global _records, _tracing
+    records, _records = _records or [], None
+    if _tracing:
+        tracemalloc.stop()
+        _tracing = False
+    return records
+
+
+def enabled() -> bool:
+    return _records is not None
+
+
+@contextlib.contextmanager
+def session(destination: Optional[str]) -> Iterator[None]:
+    """Profile the block, then `report` to `destination`. If `destination` is None, don't profile at all"""
+    if destination is None:
+        yield
+        return
+    enable()
+    try:
+        yield
+    finally:
+        report(disable(), destination)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[Dict[str, Any]]:
+    """Record how long the block takes, and how much memory it uses.
+    Put counts of what it processed (e.g `rows`, `bytes`, `files`) in the dictionary it gives.
+
+    Each record has the stage's `name` (prefixed by any stages it is inside, e.g `merge/resample`),
+    `wall` and `cpu` seconds, `traced_peak` (the most bytes tracemalloc saw allocated above the start of the stage),
+    `peak_rss` (the process' peak resident set size after the stage, in bytes) and the counts.
+    When profiling is off, this does nothing but give a dictionary to throw away.
+
+    Stages can run in several threads at once, but CPU time and tracemalloc are counted across every thread,
+    so their CPU times and peaks include each other's
+    """
+    counts: Dict[str, Any] = {}
+    if _records is None:
+        yield counts
+        return
+
+    if not hasattr(_threads, "running"):
+        _threads.running, _threads.peaks = [], []
+    running: List[str] = _threads.running
+    peaks: List[int] = _threads.peaks
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        traced_before, peak = tracemalloc.get_traced_memory()
+        # Resetting the peak would lose the enclosing stage's, so hand it up first
+        if peaks:
+            peaks[-1] = max(peaks[-1], peak)
+        _reset_peak()
+    running.append(name)
+    peaks.append(0)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield counts
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak = peaks.pop()
+        if tracing:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+        record = dict(
+            name="/".join(running),
+            wall=wall,
+            cpu=cpu,
+            traced_peak=max(peak - traced_before, 0) if tracing else None,
+            peak_rss=_peak_rss(),
+            **counts,
+        )
+        running.pop()
+        _records.append(record)
+        logger.debug(f"Stage {record}")
+
+
+def _reset_peak():
+    # `reset_peak` is new in Python 3.9. Before that, peaks are since tracing started
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+
+
+def _peak_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def summarise(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Total up the records of each stage (e.g each file read), in the order stages first finished"""
+    totals: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        total = totals.setdefault(record["name"], dict(name=record["name"], calls=0))
+        total["calls"] += 1
+        for key, value in record.items():
+            if key == "name" or value is None:
+                continue
+            if key in ("traced_peak", "peak_rss"):
+                total[key] = max(total.get(key, 0), value)
+            else:
+                total[key] = total.get(key, 0) + value
+    return list(totals.values())
+
+
+def format_table(records: List[Dict[str, Any]]) -> str:
+    """A table of `summarise`d records, for people"""
+    lines = [
+        f"{'stage':<32} {'calls':>6} {'wall':>9} {'cpu':>9} {'traced MiB':>10} {'RSS MiB':>8}  processed"
+    ]
+    for total in summarise(records):
+        processed = ", ".join(
+            f"{value} {key}"
+            for key, value in total.items()
+            if key not in ("name", "calls", "wall", "cpu", "traced_peak", "peak_rss")
+        )
+        lines.append(
+            f"{total['name']:<32} {total['calls']:>6} {total['wall']:>8.3f}s {total['cpu']:>8.3f}s"
+            f" {_mebibytes(total.get('traced_peak')):>10} {_mebibytes(total.get('peak_rss')):>8}  {processed}"
+        )
+    return "\n".join(lines)
+
+
+def _mebibytes(size: Optional[int]) -> str:
+    return "-" if size is None else f"{size / 1024 ** 2:.1f}"
+
+
+def report(records: List[Dict[str, Any]], destination: str):
+    """Log a table of the records, and write them to `destination` as JSON (unless it is `-`)"""
+    logger.info(f"Profile:\n{format_table(records)}")
+    if destination == "-":
+        return
+    Path(destination).write_text(
+        json.dumps(dict(stages=records, totals=summarise(records)), indent=2)
+    )
+    logger.info(f"Wrote profile to {destination}")
@@ -1,9 +1,197 @@
+import numpy as np
 import pandas as pd
 
 import logging
+from typing import Mapping, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+METHODS = ("nearest", "linear", "mean")
 
-def resample(a: pd.DataFrame, b: pd.DataFrame):
-    pass
+
+def resample(
+    streams: Mapping[str, pd.DataFrame],
+    interval: pd.Timedelta,
+    method: str = "mean",
+    start: Optional[pd.Timedelta] = None,
+    end: Optional[pd.Timedelta] = None,
+) -> pd.DataFrame:
+    """Align any number of streams, each at its own frame rate, onto a common grid.
+
+    Each stream is handled on its own, as sorted arrays. There is no concatenating or re-sorting of the streams together.
+
+    Args:
+        streams (Mapping[str, pd.DataFrame]): Each indexed by a TimedeltaIndex. Columns are renamed to `<name>_<column>`
+        interval (pd.Timedelta): The grid spacing
+        method (str): How to get from a stream to the grid:
+            - "nearest": the sample closest to each grid instant
+            - "linear": interpolate between the samples either side of each grid instant (NaN outside the stream)
+            - "mean": the mean of the samples in `[instant, instant + interval)` (NaN if there are none), as `DataFrame.resample(...).mean()`
+        start (Optional[pd.Timedelta]): The first grid instant. Defaults to the earliest sample
+        end (Optional[pd.Timedelta]): The last grid instant is at or before this. Defaults to the latest sample
+
+    Returns:
+        pd.DataFrame: One row per grid instant
+    """
+    assert method in METHODS, f"Unknown method {method}, expected one of {METHODS}"
+
+    instants = {name: df.index.asi8 for name, df in streams.items()}
+    if start is None:
+        start = pd.Timedelta(min(i.min() for i in instants.values()))
+    if end is None:
+        end = pd.Timedelta(max(i.max() for i in instants.values()))
+    periods = int(bucket_index(end.value, start.value, interval.value)) + 1
+
+    columns = [
+        f"{name}_{column}" for name, df in streams.items() for column in df.columns
+    ]
+    # Fill in one block, so that the DataFrame doesn't need to copy it
+    aligned = np.empty((periods, len(columns)))
+    position = 0
+    for name, df in streams.items():
+        width = len(df.columns)
+        aligned[:, position : position + width] = align(
+            instants=instants[name],
+            values=df.to_numpy(dtype=float),
+            start=start.value,
+            interval=interval.value,
+            periods=periods,
+            method=method,
+        )
+        position += width
+
+    logger.debug(f"Aligned {len(streams)} streams onto {periods} rows by {method}")
+
+    return pd.DataFrame(
+        aligned,
+        index=pd.timedelta_range(
+            start=start,
+            periods=periods,
+            freq=interval,
+            name=next(iter(streams.values())).index.name,
+        ),
+        columns=columns,
+        copy=False,
+    )
+
+
+def align(
+    instants: np.ndarray,
+    values: np.ndarray,
+    start: int,
+    interval: int,
+    periods: int,
+    method: str,
+) -> np.ndarray:
+    """Align one stream onto the grid `start + i * interval` for `i` in `[0, periods)`. See `resample`
+
+    Args:
+        instants (np.ndarray): Nanoseconds
+        values (np.ndarray): One row per instant
+        start (int): Nanoseconds
+        interval (int): Nanoseconds
+        periods (int): Grid length
+        method (str): "nearest", "linear" or "mean"
+
+    Returns:
+        np.ndarray: Shaped `(periods, columns)`
+    """
+    values = values.reshape(len(values), -1)
+
+    if method == "mean":
+        # Doesn't care about order
+        buckets = bucket_index(instants, start, interval)
+        inside = (buckets >= 0) & (buckets < periods)
+        if not inside.all():
+            buckets, values = buckets[inside], values[inside]
+        sums, counts = bucket_sums(buckets, values, periods)
+        # Mean, with NaN for empty buckets
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+
+    if len(instants) == 0:
+        return np.full((periods, values.shape[1]), np.nan)
+
+    if (np.diff(instants) < 0).any():
+        order = np.argsort(instants, kind="stable")
+        instants, values = instants[order], values[order]
+
+    grid = start + interval * np.arange(periods, dtype=np.int64)
+
+    if method == "nearest":
+        if len(instants) == 1:
+            return np.repeat(values, periods, axis=0)
+        after = np.searchsorted(instants, grid, side="left").clip(1, len(instants) - 1)
+        before = after - 1
+        # Ties go to the later sample, as `DataFrame.reindex(method="nearest")`
+        closest = np.where(
+            grid - instants[before] < instants[after] - grid, before, after
+        )
+        return values[closest]
+
+    # Linear
+    before = (np.searchsorted(instants, grid, side="right") - 1).clip(
+        0, max(len(instants) - 2, 0)
+    )
+    after = np.minimum(before + 1, len(instants) - 1)
+    span = (instants[after] - instants[before]).astype(float)
+    # A span can only be zero at the very end (duplicate instants), so take the last sample there
+    weight = np.divide(
+        grid - instants[before], span, out=np.ones(periods), where=span > 0
+    )[:, np.newaxis]
+    interpolated = values[before] + weight * (values[after] - values[before])
+    outside = (grid < instants[0]) | (grid > instants[-1])
+    interpolated[outside] = np.nan
+    return interpolated
+
+
+def bucket_index(instants: np.ndarray, start: int, interval: int) -> np.ndarray:
+    """Which bucket each instant falls into, where bucket `i` covers `[start + i * interval, start + (i + 1) * interval)`.
+    This is how `DataFrame.resample` bins a TimedeltaIndex (with `start` being the earliest instant).
+
+    Args:
+        instants (np.ndarray): Nanoseconds (i.e `TimedeltaIndex.asi8`)
+        start (int): Nanoseconds
+        interval (int): Nanoseconds
+
+    Returns:
+        np.ndarray: Integer bucket numbers
+    """
+    return (instants - start) // interval
+
+
+def bucket_sums(
+    buckets: np.ndarray, values: np.ndarray, number_of_buckets: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum up the (non-NaN) values in each bucket, and count them
+
+    Args:
+        buckets (np.ndarray): The bucket of each row, in `[0, number_of_buckets)`
+        values (np.ndarray): One row per bucket number, and any number of columns
+        number_of_buckets (int): The length of the outputs
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Sums and counts, each shaped `(number_of_buckets, columns)`
+    """
+    values = values.reshape(len(values), -1)
+    # Only bother masking out NaNs if there are any
+    missing = np.isnan(values)
+    if not missing.any():
+        counts = np.bincount(buckets, minlength=number_of_buckets)
+        sums = np.column_stack(
+            [
+                np.bincount(buckets, values[:, column], minlength=number_of_buckets)
+                for column in range(values.shape[1])
+            ]
+        )
+        return sums, np.repeat(counts[:, np.newaxis], values.shape[1], axis=1)
+
+    sums = np.empty((number_of_buckets, values.shape[1]))
+    counts = np.empty((number_of_buckets, values.shape[1]), dtype=np.int64)
+    for column in range(values.shape[1]):
+        present = ~missing[:, column]
+        sums[:, column] = np.bincount(
+            buckets[present], values[present, column], minlength=number_of_buckets
+        )
+        counts[:, column] = np.bincount(buckets[present], minlength=number_of_buckets)
+    return sums, counts
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import contextlib
+import importlib.util
+import logging
+import os
+import tempfile
+
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Iterator, List, Optional
+
+# numpy and pandas are imported where they are used, so that the command line tools can parse their arguments without them
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "parquet", "feather", "npz")
+# Formats that need pyarrow
+ARROW_FORMATS = ("parquet", "feather")
+# Formats that `streaming.analyse_in_chunks` can write a chunk at a time
+STREAMABLE_FORMATS = ("csv", "parquet")
+
+
+def resolve_format(output_format: str) -> str:
+    """The format to actually write in: Parquet and Feather fall back to npz if pyarrow isn't installed"""
+    assert (
+        output_format in FORMATS
+    ), f"Unknown output format {output_format}, expected one of {FORMATS}"
+    if output_format in ARROW_FORMATS and importlib.util.find_spec("pyarrow") is None:
+        logger.warning(
+            f"pyarrow isn't installed, so writing npz instead of {output_format}"
+        )
+        return "npz"
+    return output_format
+
+
+def result_path(folder: Path, filename: str, output_format: str) -> Path:
+    """Where `analyse_csv` writes its result, e.g processed_<filename>.parquet"""
+    return folder.joinpath(f"processed_{filename}.{output_format}")
+
+
+def slips_path(folder: Path, filename: str) -> Path:
+    """Where `analyse_csv` writes the slips it finds, e.g slips_<filename>.csv"""
+    return folder.joinpath(f"slips_{filename}.csv")
+
+
+@contextlib.contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """Yield a temporary path next to `path`, which replaces `path` once the block finishes.
+    If the block fails, `path` is left as it was
+    """
+    fd, temporary = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        yield Path(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def write_result(df: pd.DataFrame, path: Path, output_format: str):
+    """Atomically write a processed result, keeping its TimedeltaIndex
+
+    Args:
+        df (pd.DataFrame): As returned by `generate_normal_force_and_correct_for_load_positioning`
+        path (Path): Where to write it
+        output_format (str): One of `FORMATS`
+    """
+    with atomic_path(path) as temporary:
+        if output_format == "csv":
+            df.to_csv(temporary)
+        elif output_format == "parquet":
+            df.to_parquet(temporary)
+        elif output_format == "feather":
+            # Feather doesn't keep indexes, but does keep durations
+            df.reset_index().to_feather(temporary)
+        elif output_format == "npz":
+            with temporary.open("wb") as file:
+                save_npz(file, df)
+        else:
+            raise ValueError(
+                f"Unknown output format {output_format}, expected one of {FORMATS}"
+            )
+    logger.info(f"Wrote {path.as_posix()}")
+
+
+def write_slips(slips: pd.DataFrame, path: Path):
+    """Atomically write the table of slips from `csv_analyser.detect_slips`, as CSV"""
+    with atomic_path(path) as temporary:
+        slips.to_csv(temporary, index=False)
+    logger.info(f"Wrote {len(slips)} slips to {path.as_posix()}")
+
+
+def read_slips(path: Path) -> pd.DataFrame:
+    """Read what `write_slips` wrote, with its instants as Timedeltas"""
+    import pandas as pd
+
+    slips = pd.read_csv(path)
+    for column in ("Start", "End", "Duration"):
+        slips[column] = pd.to_timedelta(slips[column])
+    return slips
+
+
+def read_result(path: Path, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read a result written by `analyse_csv` in any of the `FORMATS`, going by its suffix
+
+    Args:
+        path (Path): The result
+        columns (Optional[List[str]]): Only these columns. CSV and Parquet don't read the others at all. Defaults to all of them
+
+    Returns:
+        pd.DataFrame: Indexed by the instant of each row
+    """
+    import pandas as pd
+
+    output_format = path.suffix.lstrip(".")
+    if output_format == "csv":
+        usecols = None
+        if columns is not None:
+            # The index is the first column, whatever it is called
+            index = pd.read_csv(path, nrows=0).columns[0]
+            usecols = [index, *columns]
+        df = pd.read_csv(path, index_col=0, usecols=usecols)
+        df.index = pd.to_timedelta(df.index).rename(df.index.name or "Instant")
+    elif output_format == "parquet":
+        df = pd.read_parquet(path, columns=columns)
+    elif output_format == "feather":
+        df = pd.read_feather(path)
+        df = df.set_index(df.columns[0])
+    elif output_format == "npz":
+        df = load_npz(path)
+    else:
+        raise ValueError(f"Can't tell the format of {path.as_posix()} from its suffix")
+    return df if columns is None else df[columns]
+
+
+def save_npz(file: BinaryIO, df: pd.DataFrame, **arrays: np.ndarray):
+    """Write a DataFrame with a TimedeltaIndex as npz, with one array per column so that each keeps its own dtype
+
+    Args:
+        file (BinaryIO): Where to write it
+        df (pd.DataFrame): What to write
+        arrays (np.ndarray): Anything else to keep alongside it, which `load_npz` ignores
+    """
+    import numpy as np
+
+    np.savez(
+        file,
+        index=df.index.asi8,
+        index_name=np.array(df.index.name or ""),
+        columns=np.array(df.columns, dtype=str),
+        **{f"column_{i}": df[column].to_numpy() for i, column in enumerate(df.columns)},
+        **arrays,
+    )
+
+
+def load_npz(path: Path) -> pd.DataFrame:
+    """Read a DataFrame written by `save_npz`"""
+    import numpy as np
+    import pandas as pd
+
+    with np.load(path) as npz:
+        columns = npz["columns"].tolist()
+        return pd.DataFrame(
+            {column: npz[f"column_{i}"] for i, column in enumerate(columns)},
+            index=pd.TimedeltaIndex(npz["index"], name=str(npz["index_name"]) or None),
+            columns=columns,
+        )
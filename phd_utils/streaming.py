@@ -0,0 +1,277 @@
+import contextlib
+import logging
+
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .csv_analyser import (
+    frame_instants,
+    generate_normal_force_and_correct_for_load_positioning,
+    iter_displacement_csv,
+)
+from .resample import bucket_index, bucket_sums
+from .results import STREAMABLE_FORMATS, atomic_path
+
+logger = logging.getLogger(__name__)
+
+# In the same order as `merge_and_displace_frames`
+STREAMS = ("Reference", "Substrate", "Pipette")
+
+
+def frame_range(path: Path, chunk_size: int) -> Tuple[int, int]:
+    """The first and last frame numbers in a tracker CSV, reading `chunk_size` rows at a time"""
+    first, last = None, None
+    for df in iter_displacement_csv(path, chunk_size=chunk_size):
+        if len(df) == 0:
+            continue
+        low, high = df["Frame"].min(), df["Frame"].max()
+        first = low if first is None else min(first, low)
+        last = high if last is None else max(last, high)
+    assert first is not None, f"No frames in {path.as_posix()}"
+    return first, last
+
+
+def merge_and_displace_frames_in_chunks(
+    substrate: Path,
+    reference: Path,
+    pipette: Path,
+    experiment_duration: pd.Timedelta,
+    duration_of_resampled_row: pd.Timedelta,
+    chunk_size: int,
+) -> Iterator[pd.DataFrame]:
+    """As `merge_and_displace_frames`, but reading the CSVs `chunk_size` rows at a time.
+
+    Each CSV is read twice: once for its range of frame numbers (to convert them to instants),
+    then again, adding each row to a running sum for its bucket.
+    A bucket is yielded as soon as every CSV has moved past it, so only a few chunks' worth of buckets are ever held.
+    Frames must (broadly) increase down each CSV. If a row lands in a bucket that has already been yielded, a ValueError is raised.
+
+    Yields:
+        pd.DataFrame: Consecutive runs of resampled rows
+    """
+    paths = {"Reference": reference, "Substrate": substrate, "Pipette": pipette}
+
+    # Convert from frame numbers to the actual time through the experiment
+    ranges = {name: frame_range(path, chunk_size) for name, path in paths.items()}
+
+    start = min(
+        frame_instants(np.array([first]), last, experiment_duration)[0]
+        for first, last in ranges.values()
+    )
+    end = max(
+        frame_instants(np.array([last]), last, experiment_duration)[0]
+        for _, last in ranges.values()
+    )
+    interval = duration_of_resampled_row.value
+    number_of_buckets = int(bucket_index(end, start, interval)) + 1
+    logger.debug(f"Streaming {number_of_buckets} buckets from {ranges}")
+
+    chunks = {
+        name: iter_displacement_csv(path, chunk_size=chunk_size)
+        for name, path in paths.items()
+    }
+    # The furthest bucket each CSV has reached. It may still add to that one, but not to earlier ones
+    frontiers: Dict[str, int] = {name: -1 for name in STREAMS}
+    # Running sums of X and Y, for buckets from `emitted` onwards
+    sums = {name: np.zeros((0, 2)) for name in STREAMS}
+    counts = {name: np.zeros((0, 2), dtype=np.int64) for name in STREAMS}
+    emitted = 0
+    x_start, y_start = None, None
+
+    while emitted < number_of_buckets:
+        # Read from whichever CSV is furthest behind, so that they all move forwards together
+        name = min(
+            (name for name in STREAMS if frontiers[name] < number_of_buckets),
+            key=frontiers.__getitem__,
+        )
+        df = next(chunks[name], None)
+        if df is None:
+            frontiers[name] = number_of_buckets  # It won't add to any more buckets
+        elif len(df) > 0:
+            buckets = bucket_index(
+                frame_instants(
+                    df["Frame"].to_numpy(), ranges[name][1], experiment_duration
+                ),
+                start,
+                interval,
+            )
+            if buckets.min() < emitted:
+                raise ValueError(
+                    f"Frames in {paths[name].as_posix()} go backwards, past rows that have already been written"
+                )
+            sums[name], counts[name] = accumulate(
+                sums[name],
+                counts[name],
+                buckets - emitted,
+                df[["X_Position", "Y_Position"]].to_numpy(),
+            )
+            frontiers[name] = max(frontiers[name], buckets.max())
+
+        complete = min(frontiers.values())
+        if complete <= emitted:
+            continue
+
+        n = complete - emitted
+        combined = bucket_means(
+            sums,
+            counts,
+            start=pd.Timedelta(start + emitted * interval),
+            interval=duration_of_resampled_row,
+            periods=n,
+        )
+        for stream in STREAMS:
+            sums[stream] = sums[stream][n:]
+            counts[stream] = counts[stream][n:]
+
+        # Make our delta lines start at 0
+        if x_start is None:
+            x_start, y_start = delta_origin(combined)
+        displace(combined, x_start, y_start)
+
+        logger.debug(f"Resampled rows {emitted} to {complete}")
+        emitted = complete
+        yield combined
+
+    logger.info(
+        f"Resampled to buckets of {duration_of_resampled_row} ({number_of_buckets} rows)"
+    )
+
+
+def _pad(running: np.ndarray, n: int) -> np.ndarray:
+    # Buckets past the end of the window haven't had anything added to them yet
+    if len(running) >= n:
+        return running[:n]
+    padded = np.zeros((n, running.shape[1]), dtype=running.dtype)
+    padded[: len(running)] = running
+    return padded
+
+
+def accumulate(
+    sums: np.ndarray, counts: np.ndarray, buckets: np.ndarray, values: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Add `values` to running per-bucket sums and counts, growing them to fit
+
+    Args:
+        sums (np.ndarray): Running sums, one row per bucket
+        counts (np.ndarray): Running counts, one row per bucket
+        buckets (np.ndarray): Which row each value is added to
+        values (np.ndarray): One row per bucket number
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The sums and counts, which may be new arrays
+    """
+    window = buckets.max() + 1
+    if window > len(sums):
+        sums, counts = _pad(sums, window), _pad(counts, window)
+    chunk_sums, chunk_counts = bucket_sums(buckets, values, window)
+    sums[:window] += chunk_sums
+    counts[:window] += chunk_counts
+    return sums, counts
+
+
+def bucket_means(
+    sums: Dict[str, np.ndarray],
+    counts: Dict[str, np.ndarray],
+    start: pd.Timedelta,
+    interval: pd.Timedelta,
+    periods: int,
+) -> pd.DataFrame:
+    """The first `periods` buckets of each stream's running X and Y sums, as `merge_and_displace_frames` columns (without deltas)"""
+    combined = pd.DataFrame(
+        index=pd.timedelta_range(
+            start=start, periods=periods, freq=interval, name="Instant"
+        )
+    )
+    for stream in STREAMS:
+        # Mean, with NaN for empty buckets (as `DataFrame.resample(...).mean()`)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = _pad(sums[stream], periods) / _pad(counts[stream], periods)
+        combined[f"{stream}_X_Position"] = means[:, 0]
+        combined[f"{stream}_Y_Position"] = means[:, 1]
+    return combined
+
+
+def delta_origin(combined: pd.DataFrame) -> Tuple[float, float]:
+    """The substrate's X and Y offsets from the reference in the first row, which the deltas are measured from"""
+    first = combined.iloc[0]
+    return (
+        first["Substrate_X_Position"] - first["Reference_X_Position"],
+        first["Substrate_Y_Position"] - first["Reference_Y_Position"],
+    )
+
+
+def displace(combined: pd.DataFrame, x_start: float, y_start: float):
+    """Add X_Delta and Y_Delta columns, starting from `x_start` and `y_start`"""
+    combined["X_Delta"] = (
+        combined["Substrate_X_Position"] - combined["Reference_X_Position"]
+    )
+    combined["Y_Delta"] = (
+        combined["Substrate_Y_Position"] - combined["Reference_Y_Position"]
+    )
+    combined["X_Delta"] = combined["X_Delta"] - x_start
+    combined["Y_Delta"] = combined["Y_Delta"] - y_start
+
+
+def analyse_in_chunks(
+    substrate: Path,
+    reference: Path,
+    pipette: Path,
+    output_file: Path,
+    experiment_duration: pd.Timedelta,
+    duration_of_resampled_row: pd.Timedelta,
+    chunk_size: int,
+    output_format: str = "csv",
+    **force_model,
+):
+    """Resample the CSVs and apply the force model `chunk_size` rows at a time, appending to `output_file` as rows are completed.
+    `output_file` only appears once it is complete
+
+    Args:
+        output_format (str): One of `STREAMABLE_FORMATS`
+        force_model: The rest of `generate_normal_force_and_correct_for_load_positioning`'s arguments
+    """
+    assert (
+        output_format in STREAMABLE_FORMATS
+    ), f"Can only stream to {' or '.join(STREAMABLE_FORMATS)}, not {output_format}"
+    start, initial_pipette_y_position = None, None
+
+    with atomic_path(output_file) as temporary, contextlib.ExitStack() as stack:
+        writer = None
+        for merged in merge_and_displace_frames_in_chunks(
+            substrate=substrate,
+            reference=reference,
+            pipette=pipette,
+            experiment_duration=experiment_duration,
+            duration_of_resampled_row=duration_of_resampled_row,
+            chunk_size=chunk_size,
+        ):
+            if start is None:
+                start = merged.index[0]
+                initial_pipette_y_position = merged["Pipette_Y_Position"].iloc[0]
+
+            result = generate_normal_force_and_correct_for_load_positioning(
+                df=merged,
+                start=start,
+                interval=duration_of_resampled_row,
+                initial_pipette_y_position=initial_pipette_y_position,
+                **force_model,
+            )
+            if output_format == "csv":
+                if writer is None:
+                    writer = stack.enter_context(temporary.open("w"))
+                result.to_csv(writer, header=writer.tell() == 0)
+            else:
+                import pyarrow
+                import pyarrow.parquet
+
+                table = pyarrow.Table.from_pandas(result)
+                if writer is None:
+                    writer = stack.enter_context(
+                        pyarrow.parquet.ParquetWriter(temporary, table.schema)
+                    )
+                writer.write_table(table)
+
+    logger.info(f"Wrote {output_file.as_posix()}")
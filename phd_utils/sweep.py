@@ -0,0 +1,318 @@
+import argparse
+import itertools
+import logging
+import sys
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import cli, csv_analyser
+
+logger = logging.getLogger(__name__)
+
+# csv-analyser's options, and the force model parameters that they set
+PARAMETERS = {
+    "initial-x-displacement": "initial_x_displacement",
+    "substrate-tip-position": "initial_substrate_tip_position",
+    "substrate-length": "length_of_substrate",
+    "substrate-stiffness": "stiffness_constant_of_substrate",
+    "pipette-stiffness": "stiffness_constant_of_pipette",
+    "angle-alpha": "angle_alpha",
+    "angle-beta": "angle_beta",
+    "speed": "substrate_tip_velocity",
+    "flexural-rigidity": "flexural_rigidity",
+}
+
+METRICS = csv_analyser.FORCE_COLUMNS
+
+
+def evaluate_force_model(
+    df: pd.DataFrame,
+    parameters: pd.DataFrame,
+    reverse_sliding_direction: bool,
+    duration_subtrate_tip_is_stationary_for: pd.Timedelta = pd.Timedelta(5, "seconds"),
+    interval: Optional[pd.Timedelta] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """`generate_normal_force_and_correct_for_load_positioning`, for many sets of parameters at once.
+    Each metric is computed for every set of parameters and every row as one (parameters x rows) array operation
+
+    Args:
+        df (pd.DataFrame): Resampled frames, as returned by `merge_and_displace_frames`
+        parameters (pd.DataFrame): One row per set of parameters, with a column for each of `PARAMETERS.values()`
+        interval (Optional[pd.Timedelta]): How long each row lasts for, i.e `--resample-to`. Defaults to `csv_analyser.row_interval`
+        out (Optional[np.ndarray]): Where to write the result
+
+    Returns:
+        np.ndarray: Shaped (parameters, rows, `METRICS`)
+    """
+    if out is None:
+        out = np.empty((len(parameters), len(df), len(METRICS)))
+
+    def parameter(name: str) -> np.ndarray:
+        # A column, to broadcast against rows
+        return parameters[name].to_numpy(dtype=float)[:, np.newaxis]
+
+    # Where the tip would be at unit velocity, which then just needs scaling for each set
+    travelled_at_unit_velocity = csv_analyser.substrate_tip_position(
+        instants=df.index,
+        start=df.index[0],
+        interval=csv_analyser.row_interval(df.index) if interval is None else interval,
+        initial_position=0,
+        velocity=1,
+        stationary_for=duration_subtrate_tip_is_stationary_for,
+    )
+    x_delta = df["X_Delta"].to_numpy()[np.newaxis, :]
+    pipette_y_position = df["Pipette_Y_Position"].to_numpy()[np.newaxis, :]
+
+    # Each metric is a (parameters x rows) view of `out`
+    metrics = [out[:, :, i] for i in range(len(METRICS))]
+    tip = metrics[METRICS.index("Substrate_Tip_Position")]
+    tip[:] = travelled_at_unit_velocity * parameter(
+        "substrate_tip_velocity"
+    ) + parameter("initial_substrate_tip_position")
+
+    csv_analyser.force_model(
+        x_delta=x_delta,
+        pipette_y_position=pipette_y_position,
+        initial_pipette_y_position=pipette_y_position[0, 0],
+        initial_x_displacement=parameter("initial_x_displacement"),
+        length_of_substrate=parameter("length_of_substrate"),
+        stiffness_constant_of_substrate=parameter("stiffness_constant_of_substrate"),
+        stiffness_constant_of_pipette=parameter("stiffness_constant_of_pipette"),
+        reverse_sliding_direction=reverse_sliding_direction,
+        angle_alpha=parameter("angle_alpha"),
+        angle_beta=parameter("angle_beta"),
+        flexural_rigidity=parameter("flexural_rigidity"),
+        out=metrics,
+    )
+
+    return out
+
+
+def sweep(
+    df: pd.DataFrame,
+    parameters: pd.DataFrame,
+    reverse_sliding_direction: bool,
+    sets_per_chunk: int = 16,
+    interval: Optional[pd.Timedelta] = None,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """Evaluate the force model for `sets_per_chunk` sets of parameters at a time, so memory stays bounded.
+    `interval` is as `evaluate_force_model`'s
+
+    Yields:
+        Tuple[int, np.ndarray]: The position of the chunk's first set in `parameters`, and its results (see `evaluate_force_model`)
+    """
+    out = np.empty((min(sets_per_chunk, len(parameters)), len(df), len(METRICS)))
+    for first in range(0, len(parameters), sets_per_chunk):
+        chunk = parameters.iloc[first : first + sets_per_chunk]
+        yield first, evaluate_force_model(
+            df=df,
+            parameters=chunk,
+            reverse_sliding_direction=reverse_sliding_direction,
+            interval=interval,
+            out=out[: len(chunk)],
+        )
+
+
+def write_sweep(
+    directory: Path,
+    df: pd.DataFrame,
+    parameters: pd.DataFrame,
+    reverse_sliding_direction: bool,
+    sets_per_chunk: int = 16,
+    interval: Optional[pd.Timedelta] = None,
+):
+    """Run a sweep into `directory`, as
+    - values.npy: (parameters, rows, metrics)
+    - parameters.csv: one row per set of parameters
+    - instants.npy: the time of each row, in nanoseconds
+
+    Values are written as each chunk finishes, so the whole sweep never needs to fit in memory.
+    `interval` is as `evaluate_force_model`'s
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    parameters.to_csv(directory / "parameters.csv", index=False)
+    np.save(directory / "instants.npy", df.index.asi8)
+    values = np.lib.format.open_memmap(
+        directory / "values.npy",
+        mode="w+",
+        shape=(len(parameters), len(df), len(METRICS)),
+    )
+    for first, chunk in sweep(
+        df=df,
+        parameters=parameters,
+        reverse_sliding_direction=reverse_sliding_direction,
+        sets_per_chunk=sets_per_chunk,
+        interval=interval,
+    ):
+        values[first : first + len(chunk)] = chunk
+        logger.debug(f"Evaluated sets {first} to {first + len(chunk)}")
+    values.flush()
+    logger.info(f"Wrote {len(parameters)} sets of results to {directory.as_posix()}")
+
+
+def load_sweep(directory: Path) -> Tuple[np.ndarray, pd.DataFrame, pd.TimedeltaIndex]:
+    """Read back what `write_sweep` wrote. The values are memory-mapped
+
+    Returns:
+        Tuple[np.ndarray, pd.DataFrame, pd.TimedeltaIndex]: Values (parameters, rows, `METRICS`), parameters and instants
+    """
+    return (
+        np.load(directory / "values.npy", mmap_mode="r"),
+        pd.read_csv(directory / "parameters.csv"),
+        pd.TimedeltaIndex(np.load(directory / "instants.npy"), name="Instant"),
+    )
+
+
+def tidy(
+    values: np.ndarray, parameters: pd.DataFrame, instants: pd.TimedeltaIndex
+) -> pd.DataFrame:
+    """One row per (set of parameters, instant), with the parameters alongside the metrics. Best kept for small sweeps"""
+    index = pd.MultiIndex.from_product(
+        [range(len(parameters)), instants], names=["Set", "Instant"]
+    )
+    df = pd.DataFrame(values.reshape(-1, len(METRICS)), index=index, columns=METRICS)
+    return df.join(parameters.rename_axis("Set"), on="Set")
+
+
+def parameter_grid(
+    constants: Dict[str, float], varied: Dict[str, List[float]]
+) -> pd.DataFrame:
+    """Every combination of the `varied` parameters, with the `constants` filled in"""
+    names = list(varied.keys())
+    grid = pd.DataFrame(list(itertools.product(*varied.values())), columns=names)
+    for name, value in constants.items():
+        if name not in grid.columns:
+            grid[name] = value
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+    Read and resample one experiment (as csv-analyser), then evaluate the force model for many sets of parameters at once.
+
+    Parameters are varied with `--vary`, e.g `--vary angle-beta=0,0.1,0.2 --vary speed=1,2` for every combination,
+    and/or by a CSV of parameter sets whose columns are csv-analyser's long options.
+    Anything not varied is taken from csv-analyser's usual options.
+
+    Results go to a directory of values.npy (sets x rows x metrics), parameters.csv and instants.npy
+    """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        allow_abbrev=False,  # Don't steal csv-analyser's arguments
+    )
+    parser.add_argument(
+        "-V",
+        "--vary",
+        action="append",
+        default=[],
+        metavar="OPTION=VALUE,VALUE,...",
+        help=f"One of {', '.join(PARAMETERS)}",
+    )
+    parser.add_argument(
+        "-P",
+        "--parameters",
+        type=Path,
+        default=None,
+        help="CSV of parameter sets, one per row",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="Where to write the results. Defaults to sweep_<filename-contains> in the experiment's folder",
+    )
+    parser.add_argument(
+        "--sets-per-chunk",
+        type=int,
+        default=16,
+        help="How many sets of parameters to evaluate at once. Lower this to use less memory. Defaults to %(default)s",
+    )
+    args, rest = parser.parse_known_args()
+    analysis = cli.csv_analyser_parser(required=False).parse_args(rest)
+
+    logging.basicConfig(level=analysis.log_level)
+
+    logger.debug(f"Arguments: {args}, {analysis}")
+
+    for option in ("filename_contains", "experiment_duration", "resample_to"):
+        if getattr(analysis, option) is None:
+            parser.error(f"--{option.replace('_', '-')} is required")
+
+    constants = {
+        name: getattr(analysis, option.replace("-", "_"))
+        for option, name in PARAMETERS.items()
+        if getattr(analysis, option.replace("-", "_")) is not None
+    }
+    varied = {}
+    for vary in args.vary:
+        option, _, values = vary.partition("=")
+        if option not in PARAMETERS:
+            parser.error(
+                f"Can't vary {option}, expected one of {', '.join(PARAMETERS)}"
+            )
+        varied[PARAMETERS[option]] = [float(value) for value in values.split(",")]
+
+    parameters = parameter_grid(constants=constants, varied=varied)
+    if args.parameters is not None:
+        from_file = pd.read_csv(args.parameters)
+        options = {
+            column: column.strip().replace("_", "-") for column in from_file.columns
+        }
+        unknown = [
+            column for column, option in options.items() if option not in PARAMETERS
+        ]
+        if unknown:
+            parser.error(
+                f"Can't vary {', '.join(unknown)} in {args.parameters}, expected one of {', '.join(PARAMETERS)}"
+            )
+        from_file = from_file.rename(
+            columns={column: PARAMETERS[option] for column, option in options.items()}
+        )
+        # Every row of the file, for every combination of `--vary`
+        parameters = from_file.merge(
+            parameters.drop(columns=from_file.columns, errors="ignore"), how="cross"
+        )
+
+    missing = set(PARAMETERS.values()) - set(parameters.columns)
+    if missing:
+        parser.error(f"No value given for {', '.join(sorted(missing))}")
+    parameters = parameters[list(PARAMETERS.values())]
+
+    logger.info(f"Sweeping {len(parameters)} sets of parameters")
+
+    arguments = cli.analyse_csv_arguments(analysis)
+    folder, filename = arguments["folder"], arguments["filename"]
+
+    # Before reading and merging, which can take a while
+    output = args.output
+    if output is None:
+        output = folder / f"sweep_{filename}"
+    if output.exists() and not arguments["overwrite"]:
+        logger.error(f"{output} already exists, and `--overwrite` not specified")
+        sys.exit(1)
+
+    df = csv_analyser.read_and_merge(
+        substrate_path=csv_analyser.glob_once(folder, f"substrate_{filename}.csv"),
+        reference_path=csv_analyser.glob_once(folder, f"reference_{filename}.csv"),
+        pipette_path=csv_analyser.glob_once(folder, f"pipette_{filename}.csv"),
+        experiment_duration=arguments["experiment_duration"],
+        resample_to=arguments["resample_to"],
+        cache_dir=arguments["cache_dir"],
+        max_cache_size=arguments["max_cache_size"],
+        resample_engine=arguments["resample_engine"],
+    )
+
+    write_sweep(
+        directory=output,
+        df=df,
+        parameters=parameters,
+        reverse_sliding_direction=arguments["reverse_sliding_direction"],
+        sets_per_chunk=args.sets_per_chunk,
+        interval=pd.Timedelta(arguments["resample_to"], "seconds"),
+    )
@@ -0,0 +1,693 @@
+import concurrent.futures
+import contextlib
+import functools
+import importlib.util
+import logging
+import mmap
+import struct
+import zlib
+
+from collections import deque
+from pathlib import Path
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from .results import atomic_path
+
+logger = logging.getLogger(__name__)
+
+# Bytes per value of each TIFF field type
+TYPE_SIZES = {
+    1: 1,  # BYTE
+    2: 1,  # ASCII
+    3: 2,  # SHORT
+    4: 4,  # LONG
+    5: 8,  # RATIONAL
+    6: 1,  # SBYTE
+    7: 1,  # UNDEFINED
+    8: 2,  # SSHORT
+    9: 4,  # SLONG
+    10: 8,  # SRATIONAL
+    11: 4,  # FLOAT
+    12: 8,  # DOUBLE
+    13: 4,  # IFD
+    16: 8,  # LONG8, for BigTIFF
+    17: 8,  # SLONG8
+    18: 8,  # IFD8
+}
+SHORT, LONG, LONG8 = 3, 4, 16
+# Only allowed in BigTIFFs
+BIG_TYPES = {16, 17, 18}
+
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+STRIP_BYTE_COUNTS = 279
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+PAGE_NUMBER = 297
+
+# Pointers to things we don't copy (EXIF, GPS and interoperability metadata, sub-images and free space).
+# They would point at nothing in the stack, so are left out, as ImageMagick does
+DROPPED_TAGS = {288, 289, 330, 34665, 34853, 40965}
+# Old-style JPEG points into the image data in ways we can't follow
+UNSUPPORTED_TAGS = {513, 514}
+
+# TIFF's codes for what stacks can be compressed with
+COMPRESSIONS = {"deflate": 8, "zstd": 50000}
+# What we can decompress: none, LZW, deflate (and its old code), and zstd (with the zstandard package)
+DECODABLE = {1, 5, 8, 32946, 50000}
+
+# Classic TIFFs address everything with 32 bits
+MAX_OFFSET = 2**32 - 1
+# PageNumber is a SHORT, so can't count any higher
+MAX_PAGES = 2**16 - 1
+
+
+class Layout(NamedTuple):
+    """How a TIFF's header and IFDs are laid out. Classic TIFFs use 32 bit offsets, BigTIFFs 64 bit"""
+
+    magic: int
+    # `struct` codes for an IFD's number of entries, and for an offset (or an entry's count)
+    count: str
+    offset: str
+    # How many bytes of an entry's values fit in the entry itself
+    inline: int
+
+
+CLASSIC = Layout(magic=42, count="H", offset="I", inline=4)
+BIG = Layout(magic=43, count="Q", offset="Q", inline=8)
+
+
+class Entry(NamedTuple):
+    tag: int
+    type: int
+    count: int
+    # Exactly `count` values, in the file's byte order
+    value: bytes
+
+
+# Width, height and bit depths
+Description = Tuple[int, int, Tuple[int, ...]]
+
+
+class Page(NamedTuple):
+    # "<" or ">", for `struct`
+    byte_order: str
+    entries: Dict[int, Entry]
+    # Where each strip (or tile) of the image is, and how long it is
+    data: List[Tuple[int, int]]
+    # Where the page's IFD is
+    ifd: int = 0
+
+    def values(self, tag: int) -> Tuple[int, ...]:
+        """The numbers in an entry of type BYTE, SHORT, LONG or LONG8"""
+        entry = self.entries[tag]
+        code = {1: "B", SHORT: "H", LONG: "I", LONG8: "Q"}[entry.type]
+        return struct.unpack(f"{self.byte_order}{entry.count}{code}", entry.value)
+
+
+def read_pages(buffer: bytes, name: str = "TIFF") -> Iterator[Page]:
+    """Parse each page of a TIFF (classic or Big), without reading its image data
+
+    Args:
+        buffer (bytes): The whole file, e.g an `mmap`
+        name (str): What to call it in errors
+    """
+    byte_order, layout, offset = read_header(buffer, name)
+    seen = set()
+    while offset != 0:
+        if offset in seen:
+            raise ValueError(f"{name}'s pages loop back on themselves")
+        seen.add(offset)
+        page, offset = read_page(buffer, offset, byte_order, name, layout)
+        yield page
+
+
+def read_header(buffer: bytes, name: str = "TIFF") -> Tuple[str, Layout, int]:
+    """A TIFF's byte order (as `struct` wants it, "<" or ">"), layout, and where its first IFD is"""
+    byte_order = {b"II": "<", b"MM": ">"}.get(bytes(buffer[:2]))
+    if byte_order is None:
+        raise ValueError(f"{name} isn't a TIFF")
+    (magic,) = struct.unpack(f"{byte_order}H", buffer[2:4])
+    if magic == CLASSIC.magic:
+        (offset,) = struct.unpack(f"{byte_order}I", buffer[4:8])
+        return byte_order, CLASSIC, offset
+    if magic == BIG.magic:
+        offset_size, _, offset = struct.unpack(f"{byte_order}HHQ", buffer[4:16])
+        if offset_size != 8:
+            raise ValueError(f"{name} is a BigTIFF with {offset_size} byte offsets")
+        return byte_order, BIG, offset
+    raise ValueError(f"{name} isn't a TIFF we can read (magic number {magic})")
+
+
+def read_page(
+    buffer: bytes,
+    offset: int,
+    byte_order: str,
+    name: str = "TIFF",
+    layout: Layout = CLASSIC,
+) -> Tuple[Page, int]:
+    """Parse the page whose IFD is at `offset`, without reading the rest of the file
+
+    Returns:
+        Tuple[Page, int]: The page, and where the next page's IFD is (0 for none)
+    """
+    count_size = struct.calcsize(layout.count)
+    entry = f"HH{layout.offset}{layout.inline}s"
+    try:
+        (count,) = struct.unpack_from(f"{byte_order}{layout.count}", buffer, offset)
+        # The whole IFD at once: each entry's tag, type, count and value (or where its value is), then the next IFD
+        fields = struct.unpack_from(
+            f"{byte_order}{entry * count}{layout.offset}", buffer, offset + count_size
+        )
+    except struct.error as e:
+        raise ValueError(f"{name} is cut short") from e
+    entries = {}
+    for i in range(0, 4 * count, 4):
+        tag, type, n, value = fields[i : i + 4]
+        if type not in TYPE_SIZES:
+            raise ValueError(f"{name} has tag {tag} of unknown type {type}")
+        if tag in UNSUPPORTED_TAGS:
+            raise ValueError(f"{name} uses old-style JPEG compression")
+        size = TYPE_SIZES[type] * n
+        if size <= layout.inline:
+            value = value[:size]
+        else:
+            (start,) = struct.unpack(f"{byte_order}{layout.offset}", value)
+            value = bytes(buffer[start : start + size])
+        entries[tag] = Entry(tag, type, n, value)
+
+    page = Page(byte_order, entries, [], offset)
+    if STRIP_OFFSETS in entries:
+        offsets, counts = STRIP_OFFSETS, STRIP_BYTE_COUNTS
+    elif TILE_OFFSETS in entries:
+        offsets, counts = TILE_OFFSETS, TILE_BYTE_COUNTS
+    else:
+        raise ValueError(f"{name} has a page without any image data")
+    if counts not in entries:
+        raise ValueError(f"{name} doesn't say how long its image data is")
+    page.data.extend(zip(page.values(offsets), page.values(counts)))
+    return page, fields[-1]
+
+
+def write_page(
+    file: BinaryIO,
+    buffer: bytes,
+    page: Page,
+    layout: Layout = CLASSIC,
+    strips: Optional[List[bytes]] = None,
+    compression: Optional[int] = None,
+) -> Tuple[int, int, int]:
+    """Copy a page's image data byte for byte, followed by its IFD, which is rewritten to point at the copy
+
+    Args:
+        file (BinaryIO): Where to write. The page goes at the current position
+        buffer (bytes): The file `page` was read from
+        layout (Layout): Of the file being written
+        strips (Optional[List[bytes]]): Image data to write instead of the page's own, e.g compressed
+        compression (Optional[int]): What `strips` are compressed with, if not the page's own compression
+
+    Returns:
+        Tuple[int, int, int]: Where the IFD starts, where its link to the next IFD is, and where its PageNumber values are
+    """
+    fmt = page.byte_order
+    data_offsets = []
+    if strips is None:
+        with memoryview(buffer) as view:
+            for offset, length in page.data:
+                if offset + length > len(view):
+                    raise ValueError("Image data runs past the end of the file")
+                data_offsets.append(file.tell())
+                file.write(view[offset : offset + length])
+    else:
+        for strip in strips:
+            data_offsets.append(file.tell())
+            file.write(strip)
+
+    entries = {
+        tag: entry for tag, entry in page.entries.items() if tag not in DROPPED_TAGS
+    }
+    offsets_tag = STRIP_OFFSETS if STRIP_OFFSETS in entries else TILE_OFFSETS
+    offset_type = LONG if layout is CLASSIC else LONG8
+    entries[offsets_tag] = Entry(
+        offsets_tag,
+        offset_type,
+        len(data_offsets),
+        struct.pack(f"{fmt}{len(data_offsets)}{layout.offset}", *data_offsets),
+    )
+    if strips is not None:
+        counts_tag = (
+            STRIP_BYTE_COUNTS if offsets_tag == STRIP_OFFSETS else TILE_BYTE_COUNTS
+        )
+        entries[counts_tag] = Entry(
+            counts_tag,
+            offset_type,
+            len(strips),
+            struct.pack(f"{fmt}{len(strips)}{layout.offset}", *map(len, strips)),
+        )
+    if compression is not None:
+        entries[COMPRESSION] = Entry(
+            COMPRESSION, SHORT, 1, struct.pack(f"{fmt}H", compression)
+        )
+    # Mark it as one page of many, as ImageMagick does.
+    # Page numbers are filled in once we know how many there are
+    entries[NEW_SUBFILE_TYPE] = Entry(
+        NEW_SUBFILE_TYPE, LONG, 1, struct.pack(f"{fmt}I", 2)
+    )
+    entries[PAGE_NUMBER] = Entry(PAGE_NUMBER, SHORT, 2, struct.pack(f"{fmt}2H", 0, 0))
+    ordered = [entries[tag] for tag in sorted(entries)]
+    if layout is CLASSIC and any(entry.type in BIG_TYPES for entry in ordered):
+        raise TooBig("The page has values that only fit in a BigTIFF")
+
+    # IFDs (and the values they point to) start on a word boundary
+    if file.tell() % 2:
+        file.write(b"\0")
+    ifd = file.tell()
+    offset_size = struct.calcsize(layout.offset)
+    values_start = (
+        ifd
+        + struct.calcsize(layout.count)
+        + (4 + offset_size + layout.inline) * len(ordered)
+        + offset_size
+    )
+    table = bytearray(struct.pack(f"{fmt}{layout.count}", len(ordered)))
+    values = bytearray()
+    page_number = 0
+    for entry in ordered:
+        table += struct.pack(
+            f"{fmt}HH{layout.offset}", entry.tag, entry.type, entry.count
+        )
+        if entry.tag == PAGE_NUMBER:
+            page_number = ifd + len(table)
+        if len(entry.value) <= layout.inline:
+            table += entry.value.ljust(layout.inline, b"\0")
+        else:
+            table += struct.pack(f"{fmt}{layout.offset}", values_start + len(values))
+            values += entry.value
+            if len(values) % 2:
+                values += b"\0"
+    link = ifd + len(table)
+    table += struct.pack(f"{fmt}{layout.offset}", 0)
+    file.write(table)
+    file.write(values)
+    if layout is CLASSIC and file.tell() > MAX_OFFSET:
+        raise TooBig("The stack is too big for a classic TIFF")
+    return ifd, link, page_number
+
+
+class TooBig(ValueError):
+    """Raised when writing a classic TIFF that needs to be a BigTIFF"""
+
+
+def stack(
+    sources: Iterable[Path],
+    destination: Path,
+    descriptions: Optional[List[Description]] = None,
+    big: Optional[bool] = None,
+    compression: Optional[str] = None,
+    level: int = 6,
+    threads: int = 1,
+) -> int:
+    """Combine TIFFs into one multi-page TIFF, without decoding them.
+    Each page's image data is copied as it is, so the pages keep their own compression, and their pixels are unchanged.
+    Sources are read through `mmap`, and the stack is written as it goes, so memory use doesn't grow with the number of files.
+    `destination` only appears once it is complete
+
+    Args:
+        sources (Iterable[Path]): Images to stack from, in order. Each of their pages is copied
+        destination (Path): Image to stack to
+        descriptions (Optional[List[Description]]): If given, `describe` of each page copied is added to it, for `verify`
+        big (Optional[bool]): Whether to write a BigTIFF, which most (but not all) readers can read.
+            By default, only stacks that don't fit in a classic TIFF's 4 GiB are
+        compression (Optional[str]): Compress pages that aren't already compressed, losslessly, with one of `COMPRESSIONS`.
+            Pages that are already compressed are copied as they are
+        level (int): How hard to compress, from 1 (quickest) to 9 for deflate, or 22 for zstd
+        threads (int): How many pages' strips to compress at once. They are still written in order
+
+    Returns:
+        int: How many pages the stack has
+
+    Raises:
+        ValueError: If the stack would have more than `MAX_PAGES` pages. Nothing is written
+    """
+    sources = list(sources)
+    if len(sources) > MAX_PAGES:
+        raise ValueError(
+            f"Can't stack {len(sources)} files into one TIFF, which holds at most {MAX_PAGES} pages"
+        )
+    if big is None:
+        big = needs_big(sources)
+    if descriptions is None:
+        descriptions = []
+    compress = None
+    if compression is not None:
+        compress = (COMPRESSIONS[compression], compressor(compression, level))
+    try:
+        return _stack(
+            sources,
+            destination,
+            descriptions,
+            BIG if big else CLASSIC,
+            compress,
+            threads,
+        )
+    except TooBig:
+        if big:
+            raise
+        # Only just too big. Rare enough that starting again is fine
+        logger.info(f"{destination.as_posix()} needs to be a BigTIFF, starting again")
+        descriptions.clear()
+        return _stack(sources, destination, descriptions, BIG, compress, threads)
+
+
+def compressor(compression: str, level: int) -> Callable[[bytes], bytes]:
+    """A function that compresses a strip with one of `COMPRESSIONS`.
+    Both zlib and zstandard let other threads run while they compress, so strips can be compressed in parallel
+    """
+    if compression == "deflate":
+        return functools.partial(zlib.compress, level=level)
+    assert compression == "zstd", f"Unknown compression {compression}"
+    if importlib.util.find_spec("zstandard") is None:
+        raise ValueError("Compressing with zstd needs the zstandard package")
+    import zstandard
+
+    # Compressors can't be shared between threads, and are cheap to make
+    return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def needs_big(sources: Iterable[Path]) -> bool:
+    """Whether a stack of these files is likely too big for a classic TIFF"""
+    size = sum(source.stat().st_size for source in sources)
+    # Leave room for the stack's bigger IFDs
+    return size > MAX_OFFSET * 0.99
+
+
+def _stack(
+    sources: List[Path],
+    destination: Path,
+    descriptions: List[Description],
+    layout: Layout,
+    compress: Optional[Tuple[int, Callable[[bytes], bytes]]],
+    threads: int,
+) -> int:
+    byte_order = None
+    pages: List[Tuple[int, int, int]] = []
+    with atomic_path(destination) as temporary, temporary.open("wb") as file:
+        header_size = 8 if layout is CLASSIC else 16
+        file.write(bytes(header_size))  # The header, once we know the byte order
+        to_stack = _pages_to_stack(sources, descriptions)
+        if compress is None:
+            for buffer, page in to_stack:
+                pages.append(write_page(file, buffer, page, layout))
+                byte_order = page.byte_order
+        else:
+            for page, strips, compression in _compress_pages(
+                to_stack, *compress, threads
+            ):
+                pages.append(write_page(file, b"", page, layout, strips, compression))
+                byte_order = page.byte_order
+
+        if byte_order is None:
+            raise ValueError("Nothing to stack")
+        # Now link the pages together, and number them
+        file.seek(0)
+        file.write(b"II" if byte_order == "<" else b"MM")
+        if layout is CLASSIC:
+            file.write(struct.pack(f"{byte_order}HI", CLASSIC.magic, pages[0][0]))
+        else:
+            file.write(struct.pack(f"{byte_order}HHHQ", BIG.magic, 8, 0, pages[0][0]))
+        for i, (_, link, page_number) in enumerate(pages):
+            if i + 1 < len(pages):
+                file.seek(link)
+                file.write(struct.pack(f"{byte_order}{layout.offset}", pages[i + 1][0]))
+            file.seek(page_number)
+            file.write(struct.pack(f"{byte_order}2H", i, len(pages)))
+
+    logger.debug(f"Stacked {len(pages)} pages into {destination.as_posix()}")
+    return len(pages)
+
+
+def _pages_to_stack(
+    sources: List[Path], descriptions: List[Description]
+) -> Iterator[Tuple[mmap.mmap, Page]]:
+    """Each page of each source, along with the source's buffer, which is only open until the next source's pages"""
+    byte_order = None
+    count = 0
+    for source in sources:
+        with mapped(source) as buffer:
+            for page in read_pages(buffer, name=source.as_posix()):
+                if byte_order is None:
+                    byte_order = page.byte_order
+                elif page.byte_order != byte_order:
+                    # Multi-byte samples would need swapping
+                    raise ValueError(
+                        f"{source.as_posix()} has a different byte order to the files before it"
+                    )
+                count += 1
+                if count > MAX_PAGES:
+                    # Only multi-page sources get this far. The unfinished stack isn't left behind
+                    raise ValueError(
+                        f"Stacking {source.as_posix()} takes the stack over {MAX_PAGES} pages"
+                    )
+                descriptions.append(describe(page))
+                yield buffer, page
+
+
+def _compress_pages(
+    pages: Iterator[Tuple[mmap.mmap, Page]],
+    compression: int,
+    compress: Callable[[bytes], bytes],
+    threads: int,
+) -> Iterator[Tuple[Page, List[bytes], Optional[int]]]:
+    """Each page, with its strips compressed (unless they already are) on `threads` threads.
+    A few pages are compressed ahead of the one being yielded, so the threads are kept busy, and the pages stay in order
+
+    Yields:
+        Tuple[Page, List[bytes], Optional[int]]: The page, its strips, and what they were compressed with (None if they were already)
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        ahead: Deque[Tuple[Page, List[Any], Optional[int]]] = deque()
+        for buffer, page in pages:
+            if any(offset + length > len(buffer) for offset, length in page.data):
+                raise ValueError("Image data runs past the end of the file")
+            # Copied now, as the buffer is closed once its source's pages are done
+            strips = [buffer[offset : offset + length] for offset, length in page.data]
+            if _compression(page) == 1:
+                ahead.append(
+                    (
+                        page,
+                        [executor.submit(compress, strip) for strip in strips],
+                        compression,
+                    )
+                )
+            else:
+                ahead.append((page, strips, None))
+            while len(ahead) > 2 * threads:
+                yield _finished(*ahead.popleft())
+        while ahead:
+            yield _finished(*ahead.popleft())
+
+
+def _finished(
+    page: Page, strips: List[Any], compression: Optional[int]
+) -> Tuple[Page, List[bytes], Optional[int]]:
+    if compression is not None:
+        strips = [strip.result() for strip in strips]
+    return page, strips, compression
+
+
+def _compression(page: Page) -> int:
+    return page.values(COMPRESSION)[0] if COMPRESSION in page.entries else 1
+
+
+@contextlib.contextmanager
+def mapped(path: Path) -> Iterator[mmap.mmap]:
+    """The whole file, read only through `mmap`, so only the parts that are looked at are read"""
+    with path.open("rb") as handle, mmap.mmap(
+        handle.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        yield buffer
+
+
+def count_pages(path: Path) -> int:
+    """How many pages a TIFF has, without reading their image data"""
+    with mapped(path) as buffer:
+        return sum(1 for _ in read_pages(buffer, name=path.as_posix()))
+
+
+def describe(page: Page) -> Description:
+    """A page's width, height and bit depths (of each different sample)"""
+    bits = page.values(BITS_PER_SAMPLE) if BITS_PER_SAMPLE in page.entries else (1,)
+    return (
+        page.values(IMAGE_WIDTH)[0],
+        page.values(IMAGE_LENGTH)[0],
+        tuple(sorted(set(bits))),
+    )
+
+
+def checksums(buffer: bytes, page: Page) -> List[int]:
+    """CRC-32 of each of the page's strips (or tiles), as they are stored"""
+    with memoryview(buffer) as view:
+        return [
+            zlib.crc32(view[offset : offset + length]) for offset, length in page.data
+        ]
+
+
+def verify(
+    sources: Iterable[Path],
+    stack: Path,
+    compare_data: bool = False,
+    descriptions: Optional[List[Description]] = None,
+) -> int:
+    """Check that a stack has a page for each of the sources' pages, of the same size and bit depth,
+    by following the chain of IFDs, without decoding any pixels
+
+    Args:
+        sources (Iterable[Path]): What the stack was made from, in order
+        stack (Path): What was made
+        compare_data (bool): Also check that each page's data is byte for byte the same as its source's,
+            by comparing checksums of each strip (or, for pages that `stack` compressed, their pixels).
+            Only for stacks made by `stack`
+        descriptions (Optional[List[Description]]): The sources' pages, from `stack`, so they needn't be read again.
+            Not used when comparing data
+
+    Raises:
+        ValueError: If the stack doesn't match, saying how
+
+    Returns:
+        int: How many pages the stack has
+    """
+    with mapped(stack) as stacked:
+        pages = read_pages(stacked, name=stack.as_posix())
+        number = 0
+        for source, expected, buffer, source_page in _source_pages(
+            sources, None if compare_data else descriptions
+        ):
+            page = next(pages, None)
+            if page is None:
+                raise ValueError(
+                    f"{stack.as_posix()} ends before the pages of {source}"
+                )
+            if describe(page) != expected:
+                raise ValueError(
+                    f"Page {number} of {stack.as_posix()} is {describe(page)} (width, height, bits), "
+                    f"but {source} is {expected}"
+                )
+            if compare_data and not _same_data(stacked, page, buffer, source_page):
+                raise ValueError(
+                    f"Page {number} of {stack.as_posix()} has different data to {source}"
+                )
+            number += 1
+        extra = sum(1 for _ in pages)
+        if extra:
+            raise ValueError(
+                f"{stack.as_posix()} has {extra} more pages than its sources"
+            )
+    return number
+
+
+def _same_data(buffer: bytes, page: Page, source: bytes, source_page: Page) -> bool:
+    if _compression(page) == _compression(source_page):
+        return checksums(buffer, page) == checksums(source, source_page)
+    # Compressed while it was stacked, so compare the pixels
+    return decode(buffer, page) == decode(source, source_page)
+
+
+def _source_pages(
+    sources: Iterable[Path], descriptions: Optional[List[Description]]
+) -> Iterator[Tuple[str, Description, Any, Optional[Page]]]:
+    """What to check each page of a stack against: its source's name and description,
+    and (unless the descriptions are already known) the source's buffer and page"""
+    if descriptions is not None:
+        for number, description in enumerate(descriptions):
+            yield f"its source's page {number}", description, None, None
+        return
+    for source in sources:
+        with mapped(source) as buffer:
+            for page in read_pages(buffer, name=source.as_posix()):
+                yield source.as_posix(), describe(page), buffer, page
+
+
+def decode(buffer: bytes, page: Page) -> bytes:
+    """The pixels of an uncompressed, LZW, deflate or zstd-compressed page, e.g to check that a stack has the same pixels as its sources
+
+    Returns:
+        bytes: Rows of interleaved samples, as they would be stored uncompressed
+    """
+    compression = _compression(page)
+    if compression not in DECODABLE:
+        raise NotImplementedError(f"Can't decode compression {compression}")
+    if TILE_OFFSETS in page.entries:
+        raise NotImplementedError("Can't decode tiled images")
+
+    decompress: Callable[[bytes], bytes] = bytes
+    if compression == 5:
+        decompress = _lzw_decode
+    elif compression in (8, 32946):
+        decompress = zlib.decompress
+    elif compression == 50000:
+        import zstandard
+
+        decompress = zstandard.ZstdDecompressor().decompress
+
+    pixels = bytearray()
+    for offset, length in page.data:
+        pixels += decompress(buffer[offset : offset + length])
+
+    predictor = page.values(317)[0] if 317 in page.entries else 1
+    if predictor == 2:
+        # Horizontal differencing: each sample was stored as its difference from the one a pixel to its left
+        if set(page.values(258)) != {8}:
+            raise NotImplementedError("Can only undo the predictor for 8 bit samples")
+        samples = page.values(277)[0] if 277 in page.entries else 1
+        row = page.values(256)[0] * samples
+        for start in range(0, len(pixels), row):
+            for i in range(start + samples, start + row):
+                pixels[i] = (pixels[i] + pixels[i - samples]) & 0xFF
+    elif predictor != 1:
+        raise NotImplementedError(f"Can't undo predictor {predictor}")
+    return bytes(pixels)
+
+
+def _lzw_decode(data: bytes) -> bytes:
+    """TIFF's flavour of LZW: codes are most significant bit first, and widen one code early"""
+    clear, end = 256, 257
+    table = [bytes([i]) for i in range(256)] + [b"", b""]
+    decoded = bytearray()
+    padded = bytes(data) + b"\0\0\0"
+    width, position, previous = 9, 0, None
+    while position + width <= 8 * len(data):
+        chunk = int.from_bytes(padded[position >> 3 : (position >> 3) + 3], "big")
+        code = (chunk >> (24 - (position & 7) - width)) & ((1 << width) - 1)
+        position += width
+        if code == clear:
+            del table[258:]
+            width, previous = 9, None
+            continue
+        if code == end:
+            break
+        if previous is None:
+            entry = table[code]
+        else:
+            entry = table[code] if code < len(table) else previous + previous[:1]
+            table.append(previous + entry[:1])
+            if len(table) >= (1 << width) - 1 and width < 12:
+                width += 1
+        decoded += entry
+        previous = entry
+    return bytes(decoded)
@@ -1,118 +1,426 @@
-import argparse
+import concurrent.futures
+import json
 import logging
+import os
 import subprocess
-import sys
+import threading
 
-from collections import deque
 from pathlib import Path
-from typing import Iterable, List, TextIO
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TextIO,
+)
 
-from .utils import grouper, pformat
+from . import discovery, frames, profiling, tiff
+from .results import atomic_path
+from .utils import grouper, pformat, size_grouper
 
 logger = logging.getLogger(__name__)
 
+# Kept in each folder, so that a run that is stopped part way through can carry on where it left off
+JOURNAL_NAME = ".tiff-stacker-journal.jsonl"
+# Stacks in different threads record to the same journals
+_journal_lock = threading.Lock()
+
+
+class Group(NamedTuple):
+    stack: Path
+    files: List[Path]
+    # Whether an earlier run finished the stack, but not deleting the files
+    stacked: bool = False
+
+
+class Compression(NamedTuple):
+    # One of `tiff.COMPRESSIONS`
+    name: str
+    # As `tiff.stack`
+    level: int = 6
+    threads: int = 1
+
+
+class Journal(NamedTuple):
+    # Every group ever planned in the folder, in order
+    planned: List[Group]
+    # Names of the stacks that have been finished, and of those whose files have all been deleted
+    stacked: Set[str]
+    deleted: Set[str]
+
 
 def stack_in_folders(
-    folders: Iterable[Path], files_per_stack: int, imagemagick_stderr: TextIO
+    folders: Iterable[Path],
+    files_per_stack: int,
+    imagemagick_stderr: TextIO,
+    engine: str = "native",
+    jobs: int = 1,
+    order: str = "natural",
+    checksums: bool = False,
+    bytes_per_stack: Optional[int] = None,
+    compression: Optional[Compression] = None,
 ):
     """For each folder, discover all TIF files, and combine them into stacks comprising of the contents of N of those files
 
     Args:
         folders (Iterable[Path]): The folders to search for TIFs in. The final folder will contain the stacks, with the originals removed
-        frames_per_stack (int): How many files to combine into each stack
+        frames_per_stack (int): How many files to combine into each stack, up to `tiff.MAX_PAGES`
+        engine (str): As `stack_tifs`
+        jobs (int): How many stacks to build at once, across groups and folders.
+            The next folders are discovered, and each stack's originals are deleted, while other stacks are being built.
+            The stacks are numbered, and made from the same files, as when they are built one at a time
+        order (str): Which order to put the files in, as `discovery.scan_tifs`
+        checksums (bool): When checking each stack before deleting its files, also compare its data with theirs, as `verify_stack`
+        bytes_per_stack (Optional[int]): Instead of `files_per_stack`, put as many files in each stack as fit in this many bytes,
+            so that stacks are about the same size, whatever the size of the images.
+            Stacks that would be bigger than 4 GiB are written as BigTIFFs. Stacks still have at most `tiff.MAX_PAGES` files
+        compression (Optional[Compression]): As `stack_tifs`
+
+    Each folder keeps a journal of the stacks planned, made and deleted from, so a run that is stopped part way through
+    carries on from the first unfinished stack when it is run again. Stacks only get their names once they are complete
     """
     folders: List[Path] = list(filter(Path.is_dir, folders))  # type: ignore
     logger.debug(f"Creating stacks from contents of each folder in {folders}")
 
-    for folder in folders:
-        tifs = list(filter(Path.is_file, folder.glob("**/*.tif")))
-        tifs.sort()
+    assert jobs >= 1, "Need at least one job"
+    assert (
+        1 <= files_per_stack <= tiff.MAX_PAGES
+    ), f"A stack can have between 1 and {tiff.MAX_PAGES} files, not {files_per_stack}"
+    if jobs == 1:
+        for folder in folders:
+            for group in plan_stacks(folder, files_per_stack, order, bytes_per_stack):
+                build_stack(group, imagemagick_stderr, engine, checksums, compression)
+        return
 
-        logger.info(f"Found {len(tifs)} TIFs in {folder}")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending: Set[concurrent.futures.Future] = set()
+        discovered: List[Path] = []
+        try:
+            for folder in folders:
+                if any(_overlap(folder, earlier) for earlier in discovered):
+                    # Building the earlier folder's stacks adds and removes files in this one, so let them finish first
+                    for future in concurrent.futures.as_completed(pending):
+                        future.result()
+                    pending = set()
+                discovered.append(folder)
 
-        logger.debug(f"TIFs:\n{pformat(tifs)}")
+                for group in plan_stacks(
+                    folder, files_per_stack, order, bytes_per_stack
+                ):
+                    # Bounded, so that discovery doesn't run far ahead of building
+                    while len(pending) >= 2 * jobs:
+                        done, pending = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            future.result()
+                    pending.add(
+                        executor.submit(
+                            build_stack,
+                            group,
+                            imagemagick_stderr,
+                            engine,
+                            checksums,
+                            compression,
+                        )
+                    )
 
-        for group_number, group in enumerate(  # `enumerate` gives us the group number
-            grouper(iterable=tifs, group_size=files_per_stack)
-        ):
-            group: List[Path] = list(group)  # type:ignore
-            stack = folder / f"stack{group_number}.tif"
-            logger.info(
-                f"Making a stacking from {group[0]} to {group[-1]} into {stack}"
-            )
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+        except BaseException:
+            # Let the stacks that have started finish, but don't start any more
+            for future in pending:
+                future.cancel()
+            raise
 
-            stack_tifs(
-                sources=group, destination=stack, imagemagick_stderr=imagemagick_stderr
-            )
 
-            # Now delete all the files
-            deque(map(Path.unlink, group))
+def plan_stacks(
+    folder: Path,
+    files_per_stack: int,
+    order: str = "natural",
+    bytes_per_stack: Optional[int] = None,
+) -> Iterator[Group]:
+    """Which files go into each stack.
+    Groups from the folder's journal that haven't been finished are carried on with first.
+    Then the rest of the TIFs in the folder (other than stacks we made) are discovered, and each group is planned in the journal
+    as soon as it is found, so stacking can start before discovery finishes
+
+    Args:
+        order (str): As `discovery.scan_tifs`
+        bytes_per_stack (Optional[int]): As `stack_in_folders`
+
+    Yields:
+        Group: Where each stack goes, and the files to make it from
+    """
+    journal = read_journal(folder)
+    unfinished = [
+        group for group in journal.planned if group.stack.name not in journal.deleted
+    ]
+    if unfinished:
+        logger.info(
+            f"Resuming {folder} from its journal, with {len(unfinished)} of {len(journal.planned)} stacks left"
+        )
+        yield from unfinished
+
+    # Files whose stacks are still being made are already planned
+    planned = {file for group in journal.planned for file in group.files}
+    if bytes_per_stack is None:
+        tifs = (
+            tif
+            for tif in discovery.scan_tifs(folder, order=order)
+            if tif not in planned
+        )
+        groups = grouper(iterable=tifs, group_size=files_per_stack)
+    else:
+        sizes = (
+            (tif, size)
+            for tif, size in discovery.scan_tif_sizes(folder, order=order)
+            if tif not in planned
+        )
+        groups = size_grouper(
+            iterable=sizes, group_size=bytes_per_stack, max_items=tiff.MAX_PAGES
+        )
+    found = 0
+    for group_number, group in enumerate(  # `enumerate` gives us the group number
+        groups, start=len(journal.planned)  # After any stacks from earlier runs
+    ):
+        files = list(group)
+        found += len(files)
+        logger.debug(f"TIFs:\n{pformat(files)}")
+        stack = folder / f"stack{group_number}.tif"
+        record(
+            folder,
+            event="plan",
+            groups=[
+                [stack.name, [file.relative_to(folder).as_posix() for file in files]]
+            ],
+        )
+        yield Group(stack, files)
+
+    logger.info(f"Found {found} TIFs in {folder}")
 
 
-def stack_tifs(sources: Iterable[Path], destination: Path, imagemagick_stderr: TextIO):
-    """Call out to imagemagick to do the stacking
+def build_stack(
+    group: Group,
+    imagemagick_stderr: TextIO,
+    engine: str,
+    checksums: bool = False,
+    compression: Optional[Compression] = None,
+):
+    """Stack a group of files, check and index the stack, then delete them, recording each step in the folder's journal
 
     Args:
-        sources (Iterable[Path]): Images to stack from
-        destination (Path): Image to stack to
+        checksums (bool): As `verify_stack`
+        compression (Optional[Compression]): As `stack_tifs`
     """
-    command = ["convert"]
-    sources = map(Path.as_posix, map(Path.absolute, sources))  # type: ignore
-    command.extend(map(str, sources))
-    command.append(destination.absolute().as_posix())
-
-    logger.debug(f"Issuing command {pformat(command)}")
-
-    subprocess.run(
-        command, check=True, stderr=imagemagick_stderr
-    )  # TODO there is a more pythonic way of doing this
-
-
-def main():
-    parser = argparse.ArgumentParser(
-        description="""
-    Given a list of directories this program will
-    - Gather all files that end in .tif
-    - Sort them lexicographically
-    - Merge FILES_PER_STACK of them into a single "stackN.tif" file into that directory (where N is the current batch), for all files
-    - Delete the original files
-
-    It calls `convert`, with the assumption that it is ImageMagick. Ensure that ImageMagick is installed
-    """,
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-    )
-    parser.add_argument("folder", type=Path, nargs="+")
-    parser.add_argument(
-        "-f",
-        "--files-per-stack",
-        type=int,
-        default=2000,
-        help="Number of files to combine into each stack. Defaults to 2000",
-    )
-    parser.add_argument(
-        "-i",
-        "--imagemagick-stderr",
-        type=argparse.FileType(mode="w"),
-        default=sys.stdout,
-        help="ImageMagick sometimes emits some benign errors to stderr (like unknown TIFF metadata fields). Specify a logfile to avoid stdout being cluttered",
-    )
-    parser.add_argument(
-        "-l",
-        "--log-level",
-        type=lambda x: getattr(logging, x.upper()),
-        default=logging.INFO,
-        help="How verbose to be",
-    )
-    args = parser.parse_args()
+    stack, folder = group.stack, group.stack.parent
+    if group.stacked:
+        logger.info(f"{stack} was already made, deleting what it was made from")
+    else:
+        # The run that made it may have stopped before it could record it
+        pages = _already_made(group, engine, checksums) if stack.exists() else None
+        if pages is not None:
+            logger.info(f"{stack} was already made")
+        else:
+            pages = _make(group, imagemagick_stderr, engine, checksums, compression)
 
-    logging.basicConfig(level=args.log_level)
+        with profiling.stage("index"):
+            # Only files with several pages need counting
+            pages_per_file = None
+            if pages != len(group.files):
+                pages_per_file = [tiff.count_pages(file) for file in group.files]
+            frames.write_index(stack, group.files, pages_per_file)
+        record(
+            folder,
+            event="stacked",
+            stack=stack.name,
+            pages=pages,
+            size=stack.stat().st_size,
+        )
 
-    logger.debug(f"Arguments: {args}")
+    # Now delete all the files
+    with profiling.stage("delete") as counts:
+        for file in group.files:
+            file.unlink(missing_ok=True)
+        counts["files"] = len(group.files)
+    record(folder, event="deleted", stack=stack.name)
 
-    stack_in_folders(
-        folders=args.folder,
-        files_per_stack=args.files_per_stack,
-        imagemagick_stderr=args.imagemagick_stderr,
+
+def _make(
+    group: Group,
+    imagemagick_stderr: TextIO,
+    engine: str,
+    checksums: bool,
+    compression: Optional[Compression],
+) -> int:
+    stack = group.stack
+    logger.info(
+        f"Making a stacking from {group.files[0]} to {group.files[-1]} into {stack}"
     )
 
-    logger.info("All done!")
+    descriptions: List[tiff.Description] = []
+    with profiling.stage("convert") as counts:
+        stack_tifs(
+            sources=group.files,
+            destination=stack,
+            imagemagick_stderr=imagemagick_stderr,
+            engine=engine,
+            descriptions=descriptions,
+            compression=compression,
+        )
+        counts.update(files=len(group.files), bytes=stack.stat().st_size)
+
+    # Don't record it as done until it will survive a crash
+    with stack.open("rb") as file:
+        os.fsync(file.fileno())
+    # Nor until we know it has everything, as the originals are deleted next.
+    # If it doesn't, it is left for a look, and made again by the next run
+    return verify_stack(group, engine, checksums, descriptions or None)
+
+
+def verify_stack(
+    group: Group,
+    engine: str,
+    checksums: bool = False,
+    descriptions: Optional[List[tiff.Description]] = None,
+) -> int:
+    """Check that a group's stack has a page of the same size and bit depth for each of its files' pages.
+    Only the TIFFs' IFDs are read, not their pixels, so this takes a small fraction of the time making the stack did
+
+    Args:
+        checksums (bool): Also check that each page's data is the same as the file it came from.
+            Only for the native engine, as ImageMagick re-encodes the data
+        descriptions (Optional[List[tiff.Description]]): As `tiff.verify`
+
+    Raises:
+        ValueError: If the stack doesn't match
+
+    Returns:
+        int: How many pages the stack has
+    """
+    with profiling.stage("verify") as counts:
+        pages = tiff.verify(
+            group.files,
+            group.stack,
+            compare_data=checksums and engine == "native",
+            descriptions=descriptions,
+        )
+        counts["pages"] = pages
+    logger.debug(f"Verified the {pages} pages of {group.stack}")
+    return pages
+
+
+def _already_made(group: Group, engine: str, checksums: bool) -> Optional[int]:
+    """How many pages the group's stack has, if it has been made from all of its files"""
+    try:
+        return verify_stack(group, engine, checksums)
+    except (OSError, ValueError) as e:
+        # Stopped part way through (for ImageMagick) making it, or it was made wrong
+        logger.info(f"Making {group.stack} again, as {e}")
+        return None
+
+
+def read_journal(folder: Path) -> Journal:
+    """What the folder's journal says has been planned and done. Empty if there's no journal"""
+    journal = Journal(planned=[], stacked=set(), deleted=set())
+    path = folder / JOURNAL_NAME
+    if not path.exists():
+        return journal
+
+    with path.open() as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be cut short, by a crash while it was written
+                logger.warning(f"Ignoring incomplete line at the end of {path}")
+                break
+            if entry["event"] == "plan":
+                journal.planned.extend(
+                    Group(folder / stack, [folder / file for file in files])
+                    for stack, files in entry["groups"]
+                )
+            elif entry["event"] == "stacked":
+                journal.stacked.add(entry["stack"])
+            elif entry["event"] == "deleted":
+                journal.deleted.add(entry["stack"])
+
+    journal.planned[:] = [
+        group._replace(stacked=group.stack.name in journal.stacked)
+        for group in journal.planned
+    ]
+    return journal
+
+
+def record(folder: Path, **entry: Any):
+    """Durably add an entry to the folder's journal"""
+    line = json.dumps(entry) + "\n"
+    with _journal_lock, (folder / JOURNAL_NAME).open("a") as file:
+        file.write(line)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def _overlap(a: Path, b: Path) -> bool:
+    """Whether one folder is (or is inside) the other"""
+    a, b = a.resolve(), b.resolve()
+    return a == b or a in b.parents or b in a.parents
+
+
+def stack_tifs(
+    sources: Iterable[Path],
+    destination: Path,
+    imagemagick_stderr: TextIO,
+    engine: str = "native",
+    descriptions: Optional[List[tiff.Description]] = None,
+    compression: Optional[Compression] = None,
+):
+    """Stack images into one multi-page TIFF
+
+    Args:
+        sources (Iterable[Path]): Images to stack from
+        destination (Path): Image to stack to
+        engine (str): "native" copies each image's data as it is (see `tiff.stack`), which is much quicker, and doesn't need ImageMagick.
+            "imagemagick" calls out to `convert`, which decodes and re-encodes every image (and so can stack other formats)
+        descriptions (Optional[List[tiff.Description]]): For the native engine, as `tiff.stack`
+        compression (Optional[Compression]): Losslessly compress the stack's pages (those that aren't already compressed, for the native engine).
+            ImageMagick compresses every page, on its own threads, at its own level
+    """
+    if engine == "native":
+        options: Dict[str, Any] = {}
+        if compression is not None:
+            options = dict(
+                compression=compression.name,
+                level=compression.level,
+                threads=compression.threads,
+            )
+        tiff.stack(
+            sources=sources,
+            destination=destination,
+            descriptions=descriptions,
+            **options,
+        )
+        return
+    assert engine == "imagemagick", f"Unknown engine {engine}"
+
+    sources = list(sources)
+    with atomic_path(destination) as temporary:
+        command = ["convert"]
+        command.extend(source.absolute().as_posix() for source in sources)
+        if compression is not None:
+            command.extend(
+                ["-compress", {"deflate": "Zip", "zstd": "Zstd"}[compression.name]]
+            )
+        # The temporary file's suffix isn't .tif, so tell ImageMagick what to write
+        output_format = "TIFF64" if tiff.needs_big(sources) else "TIFF"
+        command.append(f"{output_format}:{temporary.absolute().as_posix()}")
+
+        logger.debug(f"Issuing command {pformat(command)}")
+
+        subprocess.run(
+            command, check=True, stderr=imagemagick_stderr
+        )  # TODO there is a more pythonic way of doing this
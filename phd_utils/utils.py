@@ -1,6 +1,6 @@
 import itertools
 import pprint
-from typing import Iterable
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
 
 
 def grouper(iterable: Iterable, group_size: int):
@@ -19,6 +19,32 @@ def grouper(iterable: Iterable, group_size: int):
         yield itertools.chain((first_el,), chunk_it)
 
 
+def size_grouper(
+    iterable: Iterable[Tuple[Any, int]],
+    group_size: int,
+    max_items: Optional[int] = None,
+) -> Iterator[List[Any]]:
+    """
+    Split an iterable of (item, size) pairs into consecutive groups, each as big as possible without going over group_size,
+    or having more than max_items items.
+    Items bigger than group_size go in a group by themselves
+    """
+
+    group: List[Any] = []
+    total = 0
+    for item, size in iterable:
+        if group and (
+            total + size > group_size
+            or (max_items is not None and len(group) >= max_items)
+        ):
+            yield group
+            group, total = [], 0
+        group.append(item)
+        total += size
+    if group:
+        yield group
+
+
 def pformat(
     object,
     indent=1,
@@ -0,0 +1,236 @@
+import argparse
+import contextlib
+import getpass
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+
+from pathlib import Path
+from typing import Any, List, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+# Overrides where the worker listens, e.g to keep one worker per project
+SOCKET_VARIABLE = "PHD_UTILS_WORKER_SOCKET"
+
+
+def default_socket() -> Path:
+    """Where the worker listens: `$PHD_UTILS_WORKER_SOCKET`, else in `$XDG_RUNTIME_DIR` (which only the user can see), else the temporary directory"""
+    if SOCKET_VARIABLE in os.environ:
+        return Path(os.environ[SOCKET_VARIABLE])
+    folder = os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir())
+    return Path(folder) / f"phd_utils-{getpass.getuser()}.sock"
+
+
+def _send(file: TextIO, **message: Any):
+    file.write(json.dumps(message) + "\n")
+    file.flush()
+
+
+def _connect(socket_path: Path) -> Optional[socket.socket]:
+    """A connection to the worker, or None if it isn't running"""
+    if not hasattr(socket, "AF_UNIX"):  # Windows
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path.as_posix())
+    except (FileNotFoundError, ConnectionRefusedError):
+        connection.close()
+        return None
+    return connection
+
+
+def submit(
+    command: str, argv: List[str], socket_path: Optional[Path] = None
+) -> Optional[int]:
+    """Have the worker run a command, relaying its logs and output as if it ran here
+
+    Args:
+        command (str): One of `cli.COMMANDS`, or "stop" to have the worker exit
+        argv (List[str]): The command's arguments
+        socket_path (Optional[Path]): Where the worker listens. Defaults to `default_socket()`
+
+    Returns:
+        Optional[int]: The command's exit code, or None if there is no worker (so it should be run here instead)
+    """
+    socket_path = default_socket() if socket_path is None else socket_path
+    connection = _connect(socket_path)
+    if connection is None:
+        logger.debug(f"No worker at {socket_path.as_posix()}")
+        return None
+
+    logger.debug(f"Handing {command} to the worker at {socket_path.as_posix()}")
+    with connection, connection.makefile("rw", encoding="utf-8") as file:
+        _send(file, command=command, argv=argv, cwd=os.getcwd())
+        for line in file:
+            message = json.loads(line)
+            if "log" in message:
+                print(message["log"], file=sys.stderr)
+            elif "stdout" in message:
+                sys.stdout.write(message["stdout"])
+            elif "exit" in message:
+                return message["exit"]
+    logger.error("The worker hung up before finishing")
+    return 1
+
+
+class _Relay(logging.Handler):
+    """Send log records to the client, formatted as `logging.basicConfig` would"""
+
+    def __init__(self, file: TextIO, level: int):
+        super().__init__(level=level)
+        self.file = file
+        self.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            _send(self.file, log=self.format(record))
+        except OSError:
+            # The client has gone away. Carry on, so that what it asked for still gets written
+            pass
+
+
+def handle(file: TextIO) -> bool:
+    """Run one request from a client, in the client's working directory
+
+    Returns:
+        bool: Whether to keep serving
+    """
+    from . import cli
+
+    request = json.loads(file.readline())
+    if request["command"] == "stop":
+        _send(file, exit=0)
+        return False
+
+    build_parser, run = cli.COMMANDS[request["command"]]
+    logger.info(f"Running {request['command']} {' '.join(request['argv'])}")
+
+    root = logging.getLogger()
+    level = root.level
+    cwd = os.getcwd()
+    relay = None
+    exit_code = 0
+    # Anything the command prints (including from subprocesses, so this needs to be a real file) goes back to the client
+    with tempfile.TemporaryFile("w+") as stdout:
+        try:
+            os.chdir(request["cwd"])
+            with contextlib.redirect_stdout(stdout):
+                # Parsed again here, as some defaults depend on the working directory
+                args = build_parser().parse_args(request["argv"])
+                relay = _Relay(file, level=args.log_level)
+                root.addHandler(relay)
+                root.setLevel(min(level, args.log_level))
+                run(args)
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logger.exception(f"{request['command']} failed")
+            exit_code = 1
+        finally:
+            if relay is not None:
+                root.removeHandler(relay)
+            root.setLevel(level)
+            os.chdir(cwd)
+
+        stdout.seek(0)
+        try:
+            _send(file, stdout=stdout.read())
+            _send(file, exit=exit_code)
+        except OSError:
+            logger.warning("The client went away before its command finished")
+    return True
+
+
+def serve(socket_path: Path, idle_timeout: Optional[float] = None):
+    """Run commands for clients, one at a time, until asked to stop (or `idle_timeout` seconds pass without any)"""
+    # The point of the worker: these are imported once, rather than for every command
+    from . import cli, csv_analyser, tiff_stacker
+
+    if socket_path.exists():
+        connection = _connect(socket_path)
+        if connection is not None:
+            connection.close()
+            raise RuntimeError(
+                f"A worker is already running at {socket_path.as_posix()}"
+            )
+        logger.debug(f"Removing stale socket {socket_path.as_posix()}")
+        socket_path.unlink()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path.as_posix())
+        try:
+            os.chmod(socket_path, 0o600)
+            server.listen()
+            server.settimeout(idle_timeout)
+            logger.info(f"Listening on {socket_path.as_posix()}")
+            serving = True
+            while serving:
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    logger.info(f"No commands for {idle_timeout}s, exiting")
+                    break
+                # Commands can take as long as they like
+                connection.settimeout(None)
+                with connection, connection.makefile("rw", encoding="utf-8") as file:
+                    serving = handle(file)
+        finally:
+            socket_path.unlink()
+    logger.info("Stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+    Keep numpy and pandas imported (and the OS' cache of recently read files warm) in a long-running process,
+    which `csv-analyser` and `tiff-stacker` hand their work to while it is running, so that each call starts instantly.
+    Without a worker (or with `--no-worker`) they run by themselves as usual.
+    """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        default=default_socket(),
+        help=f"Where to listen. Defaults to ${SOCKET_VARIABLE}, else %(default)s",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="Exit after this many seconds without a command. Defaults to running until stopped",
+    )
+    parser.add_argument(
+        "--stop",
+        default=False,
+        action="store_true",
+        help="Stop the worker that is running",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        type=lambda x: getattr(logging, x.upper()),
+        default=logging.INFO,
+        help="How verbose to be",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    logger.debug(f"Arguments: {args}")
+
+    assert hasattr(socket, "AF_UNIX"), "The worker needs Unix sockets"
+
+    if args.stop:
+        if submit("stop", [], socket_path=args.socket) is None:
+            logger.warning(f"No worker is running at {args.socket.as_posix()}")
+        return
+
+    try:
+        serve(args.socket, idle_timeout=args.idle_timeout)
+    except KeyboardInterrupt:
+        logger.info("Interrupted")
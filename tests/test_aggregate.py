@@ -0,0 +1,145 @@
+import logging
+
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+import phd_utils.aggregate as subject
+import phd_utils.results as results
+import pytest
+
+logger = logging.getLogger(__name__)
+
+METRICS = ["Normal_Force", "Friction_Coefficient"]
+
+
+@pytest.fixture
+def experiments(tmp_path: Path) -> List[pd.DataFrame]:
+    rng = np.random.default_rng(0)
+    experiments = []
+    # Of different lengths, in different formats
+    for id, rows, output_format in [
+        ("2", 100, "csv"),
+        ("10", 80, "npz"),
+        ("1", 120, "parquet"),
+    ]:
+        df = pd.DataFrame(
+            {
+                "Pipette_Y_Position": rng.normal(size=rows),
+                "Normal_Force": rng.normal(size=rows),
+                "Friction_Coefficient": rng.normal(size=rows),
+            },
+            index=pd.timedelta_range(0, periods=rows, freq="9ms", name="Instant"),
+        )
+        df.iloc[5, 2] = np.nan
+        results.write_result(
+            df,
+            results.result_path(tmp_path, id, output_format),
+            output_format,
+        )
+        experiments.append(df)
+    return experiments
+
+
+def test_find_results(experiments: List[pd.DataFrame], tmp_path: Path):
+    (tmp_path / "processed_3.txt").touch()
+    assert [path.name for path in subject.find_results(tmp_path)] == [
+        "processed_1.parquet",
+        "processed_2.csv",
+        "processed_10.npz",
+    ]
+
+
+# Every experiment is missing the same Friction_Coefficient, which numpy warns about
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_matches_pandas(experiments: List[pd.DataFrame], tmp_path: Path):
+    output = tmp_path / "aggregate"
+    summary = subject.aggregate(
+        paths=subject.find_results(tmp_path),
+        directory=output,
+        metrics=METRICS,
+        quantiles=[0.1, 0.5],
+        rows_per_chunk=7,  # Doesn't divide evenly
+    )
+
+    values, ids, instants, metrics = subject.load_aggregate(output)
+    assert values.shape == (3, 120, 2)
+    assert ids["Experiment"].tolist() == ["1", "2", "10"]
+    assert metrics == METRICS
+    pd.testing.assert_index_equal(instants, summary.index, exact=False)
+    # Shorter experiments are padded
+    assert np.isnan(values[2, 80:]).all()
+
+    for metric in METRICS:
+        # In the order they were aggregated
+        combined = pd.concat(
+            [experiments[i][metric] for i in [2, 0, 1]], axis=1
+        ).to_numpy()
+        np.testing.assert_allclose(values[:, :, METRICS.index(metric)], combined.T)
+        np.testing.assert_allclose(
+            summary[f"{metric}_mean"], np.nanmean(combined, axis=1)
+        )
+        np.testing.assert_allclose(
+            summary[f"{metric}_std"], pd.DataFrame(combined).std(axis=1)
+        )
+        np.testing.assert_array_equal(
+            summary[f"{metric}_count"], np.count_nonzero(~np.isnan(combined), axis=1)
+        )
+        np.testing.assert_allclose(
+            summary[f"{metric}_q50"], np.nanmedian(combined, axis=1)
+        )
+        np.testing.assert_allclose(
+            summary[f"{metric}_q10"], np.nanquantile(combined, 0.1, axis=1)
+        )
+
+    pd.testing.assert_frame_equal(
+        results.read_result(output / "summary.csv"),
+        summary,
+        check_freq=False,
+        check_dtype=False,
+    )
+
+
+def test_fixed_grid(experiments: List[pd.DataFrame], tmp_path: Path):
+    summary = subject.aggregate(
+        paths=subject.find_results(tmp_path),
+        directory=tmp_path / "aggregate",
+        interval=pd.Timedelta(9, "ms"),
+        duration=pd.Timedelta(0.9, "seconds"),
+        metrics=METRICS,
+    )
+    # The longest experiment is cut short
+    assert len(summary) == 101
+    assert summary["Normal_Force_count"].tolist() == [3] * 80 + [2] * 20 + [1]
+
+
+def test_other_grid(experiments: List[pd.DataFrame], tmp_path: Path):
+    with pytest.raises(AssertionError, match="isn't resampled to"):
+        subject.aggregate(
+            paths=subject.find_results(tmp_path),
+            directory=tmp_path / "aggregate",
+            interval=pd.Timedelta(2, "ms"),
+            metrics=METRICS,
+        )
+
+
+def test_interval_from_a_longer_result(tmp_path: Path):
+    for id, rows in [("1", 1), ("2", 5)]:
+        df = pd.DataFrame(
+            {"Normal_Force": np.arange(rows, dtype=float)},
+            index=pd.timedelta_range(0, periods=rows, freq="9ms", name="Instant"),
+        )
+        results.write_result(df, results.result_path(tmp_path, id, "csv"), "csv")
+    paths = subject.find_results(tmp_path)
+
+    summary = subject.aggregate(
+        paths=paths, directory=tmp_path / "aggregate", metrics=["Normal_Force"]
+    )
+    assert summary.index[1] == pd.Timedelta(9, "ms")
+    assert summary["Normal_Force_count"].tolist() == [2, 1, 1, 1, 1]
+
+    with pytest.raises(AssertionError, match="--resample-to"):
+        subject.aggregate(
+            paths=paths[:1], directory=tmp_path / "short", metrics=["Normal_Force"]
+        )
@@ -0,0 +1,92 @@
+import logging
+import os
+import shutil
+
+from pathlib import Path
+from typing import List
+
+import phd_utils.batch as subject
+import pytest
+
+logger = logging.getLogger(__name__)
+
+COMMON = (
+    "-e 90 -r 0.009 -x 1 -t 0 -L 100 -k 0.5 -j 0.6 -a 0 -b 0 -s 1 -fr 1 --no-cache"
+).split()
+
+
+@pytest.fixture
+def experiments_folder(assets: Path, tmp_path: Path):
+    for name in ["substrate", "reference", "pipette"]:
+        shutil.copy(assets / f"{name}.csv", tmp_path / f"{name}_1.csv")
+    # Experiment 2 is missing its pipette
+    for name in ["substrate", "reference"]:
+        shutil.copy(assets / f"{name}.csv", tmp_path / f"{name}_2.csv")
+    return tmp_path
+
+
+def test_read_manifest(tmp_path: Path):
+    csv_manifest = tmp_path / "manifest.csv"
+    csv_manifest.write_text(
+        "filename-contains,substrate-stiffness,overwrite\n1,0.5,\n2,,true\n"
+    )
+    toml_manifest = tmp_path / "manifest.toml"
+    toml_manifest.write_text("""
+[defaults]
+overwrite = true
+
+[[experiment]]
+filename-contains = "1"
+substrate-stiffness = 0.5
+
+[[experiment]]
+filename-contains = "2"
+overwrite = false
+""")
+
+    assert list(map(subject.to_argv, subject.read_manifest(csv_manifest))) == [
+        ["--filename-contains", "1", "--substrate-stiffness", "0.5"],
+        ["--filename-contains", "2", "--overwrite"],
+    ]
+    assert list(map(subject.to_argv, subject.read_manifest(toml_manifest))) == [
+        ["--overwrite", "--filename-contains", "1", "--substrate-stiffness", "0.5"],
+        ["--filename-contains", "2"],
+    ]
+
+    toml_manifest.write_text("[defaults]\noverwrite = true\n")
+    with pytest.raises(AssertionError, match=r"no \[\[experiment\]\] tables"):
+        subject.read_manifest(toml_manifest)
+
+
+def test_bad_experiment_does_not_stop_the_others(experiments_folder: Path):
+    ids = subject.discover_ids(experiments_folder, "*")
+    assert ids == ["1", "2"]
+
+    jobs = [
+        [*COMMON, "-f", experiments_folder.as_posix(), "-c", id] for id in ids + ["3"]
+    ]
+    jobs.append(["-c", "4"])  # Not enough arguments
+
+    results = subject.run_batch(jobs, max_workers=2)
+
+    assert [result.filename for result in results] == ["1", "2", "3", "?"]
+    assert [result.succeeded for result in results] == [True, False, False, False]
+    assert (experiments_folder / "processed_1.csv").is_file()
+    assert "required" in results[3].error
+
+
+def die_on_2(argv: List[str]) -> subject.ExperimentResult:
+    if argv[-1] == "2":
+        os._exit(1)  # As the OOM killer would
+    return subject.ExperimentResult(filename=argv[-1], succeeded=True, seconds=0)
+
+
+def test_dead_worker_only_fails_its_experiment(monkeypatch):
+    # Workers are forked, so see this too
+    monkeypatch.setattr(subject, "run_experiment", die_on_2)
+
+    results = subject.run_batch([["-c", id] for id in "1234"], max_workers=2)
+
+    assert [result.filename for result in results] == ["1", "2", "3", "4"]
+    assert [result.succeeded for result in results] == [True, False, True, True]
+    assert "BrokenProcessPool" in results[1].error
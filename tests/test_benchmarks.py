@@ -0,0 +1,46 @@
+import logging
+import struct
+
+from pathlib import Path
+
+import benchmarks.generate as subject
+import phd_utils.csv_analyser as csv_analyser
+
+logger = logging.getLogger(__name__)
+
+
+def test_tracker_csvs(tmp_path: Path):
+    paths = subject.tracker_csvs(tmp_path, rows=1000, frame_rate_mismatch=0.1)
+
+    lengths = {
+        name: len(csv_analyser.read_displacement_csv(path))
+        for name, path in paths.items()
+    }
+    assert lengths == {"reference": 1000, "substrate": 900, "pipette": 900}
+    assert paths["substrate"].name == "substrate_benchmark.csv"
+
+    # Deterministic
+    again = subject.tracker_csvs(tmp_path / "again", rows=1000, frame_rate_mismatch=0.1)
+    assert again["pipette"].read_bytes() == paths["pipette"].read_bytes()
+
+
+def test_tiff_folder(tmp_path: Path):
+    paths = subject.tiff_folder(tmp_path, frames=3, size=16)
+
+    assert [path.name for path in paths] == [
+        "image00000.tif",
+        "image00001.tif",
+        "image00002.tif",
+    ]
+    tiff = paths[0].read_bytes()
+    assert tiff[:4] == b"II*\0"
+    (ifd,) = struct.unpack_from("<I", tiff, 4)
+    (entries,) = struct.unpack_from("<H", tiff, ifd)
+    tags = {
+        tag: value
+        for tag, _, _, value in (
+            struct.unpack_from("<HHIH", tiff, ifd + 2 + 12 * i) for i in range(entries)
+        )
+    }
+    assert tags[256] == tags[257] == 16
+    assert len(tiff) == ifd + 2 + 12 * entries + 4
@@ -0,0 +1,115 @@
+import logging
+import os
+
+from pathlib import Path
+
+import numpy as np
+import phd_utils.cache as subject
+
+logger = logging.getLogger(__name__)
+
+
+def write_bytes(n: int):
+    return lambda file: file.write(b"\0" * n)
+
+
+def test_fingerprint_changes_with_contents(tmp_path: Path):
+    source = tmp_path / "source.csv"
+    source.write_text("1,2,3")
+    before = subject.fingerprint(source)
+    assert subject.fingerprint(source) == before
+
+    source.write_text("1,2,3,4")
+    after = subject.fingerprint(source)
+    assert after != before
+    # Same file, so same prefix
+    assert after.split("-")[0] == before.split("-")[0]
+
+
+def test_store_and_lookup(tmp_path: Path):
+    assert subject.lookup(tmp_path, "a.bin") is None
+    entry = subject.store(tmp_path, "a.bin", write=write_bytes(10))
+    assert subject.lookup(tmp_path, "a.bin") == entry
+    assert entry.read_bytes() == b"\0" * 10
+
+
+def test_store_replaces_stale_entries(tmp_path: Path):
+    subject.store(tmp_path, "abc-1.bin", write=write_bytes(1))
+    subject.store(tmp_path, "abc-2.bin", write=write_bytes(1), replaces="abc-*.bin")
+    assert [entry.name for entry in tmp_path.iterdir()] == ["abc-2.bin"]
+
+
+def test_least_recently_used_is_evicted(tmp_path: Path):
+    for i, name in enumerate(["old.bin", "used.bin", "new.bin"]):
+        entry = subject.store(tmp_path, name, write=write_bytes(10))
+        os.utime(entry, ns=(i, i))
+
+    subject.lookup(tmp_path, "used.bin")  # Now the most recent
+    subject.store(tmp_path, "newest.bin", write=write_bytes(10), max_size=20)
+
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == [
+        "newest.bin",
+        "used.bin",
+    ]
+
+
+def test_derived_key(tmp_path: Path):
+    sources = [tmp_path / "a.csv", tmp_path / "b.csv"]
+    for source in sources:
+        source.write_text("1,2,3")
+    key = subject.derived_key("merged", sources, dict(resample_to=0.009))
+    assert key.startswith("merged-")
+    assert subject.derived_key("merged", sources, dict(resample_to=0.009)) == key
+    assert subject.derived_key("merged", sources, dict(resample_to=0.01)) != key
+
+    sources[1].write_text("1,2,3,4")
+    changed = subject.derived_key("merged", sources, dict(resample_to=0.009))
+    assert changed != key
+    # Same sources and parameters, so same prefix
+    assert changed.rsplit("-", 1)[0] == key.rsplit("-", 1)[0]
+
+
+def test_entries_and_clear(tmp_path: Path):
+    subject.store(tmp_path, "a.npy", write=write_bytes(10))
+    subject.store(
+        tmp_path,
+        "merged-a.npz",
+        write=lambda file: np.savez(file, description=np.array("a.csv")),
+    )
+
+    entries = {entry.path.name: entry for entry in subject.entries(tmp_path)}
+    assert set(entries) == {"a.npy", "merged-a.npz"}
+    assert entries["a.npy"].size == 10
+    assert entries["a.npy"].description is None
+    assert entries["merged-a.npz"].description == "a.csv"
+
+    assert subject.clear(tmp_path, pattern="merged-*") == entries["merged-a.npz"].size
+    assert [entry.path.name for entry in subject.entries(tmp_path)] == ["a.npy"]
+    assert subject.clear(tmp_path) == 10
+    assert subject.entries(tmp_path) == []
+
+
+def test_vanished_entries(tmp_path: Path, monkeypatch):
+    # Another process shares the cache, and evicts gone.bin just after we find it
+    gone = tmp_path / "gone.bin"
+    iterdir = Path.iterdir
+    monkeypatch.setattr(Path, "iterdir", lambda self: [*iterdir(self), gone])
+    monkeypatch.setattr(Path, "glob", lambda self, pattern: [gone])
+    monkeypatch.setattr(Path, "is_file", lambda self: True)
+
+    entry = subject.store(tmp_path, "a.bin", write=write_bytes(10), replaces="*.bin")
+    subject.evict(tmp_path, max_size=0)
+    assert not entry.exists()
+    assert subject.lookup(tmp_path, "gone.bin") is None
+    assert subject.entries(tmp_path) == []
+
+
+def test_clear_vanished_entries(tmp_path: Path, monkeypatch):
+    subject.store(tmp_path, "a.bin", write=write_bytes(10))
+    subject.store(tmp_path, "b.bin", write=write_bytes(20))
+    found = subject.entries(tmp_path)
+    # Another process evicts b.bin after we list it
+    (tmp_path / "b.bin").unlink()
+    monkeypatch.setattr(subject, "entries", lambda cache_dir: found)
+
+    assert subject.clear(tmp_path) == 10
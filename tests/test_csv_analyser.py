@@ -1,8 +1,13 @@
+import phd_utils.cli as cli
 import phd_utils.csv_analyser as subject
+import phd_utils.results as results
 import pytest
 from pathlib import Path
 import pandas as pd
+import numpy as np
 import logging
+import shutil
+import string
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +33,263 @@ def test_read_csv(reference_csv: Path):
     logger.debug(df.columns)
 
 
+@pytest.mark.parametrize("engine", ["c", "pyarrow"])
+def test_read_csv_matches_full_parse(reference_csv: Path, engine: str):
+    if engine == "pyarrow":
+        pytest.importorskip("pyarrow")
+
+    # What we used to do: parse every column, then throw most of them away
+    expected = pd.read_csv(
+        reference_csv, index_col=False, names=[s for s in string.ascii_uppercase]
+    )
+    expected = expected.dropna(axis="index", how="all")
+    expected = expected.dropna(axis="columns", how="all")
+    expected = expected.rename(
+        columns={"H": "Frame", "E": "X_Position", "F": "Y_Position"}
+    )
+    expected["Frame"] = expected["Frame"].astype(int)
+    expected = expected.drop(columns=[col for col in expected.columns if len(col) == 1])
+
+    df = subject.read_displacement_csv(reference_csv, engine=engine)
+
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_read_csv_from_cache(reference_csv: Path, tmp_path: Path):
+    source = tmp_path / "reference.csv"
+    shutil.copy(reference_csv, source)
+    cache_dir = tmp_path / "cache"
+
+    parsed = subject.read_displacement_csv(source, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    cached = subject.read_displacement_csv(source, cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(cached, parsed)
+
+    # Changing the source invalidates (and replaces) the entry
+    with source.open("a") as file:
+        file.write("\nID1,1,0,0.7,1.0,2.0,0,99999,99999\n")
+    changed = subject.read_displacement_csv(source, cache_dir=cache_dir)
+    assert len(changed) == len(parsed) + 1
+    assert len(list(cache_dir.iterdir())) == 1
+
+
+def test_cache_entry_evicted_after_lookup(
+    substrate_csv: Path,
+    reference_csv: Path,
+    pipette_csv: Path,
+    tmp_path: Path,
+    monkeypatch,
+):
+    sources = {}
+    for name, path in [
+        ("substrate", substrate_csv),
+        ("reference", reference_csv),
+        ("pipette", pipette_csv),
+    ]:
+        sources[f"{name}_path"] = tmp_path / path.name
+        shutil.copy(path, sources[f"{name}_path"])
+    cache_dir = tmp_path / "cache"
+    merged = subject.read_and_merge(
+        **sources, experiment_duration=90, resample_to=0.009, cache_dir=cache_dir
+    )
+
+    # Another process evicts each entry just after it is found
+    lookup = subject.cache.lookup
+
+    def evicted(cache_dir: Path, key: str):
+        entry = lookup(cache_dir, key)
+        if entry is not None:
+            entry.unlink()
+        return entry
+
+    monkeypatch.setattr(subject.cache, "lookup", evicted)
+    again = subject.read_and_merge(
+        **sources, experiment_duration=90, resample_to=0.009, cache_dir=cache_dir
+    )
+    pd.testing.assert_frame_equal(again, merged)
+
+
+def test_read_and_merge_from_cache(
+    substrate_csv: Path,
+    reference_csv: Path,
+    pipette_csv: Path,
+    tmp_path: Path,
+    monkeypatch,
+):
+    sources = {}
+    for name, path in [
+        ("substrate", substrate_csv),
+        ("reference", reference_csv),
+        ("pipette", pipette_csv),
+    ]:
+        sources[f"{name}_path"] = tmp_path / path.name
+        shutil.copy(path, sources[f"{name}_path"])
+    cache_dir = tmp_path / "cache"
+
+    merged = subject.read_and_merge(
+        **sources, experiment_duration=90, resample_to=0.009, cache_dir=cache_dir
+    )
+    assert len(list(cache_dir.glob("merged-*.npz"))) == 1
+
+    # Only the cached merged frame should be needed now
+    def fail(*args, **kwargs):
+        raise AssertionError("Read a CSV")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(subject, "read_displacement_csv", fail)
+        cached = subject.read_and_merge(
+            **sources, experiment_duration=90, resample_to=0.009, cache_dir=cache_dir
+        )
+    pd.testing.assert_frame_equal(cached, merged, check_freq=False)
+    pd.testing.assert_frame_equal(
+        subject.generate_normal_force_and_correct_for_load_positioning(
+            df=cached, **FORCE_MODEL
+        ),
+        subject.generate_normal_force_and_correct_for_load_positioning(
+            df=merged, **FORCE_MODEL
+        ),
+        check_freq=False,
+    )
+
+    # Different resampling is a different entry
+    subject.read_and_merge(
+        **sources, experiment_duration=90, resample_to=0.01, cache_dir=cache_dir
+    )
+    assert len(list(cache_dir.glob("merged-*.npz"))) == 2
+
+    # Changing a source replaces the entry
+    with sources["pipette_path"].open("a") as file:
+        file.write("\nID1,1,0,0.7,1.0,2.0,0,99999,99999\n")
+    subject.read_and_merge(
+        **sources, experiment_duration=90, resample_to=0.009, cache_dir=cache_dir
+    )
+    assert len(list(cache_dir.glob("merged-*.npz"))) == 2
+
+
+@pytest.fixture
+def processed_csv(assets: Path):
+    df = pd.read_csv(assets / "processed.csv", index_col=0)
+    df.index = pd.to_timedelta(df.index).rename("Instant")
+    return df
+
+
+@pytest.mark.parametrize("engine", ["pandas", "numpy"])
+def test_merge_and_displace_frames(
+    substrate_csv: Path,
+    reference_csv: Path,
+    pipette_csv: Path,
+    processed_csv: pd.DataFrame,
+    engine: str,
+):
+    df = subject.merge_and_displace_frames(
+        substrate=subject.read_displacement_csv(substrate_csv),
+        reference=subject.read_displacement_csv(reference_csv),
+        pipette=subject.read_displacement_csv(pipette_csv),
+        experiment_duration=pd.Timedelta(90, "seconds"),
+        duration_of_resampled_row=pd.Timedelta(0.009, "seconds"),
+        engine=engine,
+    )
+
+    pd.testing.assert_frame_equal(
+        df, processed_csv[df.columns], check_freq=False, check_exact=False
+    )
+
+
+FORCE_MODEL = dict(
+    initial_x_displacement=1.5,
+    initial_substrate_tip_position=1300.0,
+    length_of_substrate=2000.0,
+    stiffness_constant_of_substrate=0.5,
+    stiffness_constant_of_pipette=0.6,
+    reverse_sliding_direction=False,
+    angle_alpha=0.1,
+    angle_beta=0.2,
+    substrate_tip_velocity=2.0,
+    flexural_rigidity=3e-12,
+)
+
+
+def test_force_model(processed_csv: pd.DataFrame):
+    merged = processed_csv.drop(columns=list(subject.FORCE_COLUMNS), errors="ignore")
+    merged.index.freq = "9ms"
+
+    df = subject.generate_normal_force_and_correct_for_load_positioning(
+        df=merged, **FORCE_MODEL
+    )
+
+    # Stationary for 5s, then a ramp that moves once per row
+    tip = df["Substrate_Tip_Position"]
+    assert (tip[: pd.Timedelta(4.995, "seconds")] == 1300).all()
+    assert tip[pd.Timedelta(9, "seconds")] == pytest.approx(1300 + 2 * 4, abs=2 * 0.009)
+
+    length_from_the_tip = 2000 - (df["Pipette_Y_Position"] - tip)
+    pd.testing.assert_series_equal(
+        df["Corrected_Deflection"],
+        (merged["X_Delta"] / np.cos(0.2) + 1.5)
+        * 0.5
+        * length_from_the_tip
+        * length_from_the_tip
+        * (3 * 2000 - length_from_the_tip)
+        / (6 * 3e-12 * 10 ** 16),
+        check_names=False,
+    )
+    pd.testing.assert_series_equal(
+        df["Friction_Coefficient"],
+        (merged["Pipette_Y_Position"].iloc[0] - merged["Pipette_Y_Position"])
+        / np.cos(0.1)
+        / np.cos(0.2)
+        * 0.6
+        / (df["Corrected_Deflection"] * 0.5),
+        check_names=False,
+    )
+    pd.testing.assert_frame_equal(df[merged.columns], merged)
+
+    single = subject.generate_normal_force_and_correct_for_load_positioning(
+        df=merged, **FORCE_MODEL, dtype=np.float32
+    )
+    assert (single.dtypes == np.float32).all()
+    pd.testing.assert_frame_equal(
+        single, df, check_dtype=False, check_exact=False, rtol=1e-3, atol=1e-3
+    )
+
+    # A single row, which doesn't know its frequency
+    one = subject.generate_normal_force_and_correct_for_load_positioning(
+        df=merged.iloc[[0]].set_axis(pd.TimedeltaIndex([0], name="Instant")),
+        **FORCE_MODEL,
+    )
+    pd.testing.assert_frame_equal(one, df.iloc[:1], check_freq=False)
+
+
+def test_numpy_engine_leaves_empty_buckets_empty():
+    substrate = pd.DataFrame({"Frame": [0, 1, 9, 10], "X_Position": [1, 2, 3, 4]})
+    reference = pd.DataFrame({"Frame": [0, 5, 10], "X_Position": [1, 2, 3]})
+
+    df = subject._resample_with_numpy(
+        streams={"Reference": reference, "Substrate": substrate},
+        experiment_duration=pd.Timedelta(10, "seconds"),
+        duration_of_resampled_row=pd.Timedelta(2, "seconds"),
+    )
+
+    expected = (
+        pd.concat(
+            [
+                df.assign(Instant=pd.to_timedelta(df["Frame"], unit="seconds"))
+                .set_index("Instant")
+                .drop(columns="Frame")
+                .add_prefix(f"{name}_")
+                for name, df in [("Reference", reference), ("Substrate", substrate)]
+            ],
+            axis="columns",
+        )
+        .resample("2s")
+        .mean()
+    )
+
+    pd.testing.assert_frame_equal(df, expected, check_freq=False)
+    assert df["Substrate_X_Position"].isna().sum() == 3
+
+
 def test_calculate_displacment():
     reference = pd.DataFrame.from_dict(
         {
@@ -62,3 +324,85 @@ def test_calculate_displacment():
     logger.debug(df)
 
     assert df.equals(expected_df)
+
+
+@pytest.mark.parametrize("window", [1, 2, 7, 100])
+def test_rolling_statistics(window: int):
+    values = np.random.default_rng(0).normal(1e6, 1, 100)
+    values[[10, 50]] = [np.nan, np.inf]
+
+    statistics = subject.rolling_statistics(values, window)
+
+    # Each window in full, rather than pandas', whose standard deviation is less precise this far from 0.
+    # Windows with infinite values are left out, as pandas does
+    windows = np.lib.stride_tricks.sliding_window_view(
+        np.where(np.isinf(values), np.nan, values), window
+    )
+    padding = [np.nan] * (window - 1)
+    for name, expected in [
+        ("Mean", windows.mean(axis=1)),
+        ("Std", windows.std(axis=1, ddof=1) if window > 1 else windows[:, 0] * np.nan),
+        ("Min", windows.min(axis=1)),
+        ("Max", windows.max(axis=1)),
+    ]:
+        np.testing.assert_allclose(statistics[name], [*padding, *expected], rtol=1e-9)
+
+
+def test_detect_slips():
+    # Sticks for 1s rising at 1/s, then slips back down to 0 in 0.1s, three times, with a little noise
+    instants = pd.timedelta_range(0, periods=3300, freq="1ms", name="Instant")
+    seconds = instants.total_seconds().to_numpy()
+    cycle = seconds % 1.1
+    force = np.where(cycle < 1, cycle, 1 - (cycle - 1) * 10)
+    force += np.random.default_rng(0).normal(0, 1e-5, len(force))
+    series = pd.Series(force, index=instants, name="Friction_Force")
+
+    slips = subject.detect_slips(series, start_rate=5, end_rate=1)
+
+    assert len(slips) == 3
+    np.testing.assert_allclose(
+        slips["Start"].dt.total_seconds(), [1, 2.1, 3.2], atol=0.002
+    )
+    np.testing.assert_allclose(
+        slips["Duration"].dt.total_seconds(), [0.1] * 3, atol=0.003
+    )
+    np.testing.assert_allclose(slips["Drop"], [1] * 3, atol=0.01)
+    np.testing.assert_allclose(slips["Peak_Rate"], [10] * 3, rtol=0.05)
+
+    assert len(subject.detect_slips(series, start_rate=5, end_rate=1, min_drop=2)) == 0
+    assert len(subject.detect_slips(series, start_rate=20, end_rate=1)) == 0
+
+
+def test_analyse_csv_with_rolling_statistics_and_slips(assets: Path, tmp_path: Path):
+    for name in ["substrate", "reference", "pipette"]:
+        shutil.copy(assets / f"{name}.csv", tmp_path / f"{name}_1.csv")
+    argv = "-c 1 -e 90 -r 0.009 -x 1 -t 0 -L 100 -k 0.5 -j 0.6 -a 0 -b 0 -s 1 -fr 1"
+    argv = [*argv.split(), "-f", str(tmp_path), "--no-cache"]
+    argv += ["--rolling-window", "0.09", "--slip-rate", "0.1", "0.01"]
+    args = cli.csv_analyser_parser().parse_args(argv)
+    subject.analyse_csv(**cli.analyse_csv_arguments(args))
+
+    df = results.read_result(tmp_path / "processed_1.csv")
+    rolling = df["Friction_Force"].rolling(10)
+    np.testing.assert_allclose(
+        df["Friction_Force_Rolling_Max"], rolling.max(), equal_nan=True
+    )
+    np.testing.assert_allclose(
+        df["Friction_Coefficient_Rolling_Mean"],
+        df["Friction_Coefficient"].rolling(10).mean(),
+        rtol=1e-6,
+    )
+    slips = results.read_slips(tmp_path / "slips_1.csv")
+    pd.testing.assert_frame_equal(
+        slips,
+        subject.detect_slips(df["Friction_Force"], 0.1, 0.01),
+        check_exact=False,
+    )
+
+    # The slips are kept, even without the result they came from
+    (tmp_path / "processed_1.csv").unlink()
+    with pytest.raises(AssertionError, match="--overwrite"):
+        subject.analyse_csv(**cli.analyse_csv_arguments(args))
+    assert not (tmp_path / "processed_1.csv").exists()
+    args = cli.csv_analyser_parser().parse_args([*argv, "--overwrite"])
+    subject.analyse_csv(**cli.analyse_csv_arguments(args))
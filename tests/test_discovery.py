@@ -0,0 +1,64 @@
+import logging
+
+from pathlib import Path
+
+import phd_utils.discovery as subject
+import pytest
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def folder(tmp_path: Path) -> Path:
+    for name in [
+        "image1000.tif",
+        "image999.tif",
+        "image2.tif",
+        "notes.txt",
+        "stack0.tif",
+        "a/image10.tif",
+        "a/image9.tif",
+        "a/b/image1.tif",
+        "a.tif",
+        "z/image0.tif",
+    ]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+    return tmp_path
+
+
+def test_natural_order(folder: Path):
+    assert [
+        path.relative_to(folder).as_posix() for path in subject.scan_tifs(folder)
+    ] == [
+        "a/b/image1.tif",
+        "a/image9.tif",
+        "a/image10.tif",
+        "a.tif",
+        "image2.tif",
+        "image999.tif",
+        "image1000.tif",
+        "z/image0.tif",
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_name_order_matches_glob(folder: Path, jobs: int):
+    expected = sorted(
+        path for path in folder.glob("**/*.tif") if path.name != "stack0.tif"
+    )
+    assert list(subject.scan_tifs(folder, order="name", jobs=jobs)) == expected
+
+
+def test_natural_key():
+    names = ["b2", "a10", "a01", "a1", "a9", "10", "9"]
+    assert sorted(names, key=subject.natural_key) == [
+        "9",
+        "10",
+        "a01",
+        "a1",
+        "a9",
+        "a10",
+        "b2",
+    ]
@@ -0,0 +1,62 @@
+import logging
+import shutil
+import sys
+
+from pathlib import Path
+from typing import List
+
+import phd_utils.frames as subject
+import phd_utils.tiff as tiff
+import phd_utils.tiff_stacker as tiff_stacker
+import pytest
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def single_images(assets: Path) -> List[Path]:
+    return sorted(assets.glob("single*.tif"))
+
+
+def test_reader(single_images: List[Path], tmp_path: Path):
+    folder = tmp_path / "experiment"
+    folder.mkdir()
+    for image in single_images:
+        shutil.copy(image, folder)
+    tiff_stacker.stack_in_folders(
+        [folder], files_per_stack=4, imagemagick_stderr=sys.stdout
+    )
+    assert sorted(path.name for path in folder.glob("*.index.json")) == [
+        "stack0.index.json",
+        "stack1.index.json",
+    ]
+
+    with subject.StackReader(folder) as reader:
+        assert len(reader) == len(single_images)
+        assert reader.number("single4.tif") == 4
+        assert reader.frames[4].stack == "stack1.tif"
+        assert reader.frames[4].page == 0
+        for number, image in enumerate(single_images):
+            original = image.read_bytes()
+            (page,) = tiff.read_pages(original)
+            assert reader.raw(number) == b"".join(
+                original[offset : offset + length] for offset, length in page.data
+            )
+            assert reader.pixels(number) == tiff.decode(original, page)
+            assert tiff.describe(reader.page(number)) == tiff.describe(page)
+
+
+def test_index_of_several_pages(assets: Path, tmp_path: Path):
+    # Stacking a stack, along with a single image
+    shutil.copy(assets / "stacked.tif", tmp_path / "a.tif")
+    shutil.copy(assets / "single0.tif", tmp_path / "b.tif")
+    tiff_stacker.stack_in_folders(
+        [tmp_path], files_per_stack=2, imagemagick_stderr=sys.stdout
+    )
+
+    frames = subject.read_index(tmp_path)
+    assert [(frame.source, frame.source_page) for frame in frames] == [
+        *(("a.tif", page) for page in range(6)),
+        ("b.tif", 0),
+    ]
+    assert [frame.page for frame in frames] == list(range(7))
@@ -0,0 +1,128 @@
+import logging
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import phd_utils.csv_analyser as csv_analyser
+import phd_utils.live as subject
+import phd_utils.resample as resample
+import phd_utils.results as results
+import pytest
+
+logger = logging.getLogger(__name__)
+
+NAMES = ["substrate", "reference", "pipette"]
+FRAME_RATE = 100.0
+RESAMPLE_TO = pd.Timedelta(0.009, "seconds")
+
+FORCE_MODEL = dict(
+    initial_x_displacement=1.5,
+    initial_substrate_tip_position=1300.0,
+    length_of_substrate=2000.0,
+    stiffness_constant_of_substrate=0.5,
+    stiffness_constant_of_pipette=0.6,
+    reverse_sliding_direction=False,
+    angle_alpha=0.1,
+    angle_beta=0.2,
+    substrate_tip_velocity=2.0,
+    flexural_rigidity=3e-12,
+)
+
+
+@pytest.fixture
+def expected(assets: Path) -> pd.DataFrame:
+    # Everything at once, as `merge_and_displace_frames` would with a known frame rate
+    streams = {}
+    for name in ["Reference", "Substrate", "Pipette"]:
+        df = csv_analyser.read_displacement_csv(assets / f"{name.lower()}.csv")
+        instants = csv_analyser.frame_instants(
+            df["Frame"].to_numpy(), FRAME_RATE, pd.Timedelta(1, "seconds")
+        )
+        streams[name] = df[["X_Position", "Y_Position"]].set_index(
+            pd.TimedeltaIndex(instants, name="Instant")
+        )
+    merged = resample.resample(streams, interval=RESAMPLE_TO)
+    merged["X_Delta"] = merged["Substrate_X_Position"] - merged["Reference_X_Position"]
+    merged["Y_Delta"] = merged["Substrate_Y_Position"] - merged["Reference_Y_Position"]
+    merged["X_Delta"] -= merged["X_Delta"].iloc[0]
+    merged["Y_Delta"] -= merged["Y_Delta"].iloc[0]
+    return merged
+
+
+def test_read_appended(tmp_path: Path):
+    csv = tmp_path / "growing.csv"
+    csv.write_bytes(
+        b"\xef\xbb\xbfID,0,0,0,1.0,2.0,0,0\r\nID,0,0,0,1.5,2.5,0,1\r\nID,0,0"
+    )
+
+    df, offset = subject.read_appended(csv, 0)
+    assert df["Frame"].tolist() == [0, 1]
+    assert df["X_Position"].tolist() == [1.0, 1.5]
+
+    # The rest of the half-written row
+    with csv.open("ab") as file:
+        file.write(b",0,3.0,4.0,0,2\r\n,,,,,,,\r\n")
+    df, offset = subject.read_appended(csv, offset)
+    assert df["Frame"].tolist() == [2]
+    assert offset == csv.stat().st_size
+
+    df, offset = subject.read_appended(csv, offset)
+    assert len(df) == 0 and offset == csv.stat().st_size
+
+
+def test_follow_while_growing(assets: Path, tmp_path: Path, expected: pd.DataFrame):
+    data = {name: (assets / f"{name}.csv").read_bytes() for name in NAMES}
+    paths = {name: tmp_path / f"{name}.csv" for name in NAMES}
+    for path in paths.values():
+        path.write_bytes(b"")
+
+    updates = subject.follow(
+        **paths, frame_rate=FRAME_RATE, duration_of_resampled_row=RESAMPLE_TO
+    )
+    committed = [next(updates).committed]
+
+    # Append in uneven pieces, cutting through rows
+    rng = np.random.default_rng(0)
+    cuts = {name: np.sort(rng.integers(0, len(data[name]), 30)) for name in NAMES}
+    for i in range(31):
+        for name in NAMES:
+            low = cuts[name][i - 1] if i > 0 else 0
+            high = cuts[name][i] if i < 30 else len(data[name])
+            with paths[name].open("ab") as file:
+                file.write(data[name][low:high])
+        update = next(updates)
+        committed.append(update.committed)
+        if len(update.provisional) > 0:
+            # Provisional rows pick up where committed ones finish
+            assert (
+                update.provisional.index[0]
+                == pd.concat(committed).index[-1] + RESAMPLE_TO
+            )
+
+    last = updates.send(True)
+    assert len(last.provisional) == 0
+    committed.append(last.committed)
+
+    pd.testing.assert_frame_equal(pd.concat(committed), expected, check_freq=False)
+
+
+def test_analyse_live(assets: Path, tmp_path: Path, expected: pd.DataFrame):
+    output_file = tmp_path / "processed.csv"
+    subject.analyse_live(
+        **{name: assets / f"{name}.csv" for name in NAMES},
+        output_file=output_file,
+        frame_rate=FRAME_RATE,
+        duration_of_resampled_row=RESAMPLE_TO,
+        poll_interval=0,
+        idle_timeout=0,
+        **FORCE_MODEL,
+    )
+
+    pd.testing.assert_frame_equal(
+        results.read_result(output_file),
+        csv_analyser.generate_normal_force_and_correct_for_load_positioning(
+            df=expected, **FORCE_MODEL
+        ),
+        check_freq=False,
+    )
@@ -0,0 +1,135 @@
+import logging
+import shutil
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import phd_utils.cli as cli
+import phd_utils.csv_analyser as csv_analyser
+import phd_utils.preview as subject
+import phd_utils.results as results
+import pytest
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def result() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    rows = 100_003  # Doesn't divide into buckets evenly
+    df = pd.DataFrame(
+        {column: rng.normal(size=rows) for column in subject.PREVIEW_COLUMNS},
+        index=pd.timedelta_range(0, periods=rows, freq="9ms", name="Instant"),
+    )
+    # A spike, which has to survive every level
+    df.iloc[50_000, 1] = 100
+    df.iloc[7, 2] = np.nan
+    return df
+
+
+def test_levels(result: pd.DataFrame, tmp_path: Path):
+    subject.write_preview(
+        result, tmp_path / "preview", pd.Timedelta(9, "ms"), min_buckets=100
+    )
+    preview = subject.Preview(tmp_path / "preview")
+
+    assert preview.rows_per_bucket == [1, 4, 16, 64, 256, 1024]
+    assert len(preview.levels[-1]) < 100 <= len(preview.levels[-2])
+    np.testing.assert_array_equal(
+        preview.levels[0], result[list(subject.PREVIEW_COLUMNS)]
+    )
+    for level, rows in enumerate(preview.rows_per_bucket[1:], start=1):
+        extremes = preview.levels[level]
+        grouped = result.groupby(np.arange(len(result)) // rows)
+        np.testing.assert_array_equal(extremes[:, 0], grouped.min())
+        np.testing.assert_array_equal(extremes[:, 1], grouped.max())
+        assert extremes[:, 1, 1].max() == 100
+    # Nothing left behind
+    assert [path.name for path in tmp_path.iterdir()] == ["preview"]
+
+
+def test_window(result: pd.DataFrame, tmp_path: Path):
+    subject.write_preview(result, tmp_path / "preview", pd.Timedelta(9, "ms"))
+    preview = subject.Preview(tmp_path / "preview")
+
+    # The whole experiment at 800 pixels: 100k rows in buckets of 64 gives 1563 buckets, but of 256 only 391
+    window = preview.window(800)
+    assert len(window) == 1563
+    assert window.index[1] == pd.Timedelta(9 * 64, "ms")
+    assert window["Friction_Force_Max"].max() == 100
+
+    # Zoomed in to a second (111 rows) there are fewer rows than pixels, so every row
+    start, end = pd.Timedelta(450, "seconds"), pd.Timedelta(451, "seconds")
+    window = preview.window(800, start, end)
+    expected = result[start:end]
+    np.testing.assert_array_equal(window.index, expected.index)
+    np.testing.assert_array_equal(window["Normal_Force_Min"], expected["Normal_Force"])
+    np.testing.assert_array_equal(window["Normal_Force_Max"], expected["Normal_Force"])
+    assert window["Friction_Force_Max"].max() == 100
+
+
+def test_series(result: pd.DataFrame, tmp_path: Path):
+    subject.write_preview(result, tmp_path / "preview", pd.Timedelta(9, "ms"))
+    preview = subject.Preview(tmp_path / "preview")
+
+    series = preview.series("Friction_Force", 500)
+    assert len(series) == 500
+    assert series.index.is_monotonic_increasing
+    # LTTB keeps the spike, and both ends
+    assert series.max() == 100
+    assert series.index[0] == result.index[0]
+
+    start, end = pd.Timedelta(0), pd.Timedelta(0.5, "seconds")
+    series = preview.series("Friction_Coefficient", 20, start, end)
+    # From the rows themselves, leaving out the NaN
+    assert len(series) == 20
+    assert series.notna().all()
+    assert series.index.isin(result.index).all()
+
+
+def test_lttb():
+    x = np.arange(10, dtype=float)
+    y = np.array([0, 0, 0, 5, 0, 0, 0, -5, 0, 0], dtype=float)
+    assert subject.lttb(x, y, 4).tolist() == [0, 3, 7, 9]
+    assert subject.lttb(x, y, 20).tolist() == list(range(10))
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_analyse_csv_writes_preview(assets: Path, tmp_path: Path, streamed: bool):
+    for name in ["substrate", "reference", "pipette"]:
+        shutil.copy(assets / f"{name}.csv", tmp_path / f"{name}_1.csv")
+    argv = "-c 1 -e 90 -r 0.009 -x 1 -t 0 -L 100 -k 0.5 -j 0.6 -a 0 -b 0 -s 1 -fr 1"
+    argv = [*argv.split(), "-f", str(tmp_path), "--no-cache", "--preview"]
+    if streamed:
+        argv += ["--chunk-size", "1000"]
+    args = cli.csv_analyser_parser().parse_args(argv)
+    csv_analyser.analyse_csv(**cli.analyse_csv_arguments(args))
+
+    written = results.read_result(tmp_path / "processed_1.csv")
+    preview = subject.Preview(tmp_path / "preview_1")
+    window = preview.window(width=len(written))
+    np.testing.assert_allclose(
+        window["Friction_Force_Max"], written["Friction_Force"], equal_nan=True
+    )
+    assert len(preview.levels) == 3
+
+
+def test_one_row(result: pd.DataFrame, tmp_path: Path):
+    subject.write_preview(result[:1], tmp_path / "preview", pd.Timedelta(9, "ms"))
+    preview = subject.Preview(tmp_path / "preview")
+    assert preview.interval == pd.Timedelta(9, "ms")
+    assert len(preview.window(800)) == 1
+
+
+def test_analyse_csv_keeps_preview(assets: Path, tmp_path: Path):
+    for name in ["substrate", "reference", "pipette"]:
+        shutil.copy(assets / f"{name}.csv", tmp_path / f"{name}_1.csv")
+    (tmp_path / "preview_1").mkdir()
+    argv = "-c 1 -e 90 -r 0.009 -x 1 -t 0 -L 100 -k 0.5 -j 0.6 -a 0 -b 0 -s 1 -fr 1"
+    argv = [*argv.split(), "-f", str(tmp_path), "--no-cache", "--preview"]
+    args = cli.csv_analyser_parser().parse_args(argv)
+    with pytest.raises(AssertionError, match="--overwrite"):
+        csv_analyser.analyse_csv(**cli.analyse_csv_arguments(args))
+    # Before doing anything
+    assert not (tmp_path / "processed_1.csv").exists()
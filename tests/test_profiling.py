@@ -0,0 +1,90 @@
+import json
+import logging
+
+from pathlib import Path
+
+import numpy as np
+import phd_utils.csv_analyser as csv_analyser
+import phd_utils.profiling as subject
+import pytest
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def profiling():
+    subject.enable()
+    yield
+    subject.disable()
+
+
+def test_disabled_records_nothing():
+    assert not subject.enabled()
+    with subject.stage("read") as counts:
+        counts["rows"] = 10
+    subject.enable()
+    assert subject.disable() == []
+
+
+def test_nested_stages(profiling):
+    with subject.stage("merge"):
+        with subject.stage("resample") as counts:
+            array = np.ones(1024**2)  # 8 MiB
+            counts["rows"] = len(array)
+            del array
+    records = subject.disable()
+
+    assert [record["name"] for record in records] == ["merge/resample", "merge"]
+    resample, merge = records
+    assert resample["rows"] == 1024**2
+    assert resample["traced_peak"] >= 8 * 1024**2
+    # The enclosing stage's peak includes what happened inside it
+    assert merge["traced_peak"] >= resample["traced_peak"]
+    assert merge["wall"] >= resample["wall"]
+
+
+def test_summarise(profiling):
+    for rows in [10, 20, 30]:
+        with subject.stage("read") as counts:
+            counts.update(rows=rows, bytes=rows * 100)
+    with subject.stage("write"):
+        pass
+
+    read, write = subject.summarise(subject.disable())
+    assert read["name"] == "read"
+    assert read["calls"] == 3
+    assert read["rows"] == 60
+    assert read["bytes"] == 6000
+    assert write["calls"] == 1
+
+
+def test_report(profiling, tmp_path: Path):
+    with subject.stage("glob") as counts:
+        counts["files"] = 3
+    records = subject.disable()
+
+    assert "glob" in subject.format_table(records)
+    path = tmp_path / "profile.json"
+    subject.report(records, path.as_posix())
+    report = json.loads(path.read_text())
+    assert report["stages"] == records
+    assert report["totals"][0]["files"] == 3
+
+
+def test_read_and_merge_stages(profiling, assets: Path):
+    merged = csv_analyser.read_and_merge(
+        substrate_path=assets / "substrate.csv",
+        reference_path=assets / "reference.csv",
+        pipette_path=assets / "pipette.csv",
+        experiment_duration=90,
+        resample_to=0.009,
+    )
+    totals = {total["name"]: total for total in subject.summarise(subject.disable())}
+
+    assert list(totals) == ["read", "merge/resample", "merge"]
+    assert totals["read"]["calls"] == 3
+    assert totals["read"]["bytes"] == sum(
+        (assets / f"{name}.csv").stat().st_size
+        for name in ["substrate", "reference", "pipette"]
+    )
+    assert totals["merge"]["rows"] == len(merged)
@@ -1,6 +1,7 @@
 import phd_utils.resample as subject
 
 import pytest
+import numpy as np
 import pandas as pd
 import logging
 
@@ -42,3 +43,79 @@ def test_resample():
     interval = pd.Timedelta(value=10, unit="milliseconds")
     df = df.resample(interval).mean()  # Could also be min, max, sum etc
     logger.debug(df)
+
+
+@pytest.fixture
+def streams():
+    # 500 and 600 frames per second, over 0.1s
+    fps500 = pd.DataFrame(
+        {"Position": np.sin(np.arange(50))},
+        index=pd.timedelta_range(start="0s", end="0.1s", periods=50, name="Instant"),
+    )
+    fps600 = pd.DataFrame(
+        {"Position": np.cos(np.arange(60)), "Area": np.arange(60.0)},
+        index=pd.timedelta_range(start="0s", end="0.1s", periods=60, name="Instant"),
+    )
+    return {"Reference": fps500, "Substrate": fps600}
+
+
+INTERVAL = pd.Timedelta(value=10, unit="milliseconds")
+
+
+def test_mean(streams):
+    expected = (
+        pd.concat(
+            [df.add_prefix(f"{name}_") for name, df in streams.items()],
+            axis="columns",
+        )
+        .resample(INTERVAL)
+        .mean()
+    )
+
+    df = subject.resample(streams, interval=INTERVAL, method="mean")
+
+    pd.testing.assert_frame_equal(df, expected, check_freq=False)
+
+
+@pytest.mark.parametrize("method", ["nearest", "linear"])
+def test_nearest_and_linear(streams, method: str):
+    grid = pd.timedelta_range(start="0s", end="0.1s", freq=INTERVAL, name="Instant")
+
+    def expect(df: pd.DataFrame):
+        if method == "nearest":
+            return df.reindex(grid, method="nearest")
+        return (
+            df.reindex(df.index.union(grid)).interpolate(method="index").reindex(grid)
+        )
+
+    expected = pd.concat(
+        [expect(df).add_prefix(f"{name}_") for name, df in streams.items()],
+        axis="columns",
+    )
+
+    df = subject.resample(streams, interval=INTERVAL, method=method)
+
+    pd.testing.assert_frame_equal(df, expected, check_freq=False)
+
+
+def test_unsorted_and_out_of_range(streams):
+    shuffled = {name: df.sample(frac=1, random_state=0) for name, df in streams.items()}
+    start = pd.Timedelta(-10, "milliseconds")
+    end = pd.Timedelta(200, "milliseconds")
+
+    for method in subject.METHODS:
+        expected = subject.resample(
+            streams, interval=INTERVAL, method=method, start=start, end=end
+        )
+        df = subject.resample(
+            shuffled, interval=INTERVAL, method=method, start=start, end=end
+        )
+        pd.testing.assert_frame_equal(df, expected)
+        assert len(df) == 22
+
+    linear = subject.resample(
+        streams, interval=INTERVAL, method="linear", start=start, end=end
+    )
+    # No extrapolation
+    assert linear.iloc[0].isna().all()
+    assert linear.iloc[-1].isna().all()
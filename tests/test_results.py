@@ -0,0 +1,81 @@
+import logging
+import shutil
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import phd_utils.cli as cli
+import phd_utils.csv_analyser as csv_analyser
+import phd_utils.results as subject
+import pytest
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def result():
+    return pd.DataFrame(
+        {
+            "Pipette_Y_Position": np.linspace(1300, 1400, 1000),
+            "Friction_Coefficient": np.linspace(-1, 1, 1000, dtype=np.float32),
+        },
+        index=pd.timedelta_range(0, periods=1000, freq="9ms", name="Instant"),
+    )
+
+
+@pytest.mark.parametrize("output_format", subject.FORMATS)
+def test_round_trip(result: pd.DataFrame, tmp_path: Path, output_format: str):
+    path = subject.result_path(tmp_path, "1", output_format)
+    subject.write_result(result, path, output_format)
+
+    assert path.name == f"processed_1.{output_format}"
+    assert list(tmp_path.iterdir()) == [path]
+    pd.testing.assert_frame_equal(
+        subject.read_result(path),
+        result,
+        check_freq=False,
+        # Text loses single precision
+        check_dtype=output_format != "csv",
+    )
+
+
+@pytest.mark.parametrize("output_format", subject.FORMATS)
+def test_read_columns(result: pd.DataFrame, tmp_path: Path, output_format: str):
+    path = subject.result_path(tmp_path, "1", output_format)
+    subject.write_result(result, path, output_format)
+
+    df = subject.read_result(path, columns=["Friction_Coefficient"])
+    assert list(df.columns) == ["Friction_Coefficient"]
+    pd.testing.assert_index_equal(df.index, result.index, exact=False)
+    assert subject.read_result(path, columns=[]).shape == (1000, 0)
+
+
+def test_failed_write_leaves_existing_file(result: pd.DataFrame, tmp_path: Path):
+    path = tmp_path / "processed_1.npz"
+    path.write_text("previous result")
+
+    with pytest.raises(ValueError):
+        subject.write_result(result, path, "xlsx")
+
+    assert path.read_text() == "previous result"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_analyse_csv_respects_overwrite(assets: Path, tmp_path: Path):
+    for name in ["substrate", "reference", "pipette"]:
+        shutil.copy(assets / f"{name}.csv", tmp_path / f"{name}_1.csv")
+    argv = "-c 1 -e 90 -r 0.009 -x 1 -t 0 -L 100 -k 0.5 -j 0.6 -a 0 -b 0 -s 1 -fr 1"
+    argv = [*argv.split(), "-f", str(tmp_path), "--no-cache", "-F", "parquet"]
+
+    def analyse(*extra: str):
+        args = cli.csv_analyser_parser().parse_args([*argv, *extra])
+        csv_analyser.analyse_csv(**cli.analyse_csv_arguments(args))
+
+    analyse()
+    written = subject.read_result(tmp_path / "processed_1.parquet")
+    assert len(written) == 10001
+
+    with pytest.raises(AssertionError):
+        analyse()
+    analyse("--overwrite")
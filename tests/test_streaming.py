@@ -0,0 +1,113 @@
+import logging
+import shutil
+
+from pathlib import Path
+
+import pandas as pd
+import phd_utils.cli as cli
+import phd_utils.csv_analyser as csv_analyser
+import phd_utils.results as results
+import phd_utils.streaming as subject
+import pytest
+
+logger = logging.getLogger(__name__)
+
+DURATION = pd.Timedelta(90, "seconds")
+RESAMPLE_TO = pd.Timedelta(0.009, "seconds")
+
+FORCE_MODEL = dict(
+    initial_x_displacement=1.5,
+    initial_substrate_tip_position=1300.0,
+    length_of_substrate=2000.0,
+    stiffness_constant_of_substrate=0.5,
+    stiffness_constant_of_pipette=0.6,
+    reverse_sliding_direction=False,
+    angle_alpha=0.1,
+    angle_beta=0.2,
+    substrate_tip_velocity=2.0,
+    flexural_rigidity=3e-12,
+)
+
+
+@pytest.fixture
+def paths(assets: Path):
+    return {
+        name: assets / f"{name}.csv" for name in ["substrate", "reference", "pipette"]
+    }
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_matches_in_memory(paths, tmp_path: Path, output_format: str):
+    merged = csv_analyser.merge_and_displace_frames(
+        **{
+            name: csv_analyser.read_displacement_csv(path)
+            for name, path in paths.items()
+        },
+        experiment_duration=DURATION,
+        duration_of_resampled_row=RESAMPLE_TO,
+    )
+    expected = csv_analyser.generate_normal_force_and_correct_for_load_positioning(
+        df=merged, **FORCE_MODEL
+    )
+
+    chunks = list(
+        subject.merge_and_displace_frames_in_chunks(
+            **paths,
+            experiment_duration=DURATION,
+            duration_of_resampled_row=RESAMPLE_TO,
+            chunk_size=2000,
+        )
+    )
+    assert len(chunks) > 1
+    pd.testing.assert_frame_equal(pd.concat(chunks), merged, check_freq=False)
+
+    output_file = tmp_path / f"processed.{output_format}"
+    subject.analyse_in_chunks(
+        **paths,
+        output_file=output_file,
+        experiment_duration=DURATION,
+        duration_of_resampled_row=RESAMPLE_TO,
+        chunk_size=2000,
+        output_format=output_format,
+        **FORCE_MODEL,
+    )
+    result = results.read_result(output_file)
+    pd.testing.assert_frame_equal(result, expected, check_freq=False)
+    assert list(tmp_path.iterdir()) == [output_file]  # No temporary files left behind
+
+
+def test_frames_going_backwards(tmp_path: Path):
+    frames = list(range(100)) + [0]
+    csv = tmp_path / "backwards.csv"
+    csv.write_text("".join(f"ID,0,0,0,1.0,2.0,0,{frame}\n" for frame in frames))
+
+    with pytest.raises(ValueError):
+        list(
+            subject.merge_and_displace_frames_in_chunks(
+                substrate=csv,
+                reference=csv,
+                pipette=csv,
+                experiment_duration=DURATION,
+                duration_of_resampled_row=RESAMPLE_TO,
+                chunk_size=10,
+            )
+        )
+
+
+@pytest.mark.parametrize("output_format", ["feather", "npz"])
+def test_rejects_formats_it_cant_stream(
+    assets: Path, tmp_path: Path, output_format: str
+):
+    for name in ["substrate", "reference", "pipette"]:
+        shutil.copy(assets / f"{name}.csv", tmp_path / f"{name}_1.csv")
+    argv = "-c 1 -e 90 -r 0.009 -x 1 -t 0 -L 100 -k 0.5 -j 0.6 -a 0 -b 0 -s 1 -fr 1"
+    argv = [*argv.split(), "-f", str(tmp_path), "--no-cache", "--chunk-size", "1000"]
+    argv += ["-F", output_format]
+
+    with pytest.raises(SystemExit):
+        cli.main("csv-analyser", [*argv, "--no-worker"])
+    # Other ways in, e.g csv-analyser-batch, are stopped before any work
+    args = cli.csv_analyser_parser().parse_args(argv)
+    with pytest.raises(AssertionError, match="--chunk-size"):
+        csv_analyser.analyse_csv(**cli.analyse_csv_arguments(args))
+    assert list(tmp_path.glob("processed_*")) == []
@@ -0,0 +1,119 @@
+import logging
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import phd_utils.csv_analyser as csv_analyser
+import phd_utils.sweep as subject
+import pytest
+
+logger = logging.getLogger(__name__)
+
+CONSTANTS = dict(
+    initial_x_displacement=1.5,
+    initial_substrate_tip_position=1300.0,
+    length_of_substrate=2000.0,
+    stiffness_constant_of_substrate=0.5,
+    stiffness_constant_of_pipette=0.6,
+    angle_alpha=0.1,
+    angle_beta=0.2,
+    substrate_tip_velocity=2.0,
+    flexural_rigidity=3e-12,
+)
+
+
+@pytest.fixture
+def merged(assets: Path):
+    return csv_analyser.read_and_merge(
+        substrate_path=assets / "substrate.csv",
+        reference_path=assets / "reference.csv",
+        pipette_path=assets / "pipette.csv",
+        experiment_duration=90,
+        resample_to=0.009,
+    )
+
+
+@pytest.fixture
+def parameters():
+    return subject.parameter_grid(
+        constants=CONSTANTS,
+        varied={
+            "angle_alpha": [0.0, 0.1],
+            "angle_beta": [0.0, 0.2, 0.4],
+            "substrate_tip_velocity": [1.0, 2.0],
+        },
+    )
+
+
+@pytest.mark.parametrize("reverse_sliding_direction", [False, True])
+def test_matches_force_model(merged, parameters, reverse_sliding_direction):
+    values = subject.evaluate_force_model(
+        df=merged,
+        parameters=parameters,
+        reverse_sliding_direction=reverse_sliding_direction,
+    )
+    assert values.shape == (12, len(merged), len(subject.METRICS))
+
+    for i, row in parameters.iterrows():
+        expected = csv_analyser.generate_normal_force_and_correct_for_load_positioning(
+            df=merged,
+            reverse_sliding_direction=reverse_sliding_direction,
+            **row.to_dict(),
+        )
+        np.testing.assert_allclose(
+            values[i], expected[list(subject.METRICS)].to_numpy(), rtol=1e-12
+        )
+
+
+def test_write_and_load(merged, parameters, tmp_path: Path):
+    subject.write_sweep(
+        directory=tmp_path,
+        df=merged,
+        parameters=parameters,
+        reverse_sliding_direction=False,
+        sets_per_chunk=5,  # Doesn't divide evenly
+    )
+    values, loaded_parameters, instants = subject.load_sweep(tmp_path)
+
+    expected = subject.evaluate_force_model(
+        df=merged, parameters=parameters, reverse_sliding_direction=False
+    )
+    np.testing.assert_array_equal(values, expected)
+    pd.testing.assert_frame_equal(loaded_parameters, parameters)
+    pd.testing.assert_index_equal(instants, merged.index, exact=False)
+
+    tidy = subject.tidy(values[:2], loaded_parameters.iloc[:2], instants)
+    assert len(tidy) == 2 * len(merged)
+    assert (tidy.xs(1, level="Set")["angle_beta"] == parameters["angle_beta"][1]).all()
+
+
+def test_one_row(merged, parameters):
+    # As read back from the cache, which doesn't know its frequency
+    row = merged.iloc[[0]].set_axis(pd.TimedeltaIndex([0], name="Instant"))
+    values = subject.evaluate_force_model(
+        df=row, parameters=parameters, reverse_sliding_direction=False
+    )
+    expected = csv_analyser.generate_normal_force_and_correct_for_load_positioning(
+        df=row, reverse_sliding_direction=False, **parameters.iloc[0].to_dict()
+    )
+    np.testing.assert_allclose(values[0], expected[list(subject.METRICS)].to_numpy())
+
+
+@pytest.mark.parametrize("mistake", ["parameters", "overwrite"])
+def test_main_checks_before_merging(tmp_path: Path, monkeypatch, mistake: str):
+    def read_and_merge(**kwargs):
+        raise AssertionError("Shouldn't have got this far")
+
+    monkeypatch.setattr(csv_analyser, "read_and_merge", read_and_merge)
+    argv = "-c 1 -e 90 -r 0.009 -x 1 -t 0 -L 100 -k 0.5 -j 0.6 -a 0 -b 0 -s 1 -fr 1"
+    argv = ["csv-analyser-sweep", *argv.split(), "-f", str(tmp_path)]
+    if mistake == "parameters":
+        (tmp_path / "parameters.csv").write_text("angle-beta,angle-gamma\n0,0\n")
+        argv += ["--parameters", str(tmp_path / "parameters.csv")]
+    else:
+        (tmp_path / "sweep_1").mkdir()
+    monkeypatch.setattr("sys.argv", argv)
+
+    with pytest.raises(SystemExit):
+        subject.main()
@@ -0,0 +1,238 @@
+import importlib.util
+import logging
+import struct
+
+from pathlib import Path
+
+import phd_utils.tiff as subject
+import pytest
+
+logger = logging.getLogger(__name__)
+
+
+def uncompressed(
+    width: int, height: int, pixels: bytes, byte_order: str = "<"
+) -> bytes:
+    """A greyscale TIFF with one strip, and its IFD at the end"""
+    entries = [
+        (256, subject.SHORT, 1, width),
+        (257, subject.SHORT, 1, height),
+        (258, subject.SHORT, 1, 8),
+        (259, subject.SHORT, 1, 1),
+        (262, subject.SHORT, 1, 1),
+        (subject.STRIP_OFFSETS, subject.LONG, 1, 8),
+        (277, subject.SHORT, 1, 1),
+        (278, subject.SHORT, 1, height),
+        (subject.STRIP_BYTE_COUNTS, subject.LONG, 1, len(pixels)),
+    ]
+    ifd = 8 + len(pixels) + len(pixels) % 2
+    header = (b"II" if byte_order == "<" else b"MM") + struct.pack(
+        f"{byte_order}HI", 42, ifd
+    )
+    table = struct.pack(f"{byte_order}H", len(entries))
+    for tag, type, count, value in entries:
+        code = "HH" if type == subject.SHORT else "I"
+        values = (value, 0) if type == subject.SHORT else (value,)
+        table += struct.pack(f"{byte_order}HHI{code}", tag, type, count, *values)
+    return header + pixels + b"\0" * (len(pixels) % 2) + table + bytes(4)
+
+
+def test_stack_uncompressed(tmp_path: Path):
+    sources = []
+    for i in range(3):
+        source = tmp_path / f"{i}.tif"
+        source.write_bytes(uncompressed(3, 3, bytes(range(i, i + 9))))
+        sources.append(source)
+
+    destination = tmp_path / "stack.tif"
+    assert subject.stack(sources, destination) == 3
+
+    stacked = destination.read_bytes()
+    pages = list(subject.read_pages(stacked))
+    assert [subject.decode(stacked, page) for page in pages] == [
+        bytes(range(i, i + 9)) for i in range(3)
+    ]
+    assert [page.values(subject.PAGE_NUMBER) for page in pages] == [
+        (0, 3),
+        (1, 3),
+        (2, 3),
+    ]
+    # Only whole stacks are left behind
+    assert list(tmp_path.glob(".*")) == []
+
+
+def test_stack_keeps_big_endian(tmp_path: Path):
+    source = tmp_path / "big.tif"
+    source.write_bytes(uncompressed(2, 2, b"\1\2\3\4", byte_order=">"))
+    destination = tmp_path / "stack.tif"
+    subject.stack([source, source], destination)
+
+    stacked = destination.read_bytes()
+    assert stacked[:2] == b"MM"
+    assert [subject.decode(stacked, page) for page in subject.read_pages(stacked)] == [
+        b"\1\2\3\4"
+    ] * 2
+
+
+def test_stack_rejects_mixed_byte_orders(tmp_path: Path):
+    little, big = tmp_path / "little.tif", tmp_path / "big.tif"
+    little.write_bytes(uncompressed(2, 2, b"\1\2\3\4"))
+    big.write_bytes(uncompressed(2, 2, b"\1\2\3\4", byte_order=">"))
+    destination = tmp_path / "stack.tif"
+    with pytest.raises(ValueError, match="byte order"):
+        subject.stack([little, big], destination)
+    assert not destination.exists()
+
+
+def test_stack_drops_exif(assets: Path, tmp_path: Path):
+    source = assets / "single0.tif"
+    (page,) = subject.read_pages(source.read_bytes())
+    assert 34665 in page.entries
+
+    destination = tmp_path / "stack.tif"
+    subject.stack([source], destination)
+    (stacked,) = subject.read_pages(destination.read_bytes())
+    assert 34665 not in stacked.entries
+    assert {
+        tag: entry
+        for tag, entry in stacked.entries.items()
+        if tag not in (273, 254, 297)
+    } == {
+        tag: entry
+        for tag, entry in page.entries.items()
+        if tag not in (273, 254, 297, 34665)
+    }
+
+
+def test_not_a_tiff(tmp_path: Path):
+    with pytest.raises(ValueError, match="isn't a TIFF"):
+        list(subject.read_pages(b"GIF89a"))
+
+
+def test_verify(tmp_path: Path):
+    sources = []
+    for i in range(3):
+        source = tmp_path / f"{i}.tif"
+        source.write_bytes(uncompressed(3, 3, bytes(range(i, i + 9))))
+        sources.append(source)
+    destination = tmp_path / "stack.tif"
+    descriptions = []
+    subject.stack(sources, destination, descriptions)
+    assert descriptions == [(3, 3, (8,))] * 3
+
+    assert subject.verify(sources, destination, compare_data=True) == 3
+    # Without reading the sources again
+    assert subject.verify([], destination, descriptions=descriptions) == 3
+    with pytest.raises(ValueError, match="more pages"):
+        subject.verify([], destination, descriptions=descriptions[:2])
+    with pytest.raises(ValueError, match="more pages"):
+        subject.verify(sources[:2], destination)
+    with pytest.raises(ValueError, match="ends before"):
+        subject.verify(sources + sources[:1], destination)
+
+    # A different size
+    sources[1].write_bytes(uncompressed(9, 1, bytes(range(1, 10))))
+    with pytest.raises(ValueError, match="Page 1 .* is \\(3, 3, \\(8,\\)\\)"):
+        subject.verify(sources, destination)
+
+    # Different data, which only the checksums notice
+    sources[1].write_bytes(uncompressed(3, 3, bytes(9)))
+    assert subject.verify(sources, destination) == 3
+    with pytest.raises(ValueError, match="different data"):
+        subject.verify(sources, destination, compare_data=True)
+
+
+def test_cut_short(tmp_path: Path):
+    whole = uncompressed(3, 3, bytes(9))
+    with pytest.raises(ValueError, match="cut short"):
+        list(subject.read_pages(whole[:-10]))
+
+
+def test_stack_big(tmp_path: Path, monkeypatch):
+    sources = []
+    for i in range(3):
+        source = tmp_path / f"{i}.tif"
+        source.write_bytes(uncompressed(3, 3, bytes(range(i, i + 9))))
+        sources.append(source)
+
+    def check(destination: Path):
+        stacked = destination.read_bytes()
+        assert stacked[:4] == b"II\x2b\0"
+        pages = list(subject.read_pages(stacked))
+        assert [subject.decode(stacked, page) for page in pages] == [
+            bytes(range(i, i + 9)) for i in range(3)
+        ]
+        assert [page.values(subject.PAGE_NUMBER) for page in pages] == [
+            (0, 3),
+            (1, 3),
+            (2, 3),
+        ]
+        assert subject.verify(sources, destination, compare_data=True) == 3
+
+    subject.stack(sources, tmp_path / "big.tif", big=True)
+    check(tmp_path / "big.tif")
+
+    # Too big for a classic TIFF, but only found out part way through writing it
+    size = sum(source.stat().st_size for source in sources)
+    monkeypatch.setattr(subject, "MAX_OFFSET", size + 20)
+    assert not subject.needs_big(sources)
+    descriptions = []
+    assert subject.stack(sources, tmp_path / "auto.tif", descriptions) == 3
+    check(tmp_path / "auto.tif")
+    assert len(descriptions) == 3
+
+
+def test_stack_compressed(assets: Path, tmp_path: Path):
+    sources = []
+    for i in range(5):
+        source = tmp_path / f"{i}.tif"
+        # Mostly dark
+        source.write_bytes(uncompressed(64, 64, bytes(4000) + bytes(range(i, i + 96))))
+        sources.append(source)
+    # Already compressed, with LZW
+    sources.append(assets / "single0.tif")
+
+    destination = tmp_path / "stack.tif"
+    assert subject.stack(sources, destination, compression="deflate", threads=3) == 6
+
+    stacked = destination.read_bytes()
+    pages = list(subject.read_pages(stacked))
+    assert [page.values(subject.COMPRESSION) for page in pages] == [(8,)] * 5 + [(5,)]
+    for page, source in zip(pages, sources):
+        original = source.read_bytes()
+        (original_page,) = subject.read_pages(original)
+        assert subject.decode(stacked, page) == subject.decode(original, original_page)
+    assert subject.verify(sources, destination, compare_data=True) == 6
+    # The dark pages, 4 kB each, are a fraction of that compressed
+    assert destination.stat().st_size < sources[-1].stat().st_size + 5 * 1000
+
+
+def test_stack_zstd(tmp_path: Path):
+    source = tmp_path / "source.tif"
+    source.write_bytes(uncompressed(16, 16, bytes(256)))
+    destination = tmp_path / "stack.tif"
+    if importlib.util.find_spec("zstandard") is None:
+        with pytest.raises(ValueError, match="zstandard"):
+            subject.stack([source], destination, compression="zstd")
+        return
+    subject.stack([source], destination, compression="zstd", level=3)
+    stacked = destination.read_bytes()
+    (page,) = subject.read_pages(stacked)
+    assert page.values(subject.COMPRESSION) == (50000,)
+    assert subject.decode(stacked, page) == bytes(256)
+
+
+def test_stack_too_many_pages(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(subject, "MAX_PAGES", 2)
+    source = tmp_path / "single.tif"
+    source.write_bytes(uncompressed(2, 2, b"\1\2\3\4"))
+    destination = tmp_path / "stack.tif"
+    with pytest.raises(ValueError, match="at most 2 pages"):
+        subject.stack([source] * 3, destination)
+
+    # Only found out once a multi-page source is read
+    subject.stack([source] * 2, tmp_path / "double.tif")
+    with pytest.raises(ValueError, match="over 2 pages"):
+        subject.stack([source, tmp_path / "double.tif"], destination)
+    assert not destination.exists()
+    assert list(tmp_path.glob(".*")) == []
@@ -4,8 +4,10 @@ import shutil
 import sys
 
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, List
 
+import phd_utils.cli as cli
+import phd_utils.tiff as tiff
 import phd_utils.tiff_stacker as subject
 import pytest
 
@@ -40,13 +42,251 @@ def test_stack_tifs(
 ):
     destination = tmp_path / "stacked.tif"
     subject.stack_tifs(
-        sources=single_images, destination=destination, imagemagick_stderr=sys.stdout
+        sources=single_images,
+        destination=destination,
+        imagemagick_stderr=sys.stdout,
+        engine="imagemagick",
     )
     assert filecmp.cmp(correctly_stacked, destination, shallow=False)
 
 
-def test_stack_in_folders(experiment_folder: Path):
+def test_stack_tifs_natively(
+    single_images: Iterable[Path], correctly_stacked: Path, tmp_path: Path
+):
+    destination = tmp_path / "stacked.tif"
+    subject.stack_tifs(
+        sources=single_images, destination=destination, imagemagick_stderr=sys.stdout
+    )
+
+    stacked = destination.read_bytes()
+    expected = correctly_stacked.read_bytes()
+    pages = list(tiff.read_pages(stacked))
+    expected_pages = list(tiff.read_pages(expected))
+    assert len(pages) == len(expected_pages) == len(single_images)
+    for page, expected_page, single in zip(pages, expected_pages, single_images):
+        # ImageMagick noticed that our RGB frames are grey, and stored one channel instead of three
+        pixels = tiff.decode(stacked, page)
+        grey = tiff.decode(expected, expected_page)
+        assert pixels[0::3] == pixels[1::3] == pixels[2::3] == grey
+        # Copied without being decoded
+        single = single.read_bytes()
+        (single_page,) = tiff.read_pages(single)
+        assert [stacked[o : o + n] for o, n in page.data] == [
+            single[o : o + n] for o, n in single_page.data
+        ]
+
+
+@pytest.mark.parametrize("engine", ["native", "imagemagick"])
+def test_stack_in_folders(experiment_folder: Path, engine: str):
+    subject.stack_in_folders(
+        [experiment_folder],
+        files_per_stack=2,
+        imagemagick_stderr=sys.stdout,
+        engine=engine,
+    )
+    assert len(list(experiment_folder.glob("*.tif"))) == 3
+    assert (experiment_folder / subject.JOURNAL_NAME).is_file()
+
+
+def copy_folders(single_images: Iterable[Path], root: Path) -> List[Path]:
+    """Two experiments, the second with a sub-folder (which its stacks include), and a third inside the first"""
+    folders = [root / "a", root / "b", root / "a" / "c"]
+    for i, folder in enumerate(folders):
+        (folder / "sub").mkdir(parents=True)
+        for image in single_images:
+            shutil.copy(image, folder / f"{i}{image.name}")
+            if folder.name == "b":
+                shutil.copy(image, folder / "sub" / image.name)
+    return folders
+
+
+def test_stack_in_folders_in_parallel(single_images: Iterable[Path], tmp_path: Path):
+    serial = copy_folders(single_images, tmp_path / "serial")
+    parallel = copy_folders(single_images, tmp_path / "parallel")
+    subject.stack_in_folders(serial, files_per_stack=2, imagemagick_stderr=sys.stdout)
+    subject.stack_in_folders(
+        parallel, files_per_stack=2, imagemagick_stderr=sys.stdout, jobs=4
+    )
+
+    def contents(root: Path):
+        return {
+            path.relative_to(root).as_posix(): path.read_bytes()
+            for path in root.glob("**/*")
+            if path.is_file() and path.name != subject.JOURNAL_NAME
+        }
+
+    expected = contents(tmp_path / "serial")
+    assert contents(tmp_path / "parallel") == expected
+    assert "b/stack5.tif" in expected
+    assert not any(name.endswith("single0.tif") for name in expected)
+
+
+def test_failed_stack_keeps_originals(experiment_folder: Path):
+    (experiment_folder / "single2.tif").write_bytes(b"not a tiff")
+    with pytest.raises(ValueError):
+        subject.stack_in_folders(
+            [experiment_folder],
+            files_per_stack=2,
+            imagemagick_stderr=sys.stdout,
+            jobs=3,
+        )
+    assert (experiment_folder / "single2.tif").exists()
+    assert (experiment_folder / "single3.tif").exists()
+
+
+def test_resume_after_failure(
+    single_images: Iterable[Path], tmp_path: Path, monkeypatch
+):
+    (uninterrupted,) = copy_folders(single_images, tmp_path / "uninterrupted")[1:2]
+    (interrupted,) = copy_folders(single_images, tmp_path / "interrupted")[1:2]
+    subject.stack_in_folders(
+        [uninterrupted], files_per_stack=2, imagemagick_stderr=sys.stdout
+    )
+
+    stack_tifs = subject.stack_tifs
+    built = []
+
+    def crash_on_second_stack(sources, destination, **kwargs):
+        built.append(destination.name)
+        if len(built) == 2:
+            raise KeyboardInterrupt
+        stack_tifs(sources, destination, **kwargs)
+
+    monkeypatch.setattr(subject, "stack_tifs", crash_on_second_stack)
+    with pytest.raises(KeyboardInterrupt):
+        subject.stack_in_folders(
+            [interrupted], files_per_stack=2, imagemagick_stderr=sys.stdout
+        )
+    assert not (interrupted / "stack1.tif").exists()
+
+    subject.stack_in_folders(
+        [interrupted], files_per_stack=2, imagemagick_stderr=sys.stdout
+    )
+    # Carried on from the stack that failed, rather than starting again
+    assert built == [f"stack{i}.tif" for i in [0, 1, 1, 2, 3, 4, 5]]
+
+    def contents(folder: Path):
+        return {
+            path.relative_to(folder).as_posix(): path.read_bytes()
+            for path in folder.glob("**/*")
+            if path.is_file() and path.name != subject.JOURNAL_NAME
+        }
+
+    assert contents(interrupted) == contents(uninterrupted)
+
+    # Once finished, running again doesn't stack the stacks
+    subject.stack_in_folders(
+        [interrupted], files_per_stack=2, imagemagick_stderr=sys.stdout
+    )
+    assert len(built) == 7
+    assert contents(interrupted) == contents(uninterrupted)
+
+
+def test_resume_after_failure_to_delete(experiment_folder: Path, monkeypatch):
+    unlink = Path.unlink
+
+    def crash_on_delete(path: Path, missing_ok=False):
+        if path.name == "single3.tif":
+            raise PermissionError(path)
+        unlink(path, missing_ok=missing_ok)
+
+    monkeypatch.setattr(Path, "unlink", crash_on_delete)
+    with pytest.raises(PermissionError):
+        subject.stack_in_folders(
+            [experiment_folder], files_per_stack=2, imagemagick_stderr=sys.stdout
+        )
+    journal = subject.read_journal(experiment_folder)
+    assert journal.stacked == {"stack0.tif", "stack1.tif"}
+    assert journal.deleted == {"stack0.tif"}
+    stack1 = (experiment_folder / "stack1.tif").stat()
+
+    monkeypatch.setattr(Path, "unlink", unlink)
+    subject.stack_in_folders(
+        [experiment_folder], files_per_stack=2, imagemagick_stderr=sys.stdout
+    )
+    # Not made again
+    assert (experiment_folder / "stack1.tif").stat().st_mtime_ns == stack1.st_mtime_ns
+    assert sorted(path.name for path in experiment_folder.glob("*.tif")) == [
+        "stack0.tif",
+        "stack1.tif",
+        "stack2.tif",
+    ]
+
+
+@pytest.mark.parametrize("checksums", [False, True])
+def test_bad_stack_keeps_originals(
+    experiment_folder: Path, monkeypatch, checksums: bool
+):
+    stack = tiff.stack
+
+    def bad_stack(sources, destination, descriptions):
+        stack(sources, destination, descriptions)
+        # Then something goes wrong writing it
+        if checksums:
+            # The right number of pages, but the data is from the wrong file, which only the checksums notice
+            stack([sources[1]] * len(sources), destination)
+        else:
+            stack(sources[:-1], destination)
+
+    monkeypatch.setattr(tiff, "stack", bad_stack)
+    with pytest.raises(ValueError):
+        subject.stack_in_folders(
+            [experiment_folder],
+            files_per_stack=2,
+            imagemagick_stderr=sys.stdout,
+            checksums=checksums,
+        )
+    assert (experiment_folder / "single0.tif").exists()
+    assert (experiment_folder / "single1.tif").exists()
+
+    # The next run makes it again
+    monkeypatch.setattr(tiff, "stack", stack)
     subject.stack_in_folders(
         [experiment_folder], files_per_stack=2, imagemagick_stderr=sys.stdout
     )
-    assert len(list(experiment_folder.iterdir())) == 3
+    assert sorted(path.name for path in experiment_folder.glob("*.tif")) == [
+        "stack0.tif",
+        "stack1.tif",
+        "stack2.tif",
+    ]
+
+
+def test_stack_by_size(experiment_folder: Path):
+    # The images are 66 to 88 kB, so two fit in each stack
+    subject.stack_in_folders(
+        [experiment_folder],
+        files_per_stack=100,
+        imagemagick_stderr=sys.stdout,
+        bytes_per_stack=170_000,
+    )
+    assert [
+        tiff.count_pages(experiment_folder / f"stack{i}.tif") for i in range(3)
+    ] == [2, 2, 2]
+    assert not (experiment_folder / "stack3.tif").exists()
+
+
+def test_stack_by_size_page_cap(experiment_folder: Path, monkeypatch):
+    # Every image fits in the bytes, but not in the pages
+    monkeypatch.setattr(tiff, "MAX_PAGES", 4)
+    subject.stack_in_folders(
+        [experiment_folder],
+        files_per_stack=4,
+        imagemagick_stderr=sys.stdout,
+        bytes_per_stack=10 ** 9,
+    )
+    assert [
+        tiff.count_pages(experiment_folder / f"stack{i}.tif") for i in range(2)
+    ] == [4, 2]
+
+    with pytest.raises(AssertionError, match="between 1 and 4 files"):
+        subject.stack_in_folders(
+            [experiment_folder], files_per_stack=5, imagemagick_stderr=sys.stdout
+        )
+
+
+@pytest.mark.parametrize(
+    "options", [["--rolling-window", "1"], ["--slip-rate", "1", "0.5"], ["--preview"]]
+)
+def test_parser_rejects_csv_analyser_options(options: List[str]):
+    with pytest.raises(SystemExit):
+        cli.tiff_stacker_parser().parse_args(["folder", *options])
@@ -13,7 +13,23 @@ def test_grouper():
     assert grouped == [[1, 2], [3]]
 
 
+def test_size_grouper():
+    sizes = [("a", 3), ("b", 4), ("c", 3), ("d", 11), ("e", 1), ("f", 9)]
+
+    grouped = list(subject.size_grouper(iterable=sizes, group_size=10))
+
+    assert grouped == [["a", "b", "c"], ["d"], ["e", "f"]]
+
+
 def test_pformat():
     l = [str(i) * 50 for i in range(1000)]
 
     assert len(subject.pformat(l).splitlines()) == 10
+
+
+def test_size_grouper_max_items():
+    sizes = [(str(i), 1) for i in range(5)]
+
+    grouped = list(subject.size_grouper(iterable=sizes, group_size=10, max_items=2))
+
+    assert grouped == [["0", "1"], ["2", "3"], ["4"]]
@@ -0,0 +1,93 @@
+import logging
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from pathlib import Path
+
+import phd_utils.results as results
+import phd_utils.worker as subject
+import pytest
+
+logger = logging.getLogger(__name__)
+
+ARGUMENTS = [
+    *("-c", "1"),
+    *("-e", "90"),
+    *("-r", "0.009"),
+    *("-x", "1.5"),
+    *("-t", "1300"),
+    *("-L", "2000"),
+    *("-k", "0.5"),
+    *("-j", "0.6"),
+    *("-a", "0.1"),
+    *("-b", "0.2"),
+    *("-s", "2"),
+    *("-fr", "3e-12"),
+    "--no-cache",
+]
+
+
+@pytest.fixture
+def experiment(assets: Path, tmp_path: Path) -> Path:
+    folder = tmp_path / "experiment"
+    folder.mkdir()
+    for name in ["substrate", "reference", "pipette"]:
+        shutil.copy(assets / f"{name}.csv", folder / f"{name}_1.csv")
+    return folder
+
+
+@pytest.fixture
+def socket_path(tmp_path: Path):
+    path = tmp_path / "worker.sock"
+    thread = threading.Thread(target=subject.serve, args=(path,), daemon=True)
+    thread.start()
+    while not path.exists():
+        time.sleep(0.01)
+    yield path
+    subject.submit("stop", [], socket_path=path)
+    thread.join()
+    assert not path.exists()
+
+
+def test_no_worker(tmp_path: Path):
+    assert subject.submit("csv-analyser", [], socket_path=tmp_path / "none") is None
+
+
+def test_submit(socket_path: Path, experiment: Path, monkeypatch, capsys):
+    # Relative to the client's working directory, not the worker's
+    monkeypatch.chdir(experiment.parent)
+    exit_code = subject.submit(
+        "csv-analyser", [*ARGUMENTS, "-f", experiment.name], socket_path=socket_path
+    )
+
+    assert exit_code == 0
+    assert (experiment / "processed_1.csv").is_file()
+    assert "Wrote" in capsys.readouterr().err
+
+    # Failures are reported, and don't stop the worker
+    assert subject.submit("csv-analyser", [*ARGUMENTS], socket_path=socket_path) == 1
+    assert "AssertionError" in capsys.readouterr().err
+    assert (
+        subject.submit(
+            "csv-analyser",
+            [*ARGUMENTS, "-f", experiment.name, "-O", "-F", "npz"],
+            socket_path=socket_path,
+        )
+        == 0
+    )
+    assert len(results.read_result(experiment / "processed_1.npz")) > 0
+
+
+def test_command_line_starts_without_pandas():
+    # Nothing heavy is imported until the arguments have been parsed
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, phd_utils.cli as cli; cli.csv_analyser_parser(); cli.tiff_stacker_parser(); assert 'pandas' not in sys.modules and 'numpy' not in sys.modules",
+        ],
+        check=True,
+    )